@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Purpose:
+# Measures the memory needed to keep N volumes in memory, comparing the slotted GVolume
+# with an equivalent class that stores the same fields in a per-instance __dict__.
+#
+# Usage, from the sci-g directory:
+#   ./benchmarks/memory_benchmark.py                     (default: 10^5 and 10^6 volumes)
+#   ./benchmarks/memory_benchmark.py -n 1000 100000
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gemc_api_geometry import GVolume
+
+
+# same fields and methods as GVolume, stored in __dict__
+class DictGVolume:
+    __init__ = GVolume.__init__
+    make_tube = GVolume.make_tube
+    set_position = GVolume.set_position
+    set_identifier = GVolume.set_identifier
+
+
+# builds n fibers like the bcal example and returns the memory they use, in bytes
+def volumes_memory(volume_class, n):
+    tracemalloc.start()
+    volumes = []
+    for i in range(n):
+        gvolume = volume_class(f'core_{i}')
+        gvolume.mother = 'lead_box'
+        gvolume.make_tube(0, 0.046, 1.99, 0, 360, 'cm')
+        gvolume.set_position(i % 100, i // 100, 0, 'cm')
+        gvolume.material = 'core'
+        gvolume.color = 'FFFFFF'
+        gvolume.set_identifier('fiber', i)
+        volumes.append(gvolume)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def main():
+    desc_str = "   Memory used by GVolume with and without __slots__\n"
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('-n', metavar='nvolumes', type=int, nargs='*', default=[100000, 1000000],
+                        help='number of volumes to build')
+    args = parser.parse_args()
+
+    print()
+    print(f'  {"volumes":>10} {"__dict__ [MB]":>15} {"__slots__ [MB]":>15} {"saving":>8}')
+    for n in args.n:
+        dict_memory = volumes_memory(DictGVolume, n)
+        slots_memory = volumes_memory(GVolume, n)
+        saving = 1 - slots_memory / dict_memory
+        print(f'  {n:>10} {dict_memory / 1e6:>15.1f} {slots_memory / 1e6:>15.1f} {saving:>8.0%}')
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -24,27 +24,28 @@ def build_geometry(configuration):
 	gvolume.publish(configuration)
 
 
-	# now build the bars
-	for i in range(NBARS):
-
-		theta_pl  = (i * theta0) * 3.1415926 / 180.
-		theta_rot = (i * theta0 + 90)
-
-		R = RMIN + dz
-
-		x = R * cos(theta_pl)
-		y = R * sin(theta_pl)
-		z = 0
-
-		gvolume = GVolume(f'bar_{i}')
-		gvolume.description = f'Scintillator bar_{i}'
-		gvolume.mother = 'tof'
-		gvolume.make_trapezoid(dx1, dx2, dy, dy, dz, 'cm')
-		gvolume.set_position(x, y, z, 'cm')
-		gvolume.set_rotation(90, theta_rot, 0, 'deg')
-		gvolume.material = 'G4_POLYSTYRENE'
-		gvolume.color = '66aaaa0'
-		gvolume.digitization = 'flux'
-		gvolume.set_identifier('bar_id', i+1)
-		gvolume.publish(configuration)
-
+	# now build the bars, all at once: one copy of the bar for each position and rotation
+	i = range(NBARS)
+
+	theta_pl  = [(n * theta0) * 3.1415926 / 180. for n in i]
+	theta_rot = [(n * theta0 + 90) for n in i]
+
+	R = RMIN + dz
+
+	x = [R * cos(theta) for theta in theta_pl]
+	y = [R * sin(theta) for theta in theta_pl]
+	z = 0
+
+	names = [f'bar_{n}' for n in i]
+
+	gvolume = GVolume('bar')
+	gvolume.mother = 'tof'
+	gvolume.make_trapezoid(dx1, dx2, dy, dy, dz, 'cm')
+	gvolume.material = 'G4_POLYSTYRENE'
+	gvolume.color = '66aaaa0'
+	gvolume.digitization = 'flux'
+	gvolume.publish_copies(configuration, names,
+	                       positions=(x, y, z), rotations=(90, theta_rot, 0),
+	                       identifiers=('bar_id', [n + 1 for n in i]),
+	                       lunit='cm', runit='deg',
+	                       descriptions=[f'Scintillator {name}' for name in names])
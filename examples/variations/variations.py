@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from gemc_api_utils import GConfiguration
+from gemc_api_utils import GConfiguration, build_variations
 from geometry import build_geometry
 from materials import build_materials
 
@@ -9,16 +9,21 @@ VARIATIONS = {
     "lead_target",
 }
 
-for variation in VARIATIONS:
+def build_variation(variation, runno):
     # Define GConfiguration: use TEXT factory.
     # Initialize geometry and materials files.
     txt_config = GConfiguration("variations", "TEXT", "The variations system")
     txt_config.setVariation(variation)
+    txt_config.setRunNo(runno)
     txt_config.init_geom_file()
     txt_config.init_mats_file()
 
-    # build geometry, materials and print out the GConfiguration
+    # build geometry and materials
     build_geometry(txt_config)
     build_materials(txt_config)
-    txt_config.printC()
+    return txt_config
 
+
+if __name__ == "__main__":
+    # the variations are independent: they are built in parallel, then a summary is printed
+    build_variations(build_variation, VARIATIONS)
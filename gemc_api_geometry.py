@@ -74,17 +74,91 @@
 #           This value can also be accessed in the jcard modifiers. Default is "1".
 #
 # - description		- A description of the volume. Default is "no description"
+#
+# The GVolumeTable class holds many copies of the same volume, for example the fibers of a calorimeter.
+# The fields shared by all copies are kept once, in a GVolume, while the names, positions, rotations and identifiers
+# of the copies are stored in NumPy arrays. Its "publish" function writes all the copies, without creating a GVolume
+# for each one.
 import sys
+import copy
+import functools
+import itertools
+import json
+import sqlite3
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 WILLBESET = 'notSetYet'  # for mandatory fields. Used in function check_validity
 NOTAPPLICABLE = 'na'  # for optionals fields
 DEFAULTMOTHER = 'root'
 DEFAULTCOLOR = '778899'
 
-from scig_sql import populate_sqlite_geometry
+from gemc_api_units import unit_factor
+from gemc_api_rotations import rotation_matrix, collapsed_rotation_string
+from gemc_api_system import SYSTEM_FIELDS, PUBLISHED_FIELDS
+
+# the TEXT factory line of the PUBLISHED_FIELDS values
+PUBLISHED_TEXT_TEMPLATE = ' ' + ' | '.join(['{}'] * len(PUBLISHED_FIELDS)) + ' |\n'
+
+
+# GSolidParameters class definition
+# The parameters of a solid built with the GVolume make_* functions: the numeric values, and the unit of each value
+# (None for the values without unit, like the number of planes of a polycone).
+# The gemc parameters string is formatted only when the volume is published, with str(), each value with str().
+# Identical parameters (same value strings and units) share the same string: see format_solid_parameters.
+class GSolidParameters:
+    __slots__ = ('values', 'units', 'template')
+
+    def __init__(self, values, units, template=None):
+        self.values = tuple(values)
+        self.units = tuple(units)
+        # the string template, with one {} field for each value. By default the values are comma separated
+        if template is None:
+            template = solid_parameters_template(self.units)
+        self.template = template
+
+    def __str__(self):
+        return format_solid_parameters(self.template, tuple(map(str, self.values)))
+
+    # the values in the canonical units: mm, rad
+    def canonical_values(self):
+        return tuple(value * unit_factor(unit) for value, unit in zip(self.values, self.units))
+
+    def __repr__(self):
+        return f'GSolidParameters({self.values}, {self.units})'
+
+    # SQLITE factory: the parameters are stored as their string
+    def __conform__(self, protocol):
+        if protocol is sqlite3.PrepareProtocol:
+            return str(self)
+
+
+# '{}*mm, {}*mm, {}*mm' for units ('mm', 'mm', 'mm')
+@functools.lru_cache(maxsize=None)
+def solid_parameters_template(units):
+    return ', '.join('{}*' + escape_braces(unit) if unit is not None else '{}' for unit in units)
+
+
+# The values are already converted with str(), as the gemc parameters strings have always been: the cache is keyed on
+# these strings, so that the output does not depend on the value types (numpy scalars, 0.0 and -0.0) or call order.
+@functools.lru_cache(maxsize=65536)
+def format_solid_parameters(template, value_strings):
+    return template.format(*value_strings)
 
 # GVolume class definition
+# The fields are __slots__, to keep systems of many volumes small: only the fields below can be assigned.
 class GVolume:
+    __slots__ = ('name', 'solid', 'parameters', 'material',
+                 'mother', 'position', 'rotations', 'mfield',
+                 'visible', 'style', 'color',
+                 'digitization', 'identifier',
+                 'copyOf', 'replicaOf', 'solidsOpr',
+                 'mirror',
+                 'exist', 'description')
+
     def __init__(self, name):
         # mandatory fields. Checked at publish time
         self.name = name
@@ -143,6 +217,24 @@ class GVolume:
             rotation_string = rotation_string + r
         return rotation_string
 
+    # the 3x3 matrix of the rotations chain, as given to the geant4 G4PVPlacement. See gemc_api_rotations
+    def get_rotation_matrix(self):
+        return rotation_matrix(self.get_rotation_string())
+
+    # the rotations chain as a single "x, y, z" rotation with the same matrix
+    def get_collapsed_rotation_string(self):
+        return collapsed_rotation_string(self.get_rotation_string())
+
+    # the rotations string written by publish: the collapsed rotation if configuration.collapseRotations is set
+    def get_published_rotation_string(self, configuration):
+        if configuration.collapseRotations:
+            return self.get_collapsed_rotation_string()
+        return self.get_rotation_string()
+
+    # the parameters are a GSolidParameters when built with the make_* functions, or a string
+    def get_parameters_string(self):
+        return str(self.parameters)
+
     def check_validity(self):
         # need to add checking if it's operation instead
         if self.solid == WILLBESET:
@@ -168,39 +260,122 @@ class GVolume:
 
         self.identifier = myidentifiers
 
+    def publish_copies(self, configuration, names, positions=None, rotations=None, identifiers=(),
+                       lunit='mm', runit='deg', order='', descriptions=None):
+        """
+        publish_copies(configuration, names, positions=None, rotations=None, identifiers=(), lunit='mm', runit='deg', order='', descriptions=None)
+
+        Publishes n copies of this volume at once, with a GVolumeTable. The output is the same as setting
+        the name, position, rotation and identifier of this volume and publishing it, once for each copy.
+
+        Parameters
+        ----------
+
+        configuration: the GConfiguration the copies are published to
+        names: list of n names, or a string: the copies are then named <names><index>, with index 0 to n-1
+        positions: (n, 3) array, or the x, y, z columns (arrays of n values or single values) (optional)
+        rotations: (n, 3) array, or the x, y, z columns, as in set_rotation (optional)
+        identifiers: pairs of identifier name, n values, as in set_identifier (optional)
+        lunit: positions length unit (optional; default: mm)
+        runit: rotations angle unit (optional; default: deg)
+        order: rotations order, as in set_rotation (optional)
+        descriptions: list of n descriptions (optional)
+
+        The fields not given are the ones of this volume, for all copies.
+        Integer columns are written as integers: use a (n, 3) array only if all the coordinates have the same type.
+        Without numpy, the columns are lists (or single values) and the copies are published one by one.
+
+        Example
+        -------
+
+        Publishes 36 bars named bar_0 to bar_35 on a circle of radius 300mm, with identifiers bar_id 1 to 36:
+
+        > phi = np.radians(10 * np.arange(36))
+        > bar.publish_copies(configuration, 'bar_', (300 * np.cos(phi), 300 * np.sin(phi), 0),
+                             identifiers=('bar_id', np.arange(1, 37)))
+
+        Returns the GVolumeTable of the copies, None without numpy
+        """
+
+        if np is None:
+            self.publish_each_copy(configuration, names, positions, rotations, identifiers, lunit, runit, order, descriptions)
+            return None
+        if isinstance(names, str):
+            columns = [column for values in (positions, rotations) if values is not None for column in copy_columns(values)]
+            if not columns:
+                sys.exit(' Error: the number of copies of GVolume ' + str(self.name) + ' is given by the positions or rotations')
+            names = np.char.add(names, np.arange(np.broadcast(*columns).size).astype(str))
+
+        table = GVolumeTable(self, names)
+        if positions is not None:
+            table.set_positions(*copy_columns(positions), lunit)
+        if rotations is not None:
+            table.set_rotations(*copy_columns(rotations), runit, order)
+        if identifiers:
+            table.set_identifiers(*identifiers)
+        if descriptions is not None:
+            table.set_descriptions(descriptions)
+        table.publish(configuration)
+        return table
+
+    # publish_copies without numpy: a copy of this volume is published for each row of the list columns
+    def publish_each_copy(self, configuration, names, positions, rotations, identifiers, lunit, runit, order, descriptions):
+        columns = [list(values) for values in (positions, rotations) if values is not None]
+        columns = [column for values in columns for column in values]
+        columns += [identifiers[2 * i + 1] for i in range(len(identifiers) // 2)]
+        if descriptions is not None:
+            columns.append(descriptions)
+        if isinstance(names, str):
+            sizes = [len(column) for column in columns if isinstance(column, (list, tuple))]
+            if not sizes:
+                sys.exit(' Error: the number of copies of GVolume ' + str(self.name) + ' is given by the positions or rotations')
+            names = [names + str(index) for index in range(max(sizes))]
+
+        def row_value(column, row):
+            return column[row] if isinstance(column, (list, tuple)) else column
+
+        gvolume = copy.copy(self)
+        for row, name in enumerate(names):
+            gvolume.name = name
+            if positions is not None:
+                gvolume.set_position(*[row_value(column, row) for column in positions], lunit)
+            if rotations is not None:
+                gvolume.set_rotation(*[row_value(column, row) for column in rotations], runit, order)
+            if identifiers:
+                gvolume.set_identifier(*[row_value(value, row) if i % 2 else value for i, value in enumerate(identifiers)])
+            if descriptions is not None:
+                gvolume.description = row_value(descriptions, row)
+            gvolume.publish(configuration)
+
     def publish(self, configuration):
         self.check_validity()
+        if configuration.volumes is not None:
+            configuration.volumes.add_volume(self)
         # TEXT factory
         if configuration.factory == 'TEXT':
-            file_name = configuration.geoFileName
             configuration.nvolumes += 1
-            with open(file_name, 'a+') as dn:
-                lstr = ' ' \
-                       + f'{self.name} | ' \
-                       + f'{self.solid} | ' \
-                       + f'{self.parameters} | ' \
-                       + f'{self.material} | ' \
-                       + f'{self.mother} | ' \
-                       + f'{self.position} | ' \
-                       + f'{self.get_rotation_string()} | ' \
-                       + f'{self.mfield} | ' \
-                       + f'{self.visible} | ' \
-                       + f'{self.style} | ' \
-                       + f'{self.color} | ' \
-                       + f'{self.digitization} | ' \
-                       + f'{self.identifier} | ' \
-                       + f'{self.copyOf} | ' \
-                       + f'{self.replicaOf} | ' \
-                       + f'{self.solidsOpr} | ' \
-                       + f'{self.mirror} | ' \
-                       + f'{self.exist} | ' \
-                       + f'{self.description} |\n'
-                dn.write(lstr)
+            configuration.write_volume_records([PUBLISHED_TEXT_TEMPLATE.format(*self.published_values(configuration))])
         # SQLITE factory
         elif configuration.factory == 'SQLITE':
             configuration.nvolumes += 1
-            self.rotations = self.get_rotation_string()
-            populate_sqlite_geometry(self, configuration)
+            self.rotations = self.get_published_rotation_string(configuration)
+            configuration.write_volume_records([tuple(getattr(self, field) for field in configuration.sqliteColumns['geometry'][3:])])
+        # JSON factory
+        elif configuration.factory == 'JSON':
+            configuration.nvolumes += 1
+            configuration.write_volume_records([json.dumps(dict(zip(PUBLISHED_FIELDS, self.published_values(configuration))))])
+
+    # the value published for the field: the parameters string, and the rotations of the configuration
+    def published_value(self, field, configuration):
+        if field == 'parameters':
+            return self.get_parameters_string()
+        if field == 'rotations':
+            return self.get_published_rotation_string(configuration)
+        return getattr(self, field)
+
+    # the values of the PUBLISHED_FIELDS
+    def published_values(self, configuration):
+        return [self.published_value(field, configuration) for field in PUBLISHED_FIELDS]
 
     # Functions to build geant4 solids
 
@@ -236,10 +411,7 @@ class GVolume:
 
         self.solid = WILLBESET
         self.solid = 'G4Box'
-        my_lengths: str = str(dx) + '*' + lunit + ', '
-        my_lengths += str(dy) + '*' + lunit + ', '
-        my_lengths += str(dz) + '*' + lunit
-        self.parameters = my_lengths
+        self.parameters = GSolidParameters((dx, dy, dz), (lunit,) * 3)
 
     # Cylindrical Section or Tube
     def make_tube(self, rin, rout, length, phistart, phitotal, lunit1='mm', lunit2='deg'):
@@ -277,12 +449,7 @@ class GVolume:
         """
 
         self.solid = 'G4Tubs'
-        my_dims: str = str(rin) + '*' + lunit1 + ', '
-        my_dims += str(rout) + '*' + lunit1 + ', '
-        my_dims += str(length) + '*' + lunit1 + ', '
-        my_dims += str(phistart) + '*' + lunit2 + ', '
-        my_dims += str(phitotal) + '*' + lunit2
-        self.parameters = my_dims
+        self.parameters = GSolidParameters((rin, rout, length, phistart, phitotal), (lunit1,) * 3 + (lunit2,) * 2)
 
     # Cylindrical Cut Section or Cut Tube
     # def make_cut_tube()
@@ -325,13 +492,8 @@ class GVolume:
         """
 
         self.solid = 'G4Cons'
-        mydims = str(rin1) + '*' + lunit1 + ', ' + str(rout1) + '*' + lunit1 + ', ' \
-                 + str(rin2) + '*' + lunit1 + ', ' \
-                 + str(rout2) + '*' + lunit1 + ', ' \
-                 + str(length) + '*' + lunit1 + ', ' \
-                 + str(phi_start) + '*' + lunit2 + ', ' \
-                 + str(phi_total) + '*' + lunit2
-        self.parameters = mydims
+        self.parameters = GSolidParameters((rin1, rout1, rin2, rout2, length, phi_start, phi_total),
+                                           (lunit1,) * 5 + (lunit2,) * 2)
 
     # Trapezoid
     def make_trapezoid(self, dx1, dx2, dy1, dy2, z, lunit='mm'):
@@ -369,11 +531,7 @@ class GVolume:
         """
 
         self.solid = "G4Trd"
-        with_units = [
-            f"{val}*{lunit}"
-            for val in [dx1, dx2, dy1, dy2, z]
-        ]
-        self.parameters = ", ".join(with_units)
+        self.parameters = GSolidParameters((dx1, dx2, dy1, dy2, z), (lunit,) * 5)
 
     def make_trap_from_angular_wedges(self, pz, py, px, pltx, unit='mm'):
         """
@@ -409,13 +567,7 @@ class GVolume:
         """
 
         self.solid = "G4Trap"
-        with_units = [
-            f"{pz}*{unit}",
-            f"{py}*{unit}",
-            f"{px}*{unit}",
-            f"{pltx}*{unit}"
-        ]
-        self.parameters = ", ".join(with_units)
+        self.parameters = GSolidParameters((pz, py, px, pltx), (unit,) * 4)
 
     def make_general_trapezoid(self, pDz, pTheta, pPhi, pDy1, pDx1, pDx2, pAlp1, pDy2, pDx3, pDx4, pAlp2,
                                lunit1='mm', lunit2='deg'):
@@ -460,20 +612,9 @@ class GVolume:
         """
 
         self.solid = "G4Trap"
-        with_units = [
-            f"{pDz}*{lunit1}",
-            f"{pTheta}*{lunit2}",
-            f"{pPhi}*{lunit2}",
-            f"{pDy1}*{lunit1}",
-            f"{pDx1}*{lunit1}",
-            f"{pDx2}*{lunit1}",
-            f"{pAlp1}*{lunit2}",
-            f"{pDy2}*{lunit1}",
-            f"{pDx3}*{lunit1}",
-            f"{pDx4}*{lunit1}",
-            f"{pAlp2}*{lunit2}"
-        ]
-        self.parameters = ", ".join(with_units)
+        self.parameters = GSolidParameters((pDz, pTheta, pPhi, pDy1, pDx1, pDx2, pAlp1, pDy2, pDx3, pDx4, pAlp2),
+                                           (lunit1, lunit2, lunit2, lunit1, lunit1, lunit1, lunit2,
+                                            lunit1, lunit1, lunit1, lunit2))
 
     def make_trap_from_vertices(self,
                                 v1x, v1y, v1z,
@@ -518,33 +659,9 @@ class GVolume:
         """
 
         self.solid = "G4Trap"
-        with_units = [
-            f"{v1x}*{lunit1}",
-            f"{v1y}*{lunit1}",
-            f"{v1z}*{lunit1}",
-            f"{v2x}*{lunit1}",
-            f"{v2y}*{lunit1}",
-            f"{v2z}*{lunit1}",
-            f"{v3x}*{lunit1}",
-            f"{v3y}*{lunit1}",
-            f"{v3z}*{lunit1}",
-            f"{v4x}*{lunit1}",
-            f"{v4y}*{lunit1}",
-            f"{v4z}*{lunit1}",
-            f"{v5x}*{lunit1}",
-            f"{v5y}*{lunit1}",
-            f"{v5z}*{lunit1}",
-            f"{v6x}*{lunit1}",
-            f"{v6y}*{lunit1}",
-            f"{v6z}*{lunit1}",
-            f"{v7x}*{lunit1}",
-            f"{v7y}*{lunit1}",
-            f"{v7z}*{lunit1}",
-            f"{v8x}*{lunit1}",
-            f"{v8y}*{lunit1}",
-            f"{v8z}*{lunit1}"
-        ]
-        self.parameters = ", ".join(with_units)
+        self.parameters = GSolidParameters((v1x, v1y, v1z, v2x, v2y, v2z, v3x, v3y, v3z, v4x, v4y, v4z,
+                                            v5x, v5y, v5z, v6x, v6y, v6z, v7x, v7y, v7z, v8x, v8y, v8z),
+                                           (lunit1,) * 24)
 
     # Generic Trapezoid: will call the G4Trap constructor based on the number of parameters
     # - for a Right Angular Wedge (4 parameters)
@@ -603,11 +720,7 @@ class GVolume:
         """
         self.solid = WILLBESET
         self.solid = 'G4Sphere'
-        dimensions = str(rmin) + '*' + lunit1 + ', ' \
-                     + str(rmax) + '*' + lunit1 + ', ' \
-                     + str(sphi) + '*' + lunit2 + ', ' + str(dphi) + '*' + lunit2 + ', ' \
-                     + str(stheta) + '*' + lunit2 + ', ' + str(dtheta) + '*' + lunit2
-        self.parameters = dimensions
+        self.parameters = GSolidParameters((rmin, rmax, sphi, dphi, stheta, dtheta), (lunit1,) * 2 + (lunit2,) * 4)
 
     # "G4Orb": "Full Solid Sphere",
     # "G4Torus": "Torus",
@@ -645,14 +758,176 @@ class GVolume:
                     len(iradius)) + ', oradius=' + str(len(oradius)))
 
         self.solid = 'G4Polycone'
-        mylengths = ' '
-        for ele in zplane:
-            mylengths += str(ele) + '*' + lunit1 + ', '
-        for ele in iradius:
-            mylengths += str(ele) + '*' + lunit1 + ', '
-        for ele in oradius[:-1]:
-            mylengths += str(ele) + '*' + lunit1 + ', '
-
-        # last element w/o the extra comment
-        mylengths += str(oradius[-1]) + '*' + lunit1
-        self.parameters = f'{phiStart}*{lunit2}, {phiTotal}*{lunit2}, {nplanes}, {mylengths}'
+        values = (phiStart, phiTotal, nplanes, *zplane, *iradius, *oradius)
+        units = (lunit2, lunit2, None) + (lunit1,) * (len(values) - 3)
+        # the lengths are separated from the number of planes by an extra space
+        template = solid_parameters_template(units[:3]) + ',  ' + solid_parameters_template(units[3:])
+        self.parameters = GSolidParameters(values, units, template)
+
+
+# GVolumeTable class definition
+# A table of copies of the gvolume, one row for each name. The gvolume provides the fields shared by all copies.
+# Positions, rotations and identifiers not set in the table are taken from the gvolume.
+#
+# Example, a row of 100 fibers along x:
+#
+#   fiber = GVolume('fiber')
+#   fiber.mother = 'lead_box'
+#   fiber.make_tube(0, 0.046, 1.99, 0, 360, 'cm')
+#   fiber.material = 'core'
+#   nx = np.arange(100)
+#   fibers = GVolumeTable(fiber, np.char.add('fiber_', nx.astype(str)))
+#   fibers.set_positions(-5 + 0.1*nx, 0, 0, 'cm')
+#   fibers.set_identifiers('fiber', nx)
+#   fibers.publish(configuration)
+class GVolumeTable:
+    __slots__ = ('gvolume', 'names',
+                 'positions', 'positionsUnit',
+                 'rotations', 'rotationsUnit', 'rotationsOrder',
+                 'identifiers', 'identifiersNames',
+                 'descriptions')
+
+    def __init__(self, gvolume, names):
+        if np is None:
+            sys.exit(' Error: GVolumeTable requires numpy')
+        gvolume.check_validity()
+        self.gvolume = gvolume
+        self.names = np.asarray(names, dtype=str).reshape(-1)
+
+        # lists of 3 arrays of n values (x, y, z) and their units. None: the gvolume value is used for all rows.
+        # Each coordinate keeps its own dtype, so that integers are written as integers, as in GVolume.set_position
+        self.positions = None
+        self.positionsUnit = 'mm'
+        self.rotations = None
+        self.rotationsUnit = 'deg'
+        self.rotationsOrder = ''
+
+        # list of k arrays of n identifiers values, and their names
+        self.identifiers = None
+        self.identifiersNames = []
+
+        # array of n descriptions. None: the gvolume description is used for all rows
+        self.descriptions = None
+
+    def __len__(self):
+        return len(self.names)
+
+    # x, y, z can be arrays with one value per row, or single values shared by all rows
+    def set_positions(self, x, y, z, lunit='mm'):
+        self.positions = self.rows_columns(x, y, z)
+        self.positionsUnit = lunit
+
+    # single rotation, as in GVolume.set_rotation: around the x-, y-, and z- axes in order, or in the given order
+    def set_rotations(self, x, y, z, lunit='deg', order=''):
+        self.rotations = self.rows_columns(x, y, z)
+        self.rotationsUnit = lunit
+        self.rotationsOrder = order
+
+    # pairs of identifier name, values. As in GVolume.set_identifier, but with one value per row
+    def set_identifiers(self, *identifiers):
+        identity_size = int(len(identifiers) / 2)
+        self.identifiersNames = [str(identifiers[2 * i]) for i in range(identity_size)]
+        self.identifiers = self.rows_columns(*[identifiers[2 * i + 1] for i in range(identity_size)])
+
+    def set_descriptions(self, descriptions):
+        self.descriptions = np.asarray(descriptions, dtype=str).reshape(-1)
+
+    # each column is broadcast to one value per row
+    def rows_columns(self, *columns):
+        nrows = len(self.names)
+        return [np.broadcast_to(np.asarray(column), (nrows,)) for column in columns]
+
+    # the per-row fields, as lists of strings formatted as in the GVolume functions.
+    # With a configuration, the rotations are the published ones (see GVolume.get_published_rotation_string)
+    def row_columns(self, configuration=None):
+        columns = {'name': self.names.tolist()}
+        if self.positions is not None:
+            columns['position'] = format_rows(', '.join([f'{{}}*{self.positionsUnit}'] * 3), self.positions)
+        if self.rotations is not None:
+            template = ', '.join([f'{{}}*{self.rotationsUnit}'] * 3)
+            if self.rotationsOrder:
+                template = f'ordered: {escape_braces(self.rotationsOrder)}, ' + template
+            rotations = format_rows(template, self.rotations)
+            if configuration is not None and configuration.collapseRotations:
+                collapsed = {rotation: collapsed_rotation_string(rotation) for rotation in set(rotations)}
+                rotations = [collapsed[rotation] for rotation in rotations]
+            columns['rotations'] = rotations
+        if self.identifiers is not None:
+            columns['identifier'] = format_rows(', '.join(escape_braces(idname) + ': {}' for idname in self.identifiersNames),
+                                                self.identifiers)
+        if self.descriptions is not None:
+            columns['description'] = self.descriptions.tolist()
+        return columns
+
+    # the field value shared by all rows
+    def shared_value(self, field, configuration):
+        return self.gvolume.published_value(field, configuration)
+
+    # the GVolume field values of the rows, in the order of fields
+    def rows(self, fields, configuration):
+        columns = self.row_columns(configuration)
+        values = [columns[field] if field in columns else itertools.repeat(self.shared_value(field, configuration)) for field in fields]
+        return zip(*values)
+
+    # the TEXT factory lines. The shared fields are formatted once, in the line template
+    def text_lines(self, configuration):
+        columns = self.row_columns(configuration)
+        template = ' ' + ' | '.join('{}' if field in columns else escape_braces(str(self.shared_value(field, configuration)))
+                                    for field in PUBLISHED_FIELDS) + ' |\n'
+        return map(template.format, *[columns[field] for field in PUBLISHED_FIELDS if field in columns])
+
+    # the JSON factory records, encoded as json.dumps would encode the GVolume dictionaries
+    def json_records(self, configuration):
+        columns = self.row_columns(configuration)
+        template = '{{' + ', '.join(escape_braces(json.dumps(field)) + ': ' + ('{}' if field in columns else escape_braces(json.dumps(self.shared_value(field, configuration))))
+                                    for field in PUBLISHED_FIELDS) + '}}'
+        return map(template.format, *[map(json.dumps, columns[field]) for field in PUBLISHED_FIELDS if field in columns])
+
+    # the GSystem columns of the rows
+    def system_columns(self):
+        columns = self.row_columns()
+        shared_values = {'parameters': self.gvolume.parameters, 'rotations': self.gvolume.get_rotation_string()}
+        return {field: columns[field] if field in columns else [shared_values.get(field, getattr(self.gvolume, field))] * len(self)
+                for field in SYSTEM_FIELDS}
+
+    def publish(self, configuration):
+        if configuration.volumes is not None:
+            configuration.volumes.add_rows(self.system_columns())
+        # TEXT factory
+        if configuration.factory == 'TEXT':
+            configuration.nvolumes += len(self)
+            configuration.write_volume_records(self.text_lines(configuration))
+        # SQLITE factory
+        elif configuration.factory == 'SQLITE':
+            configuration.nvolumes += len(self)
+            configuration.write_volume_records(self.rows(configuration.sqliteColumns['geometry'][3:], configuration))
+        # JSON factory
+        elif configuration.factory == 'JSON':
+            configuration.nvolumes += len(self)
+            configuration.write_volume_records(self.json_records(configuration))
+
+
+# Format each row of the k columns of values with template, a string with k {} fields.
+# Geometries built on grids repeat the same coordinates many times: each distinct value is converted to string only once.
+# The values are converted with str() in their own dtype, as GVolume.set_position does with numpy scalars. The floats
+# are distinct by their bits, so that 0.0 and -0.0 keep their own string
+def format_rows(template, values):
+    columns = []
+    for column in values:
+        column = np.ascontiguousarray(column).reshape(-1)
+        keys = column
+        if column.dtype.kind == 'f' and column.dtype.itemsize in (2, 4, 8):
+            keys = column.view(np.dtype(f'u{column.dtype.itemsize}'))
+        distinct_keys, first_rows, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        distinct_strings = np.array([str(value) for value in column[first_rows]], dtype=object)
+        columns.append(distinct_strings[inverse.reshape(-1)].tolist())
+    return list(map(template.format, *columns))
+
+# The x, y, z columns of an (n, 3) array, or the given (x, y, z) columns
+def copy_columns(values):
+    if isinstance(values, np.ndarray) and values.ndim == 2:
+        return list(values.T)
+    return [np.asarray(column) for column in values]
+
+def escape_braces(string):
+    return string.replace('{', '{{').replace('}', '}}')
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc homogenization
+#
+# This file exports a variation of a published system where the subtree of a volume (for example a lead / fiber
+# matrix) is replaced by the volume alone, made of a mixture of the materials of the subtree. The mixture keeps the mass
+# and the composition of the subtree, so the variation has the same material budget and simulates much faster.
+#
+# The mixture is a GMaterial defined with fractional masses of the subtree materials:
+#
+# - the mass of each material is the mass of the built volumes of the subtree made of it (gemc_api_mass.GMassBudget),
+#   the volume included: each volume weighs its solid volume minus the solid volumes of its daughters
+# - the density is the mass of the subtree divided by the solid volume of the volume
+#
+# homogenize publishes the variation with a GConfiguration: the published materials, then the mixture, then the
+# published volumes without the descendants of the volume, whose material becomes the mixture. homogenized_records
+# does all the checks and returns what is published, so that nothing is written if they fail. The volumes and
+# materials keep all their published fields. The subtree must only have solids with a known volume and materials with a
+# known density, and its volumes cannot be copied outside of it.
+import sys
+import os
+import json
+import sqlite3
+
+from scig_sql import MATERIALS_COLUMNS
+from gemc_api_geometry import GVolume
+from gemc_api_materials import GMaterial, ISCHEMICAL, ISFRACTIONAL
+from gemc_api_system import load_geometry, PUBLISHED_FIELDS
+from gemc_api_mass import mass_budget, KG_PER_G_CM3_MM3
+from gemc_api_radiation import composition_components, ATOMS_TOTAL
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the GMaterial fields in the order of the TEXT factory columns
+MATERIAL_FIELDS = tuple(name for name, sql_type in MATERIALS_COLUMNS[3:])
+
+# significant digits of the mixture density and fractional masses
+MIXTURE_DIGITS = 10
+
+
+# the records of the TEXT factory file: dictionaries of the fields values
+def text_records(file_name, fields):
+    records = []
+    with open(file_name) as records_file:
+        for line in records_file:
+            values = [value.strip() for value in line.split('|')]
+            if len(values) >= len(fields):
+                records.append(dict(zip(fields, values)))
+    return records
+
+
+# The volume and material records of a published system: lists of dictionaries of the GVolume and GMaterial fields,
+# in publish order. The materials file of a geometry file is the one written by the same configuration, if it exists
+def published_records(file_name, system_name=None, variation='default', runno=1):
+    if file_name.endswith('.txt') or file_name.endswith('.json'):
+        materials_file_name = file_name.replace('__geometry_', '__materials_')
+        if materials_file_name == file_name or not os.path.exists(materials_file_name):
+            materials_file_name = None
+        if file_name.endswith('.txt'):
+            volumes = text_records(file_name, PUBLISHED_FIELDS)
+            materials = text_records(materials_file_name, MATERIAL_FIELDS) if materials_file_name else []
+        else:
+            with open(file_name) as geometry_file:
+                volumes = json.load(geometry_file)
+            materials = []
+            if materials_file_name:
+                with open(materials_file_name) as materials_file:
+                    materials = json.load(materials_file)
+        return volumes, materials
+
+    if system_name is None:
+        sys.exit(' Error: the system name is required to load the records of the SQLITE database ' + file_name)
+    sqlitedb = sqlite3.connect(file_name)
+    records = []
+    for table, fields in (('geometry', PUBLISHED_FIELDS), ('materials', MATERIAL_FIELDS)):
+        query = "SELECT {} FROM {} WHERE system = ? and variation = ? and run = ? ORDER BY id".format(", ".join(fields), table)
+        rows = sqlitedb.execute(query, (system_name, variation, runno)).fetchall()
+        records.append([dict(zip(fields, row)) for row in rows])
+    sqlitedb.close()
+    return records[0], records[1]
+
+
+# GVolume with the published fields of the record
+def gvolume_from_record(record):
+    gvolume = GVolume(record['name'])
+    for field in PUBLISHED_FIELDS:
+        setattr(gvolume, field, record[field])
+    gvolume.rotations = [record['rotations']]
+    gvolume.exist = int(record['exist'])
+    return gvolume
+
+
+# GMaterial with the published fields of the record. The composition type is given by the total of the composition
+def gmaterial_from_record(record):
+    gmaterial = GMaterial(record['name'])
+    for field in MATERIAL_FIELDS:
+        setattr(gmaterial, field, record[field])
+    gmaterial.density = float(record['density'])
+    gmaterial.totComposition = sum(amount for component, amount in composition_components(gmaterial.composition))
+    gmaterial.compType = ISCHEMICAL if gmaterial.totComposition > ATOMS_TOTAL else ISFRACTIONAL
+    return gmaterial
+
+
+# The GMaterial mixture of the subtree of the volume mother, named material_name (<mother>_homogenized by default).
+# densities: optional dictionary of material densities, in g/cm3, that replace the system ones
+def homogenized_material(system, mother, material_name=None, densities=None):
+    if np is None:
+        sys.exit(' Error: homogenization requires numpy')
+    budget = mass_budget(system, densities)
+    in_subtree = system.subtree_rows(mother) & budget.built
+    mother_row = system.index[mother]
+    if not budget.built[mother_row]:
+        sys.exit(f' Error: volume {mother} is not built, it cannot be homogenized')
+    rows = np.flatnonzero(in_subtree)
+    unsupported = [budget.names[row] for row in rows[np.isnan(budget.volumes[rows])].tolist()]
+    if unsupported:
+        sys.exit(f' Error: the volume of the solids of {", ".join(unsupported)} is not known, {mother} cannot be homogenized')
+    missing = sorted({budget.materials[row] for row in rows[np.isnan(budget.densities[rows])].tolist()})
+    if missing:
+        sys.exit(f' Error: the density of {", ".join(missing)} is not known, {mother} cannot be homogenized')
+
+    material_masses = {}
+    for row in rows.tolist():
+        material_masses[budget.materials[row]] = material_masses.get(budget.materials[row], 0.) + float(budget.masses[row])
+    total_mass = sum(material_masses.values())
+    if total_mass <= 0:
+        sys.exit(f' Error: the subtree of {mother} has no mass, it cannot be homogenized')
+
+    gmaterial = GMaterial(material_name or mother + '_homogenized')
+    if gmaterial.name in system.materials:
+        sys.exit(f' Error: material {gmaterial.name} is already defined')
+    gmaterial.density = float(f'{total_mass / (budget.volumes[mother_row] * KG_PER_G_CM3_MM3):.{MIXTURE_DIGITS}g}')
+    for material, mass in sorted(material_masses.items(), key=lambda item: -item[1]):
+        if mass > 0:
+            gmaterial.addMaterialWithFractionalMass(material, float(f'{mass / total_mass:.{MIXTURE_DIGITS}g}'))
+    gmaterial.description = f'homogenized {mother} subtree: {int(in_subtree.sum())} volumes, {total_mass:.6g} kg'
+    return gmaterial
+
+
+# The GMaterial mixture, and the material and volume records of the variation of the published geometry
+# (see load_geometry) where the subtree of the volume mother is replaced by the volume, made of the
+# homogenized_material mixture. Nothing is published: the checks are done before any output file is created
+def homogenized_records(file_name, mother, system_name=None, variation='default', runno=1,
+                        material_name=None, densities=None):
+    system = load_geometry(file_name, system_name, variation, runno)
+    volumes, materials = published_records(file_name, system_name, variation, runno)
+    gmaterial = homogenized_material(system, mother, material_name, densities)
+
+    in_subtree = system.subtree_rows(mother)
+    in_subtree[system.index[mother]] = False
+    removed = {system.columns['name'][row] for row in np.flatnonzero(in_subtree).tolist()}
+    kept = [record for record in volumes if record['name'] not in removed]
+    for record in kept:
+        for field in ('copyOf', 'replicaOf'):
+            if record[field] in removed:
+                sys.exit(f' Error: volume {record["name"]} {field} {record[field]}, that is removed by the homogenization')
+    return gmaterial, materials, kept
+
+
+# Publishes with the configuration the homogenized_records: the materials, then the mixture, then the volumes,
+# the material of the volume mother replaced by the mixture
+def publish_homogenized(configuration, mother, gmaterial, materials, volumes):
+    for record in materials:
+        gmaterial_from_record(record).publish(configuration)
+    gmaterial.publish(configuration)
+    for record in volumes:
+        gvolume = gvolume_from_record(record)
+        if gvolume.name == mother:
+            gvolume.material = gmaterial.name
+        gvolume.publish(configuration)
+
+
+# Publishes with the configuration the variation of the published geometry where the subtree of the volume mother
+# is replaced by the volume, made of the homogenized_material mixture. Returns the mixture GMaterial
+def homogenize(configuration, file_name, mother, system_name=None, variation='default', runno=1,
+               material_name=None, densities=None):
+    gmaterial, materials, volumes = homogenized_records(file_name, mother, system_name, variation, runno,
+                                                        material_name, densities)
+    publish_homogenized(configuration, mother, gmaterial, materials, volumes)
+    return gmaterial
+
+
+# The following code allows this module to be executed as a main python script to export a homogenized variation
+# To test, type:  'python gemc_api_homogenize.py <system>__geometry_default.txt -m <volume>' on the command line
+if __name__ == "__main__":
+    import argparse
+    from gemc_api_utils import GConfiguration
+
+    desc_str = ' Variation of a published geometry where the subtree of a volume is replaced by a homogenized volume\n'
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('geometry', help='TEXT (.txt) or JSON (.json) geometry file, or SQLITE database')
+    parser.add_argument('-m', '--mother', required=True, help='volume whose subtree is homogenized')
+    parser.add_argument('-s', '--system', help='system name, by default the one of the geometry file')
+    parser.add_argument('-v', '--variation', default='default', help='variation, for the SQLITE database')
+    parser.add_argument('-r', '--run', type=int, default=1, help='run number, for the SQLITE database')
+    parser.add_argument('-n', '--new-variation', default='homogenized', help='name of the exported variation')
+    parser.add_argument('--material', help='name of the mixture, <mother>_homogenized by default')
+    args = parser.parse_args()
+
+    if args.geometry.endswith('.txt') or args.geometry.endswith('.json'):
+        system_name = args.system or os.path.basename(args.geometry).split('__geometry_')[0]
+    elif args.system is None:
+        sys.exit(' Error: the system name is required for the SQLITE database ' + args.geometry)
+    else:
+        system_name = args.system
+
+    # the checks are done before the output files are created
+    mixture, mixture_materials, mixture_volumes = homogenized_records(args.geometry, args.mother, system_name,
+                                                                      args.variation, args.run, args.material)
+
+    if args.geometry.endswith('.txt') or args.geometry.endswith('.json'):
+        factory = 'TEXT' if args.geometry.endswith('.txt') else 'JSON'
+        configuration = GConfiguration(system_name, factory, 'homogenized ' + args.mother)
+        configuration.setVariation(args.new_variation)
+        configuration.setRunNo(args.run)
+        configuration.init_geom_file()
+        configuration.init_mats_file()
+    else:
+        configuration = GConfiguration(system_name, 'SQLITE', 'homogenized ' + args.mother)
+        configuration.init_sqlite_file(args.geometry, append=True)
+        configuration.setVariation(args.new_variation)
+        configuration.setRunNo(args.run)
+
+    publish_homogenized(configuration, args.mother, mixture, mixture_materials, mixture_volumes)
+    if configuration.factory == 'SQLITE':
+        configuration.close_sqlite_file()
+    else:
+        configuration.close_files()
+    configuration.printC()
+    print(f'  {mixture.name}: {mixture.density} g/cm3, {mixture.composition}')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc mass
+#
+# This file computes the mass budget of a GSystem without geant4: the volume, surface, density and mass of each volume,
+# the mass of each material and the mass of each subtree of the hierarchy.
+#
+# The solid volumes and surfaces are the analytic ones of gemc_api_solids.solid_volumes and solid_surfaces.
+# The densities are the GMaterial.density of the system materials (GSystem.materials), then the gemc_api_nist
+# densities of the G4_* names. The volumes of a material without density have a NaN mass.
+#
+# As in geant4, the daughters displace the material of their mother: the net volume of a volume is its solid volume
+# minus the solid volumes of its daughters. A volume with exist 0 is not built, and neither are its daughters.
+#
+# The material, subtree and total masses are the sums of the known masses: missing_densities and unsupported_volumes
+# list what they do not include.
+#
+# Volumes are in mm3, surfaces in mm2, densities in g/cm3 and masses in kg.
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_solids import solid_volumes, solid_surfaces
+from gemc_api_nist import NIST_DENSITIES
+
+# g/cm3 times mm3 in kg
+KG_PER_G_CM3_MM3 = 1.e-6
+
+
+# GMassBudget class definition
+# The arrays have one entry per row of the system:
+#
+# - names, materials: the volume names and materials
+# - built: the volume exists, is placed, and its mother is built
+# - volumes, surfaces: the solid volumes and surfaces
+# - densities: the material densities
+# - net_volumes: the solid volumes minus the daughters solid volumes, 0 if not built
+# - masses: the net volumes times the densities
+# - subtree_masses: the known masses of the volumes and of all their descendants
+class GMassBudget:
+    __slots__ = ('names', 'materials', 'index', 'built', 'volumes', 'surfaces', 'densities',
+                 'net_volumes', 'masses', 'subtree_masses')
+
+    # densities: optional dictionary of material densities, in g/cm3, that replace the system ones
+    def __init__(self, system, densities=None):
+        if np is None:
+            sys.exit(' Error: the mass budget requires numpy')
+        self.names = system.columns['name']
+        self.materials = system.columns['material']
+        self.index = system.index
+        nrows = len(system)
+
+        hierarchy = system.hierarchy()
+        hierarchy.check()
+        parents = np.asarray(hierarchy.parents, dtype=int)
+        levels = [np.asarray(rows, dtype=int) for rows in hierarchy.levels()]
+        self.built = system.built_volumes()
+
+        self.volumes = solid_volumes(system)
+        self.surfaces = solid_surfaces(system)
+        self.densities = material_densities(system, self.materials, densities)
+
+        daughters = np.flatnonzero(self.built & (parents >= 0))
+        daughters_volumes = np.zeros(nrows)
+        np.add.at(daughters_volumes, parents[daughters], np.nan_to_num(self.volumes[daughters]))
+        self.net_volumes = np.where(self.built, self.volumes - daughters_volumes, 0.)
+        self.masses = self.net_volumes * self.densities * KG_PER_G_CM3_MM3
+
+        # the subtrees are summed from the deepest level up
+        self.subtree_masses = np.where(self.built, np.nan_to_num(self.masses), 0.)
+        for rows in reversed(levels[1:]):
+            np.add.at(self.subtree_masses, parents[rows], self.subtree_masses[rows])
+
+    def mass(self, name):
+        return self.masses[self.index[name]]
+
+    def subtree_mass(self, name):
+        return self.subtree_masses[self.index[name]]
+
+    def total_mass(self):
+        return float(np.nansum(self.masses[self.built]))
+
+    # the known mass of each material of the built volumes
+    def material_masses(self):
+        masses = {}
+        for material, mass in zip(self.materials, np.where(self.built, np.nan_to_num(self.masses), 0.).tolist()):
+            masses[material] = masses.get(material, 0.) + mass
+        return masses
+
+    # the materials of the built volumes without density
+    def missing_densities(self):
+        return sorted({material for material, density, built in zip(self.materials, self.densities, self.built)
+                       if built and np.isnan(density)})
+
+    # the names of the built volumes whose solid volume is not supported
+    def unsupported_volumes(self):
+        return [self.names[row] for row in np.flatnonzero(self.built & np.isnan(self.volumes)).tolist()]
+
+
+# (n,) densities of the materials column, in g/cm3. Each distinct material is looked up once
+def material_densities(system, materials, densities=None):
+    distinct_materials, inverse = np.unique(np.asarray(materials, dtype=str), return_inverse=True)
+    distinct_densities = np.array([material_density(system, material, densities)
+                                   for material in distinct_materials.tolist()], dtype=float)
+    return distinct_densities[inverse.reshape(-1)]
+
+
+def material_density(system, material, densities=None):
+    if densities is not None and material in densities:
+        return float(densities[material])
+    if material in system.materials:
+        return float(system.materials[material].density)
+    return NIST_DENSITIES.get(material, np.nan)
+
+
+def mass_budget(system, densities=None):
+    return GMassBudget(system, densities)
+
+
+# The following code allows this module to be executed as a main python script to weigh a published geometry
+# To test, type:  'python gemc_api_mass.py <system>__geometry_default.txt' on the command line
+if __name__ == "__main__":
+    import argparse
+    from gemc_api_system import load_geometry, WORLDVOLUME
+
+    desc_str = ' Mass budget of a published geometry: by material, by subtree and total, in kg\n'
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('geometry', help='TEXT (.txt) or JSON (.json) geometry file, or SQLITE database')
+    parser.add_argument('-s', '--system', help='system name, for the SQLITE database')
+    parser.add_argument('-v', '--variation', default='default', help='variation, for the SQLITE database')
+    parser.add_argument('-r', '--run', type=int, default=1, help='run number, for the SQLITE database')
+    parser.add_argument('-d', '--depth', type=int, default=1, help='show the subtrees down to this depth')
+    args = parser.parse_args()
+
+    gsystem = load_geometry(args.geometry, args.system, args.variation, args.run)
+    budget = mass_budget(gsystem)
+    depths = gsystem.hierarchy().depth
+
+    print('  Materials:')
+    for material, material_mass in sorted(budget.material_masses().items(), key=lambda item: -item[1]):
+        print(f'    {material:30s} {material_mass:14.6g} kg')
+    print('  Subtrees:')
+    # depth first, each subtree below its mother
+    rows = list(reversed(gsystem.children.get(WORLDVOLUME, [])))
+    while rows:
+        row = rows.pop()
+        if budget.built[row] and depths[row] <= args.depth:
+            print(f'    {"  " * (depths[row] - 1)}{budget.names[row]:30s} {budget.subtree_masses[row]:14.6g} kg')
+            rows.extend(reversed(gsystem.children.get(budget.names[row], [])))
+    print(f'  Total mass: {budget.total_mass():.6g} kg')
+    for material in budget.missing_densities():
+        print(f'  Warning: material {material} has no density, its volumes are not weighed')
+    for name in budget.unsupported_volumes():
+        print(f'  Warning: the solid of volume {name} is not supported, it is not weighed')
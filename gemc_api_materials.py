@@ -89,7 +89,14 @@ ISFRACTIONAL = "ISFRACTIONAL"
 from scig_sql import populate_sqlite_materials
 
 # Material class definition
+# Only the fields below can be assigned.
 class GMaterial():
+	__slots__ = ('name', 'density', 'composition', 'compType', 'totComposition', 'description',
+	             'photonEnergy', 'indexOfRefraction', 'absorptionLength', 'reflectivity', 'efficiency',
+	             'fastcomponent', 'slowcomponent', 'scintillationyield', 'resolutionscale',
+	             'fasttimeconstant', 'slowtimeconstant', 'yieldratio', 'birksConstant',
+	             'rayleigh')
+
 	def __init__(self, name):
 
 		# mandatory fields. Checked at publish time
@@ -144,42 +151,72 @@ class GMaterial():
 
 	def publish(self, configuration):
 		self.check_validity()
+		# the GSystem of the published volumes, if kept, also keeps the materials
+		if configuration.volumes is not None:
+			configuration.volumes.add_material(self)
 		# TEXT factory
 		if configuration.factory == 'TEXT':
-			fileName = configuration.matFileName
 			configuration.nmaterials += 1
-			with open(fileName, 'a+') as dn:
-				lstr = ''
-				lstr += '%s | ' % self.name
-				lstr += '%s | ' % self.density
-				lstr += '%s | ' % self.composition
-				lstr += '%s | ' % self.description
+			lstr = ''
+			lstr += '%s | ' % self.name
+			lstr += '%s | ' % self.density
+			lstr += '%s | ' % self.composition
+			lstr += '%s | ' % self.description
+
+			# optical parameters
+			lstr += '%s | ' % self.photonEnergy
+			lstr += '%s | ' % self.indexOfRefraction
+			lstr += '%s | ' % self.absorptionLength
+			lstr += '%s | ' % self.reflectivity
+			lstr += '%s | ' % self.efficiency
+
+			# scintillation parameters
+			lstr += '%s | ' % self.fastcomponent
+			lstr += '%s | ' % self.slowcomponent
+			lstr += '%s | ' % self.scintillationyield
+			lstr += '%s | ' % self.resolutionscale
+			lstr += '%s | ' % self.fasttimeconstant
+			lstr += '%s | ' % self.slowtimeconstant
+			lstr += '%s | ' % self.yieldratio
+			lstr += '%s | ' % self.birksConstant
+
+			# other optical processes
+			lstr += '%s |\n' % self.rayleigh
+
+			configuration.writer(configuration.matFileName).write(lstr)
+		# SQLITE factory
+		elif configuration.factory == 'SQLITE':
+			configuration.nmaterials += 1
+			populate_sqlite_materials(self, configuration)
+		# JSON factory
+		elif configuration.factory == 'JSON':
+			configuration.nmaterials += 1
+			configuration.write_json_record(configuration.matFileName, {
+				'name':               self.name,
+				'density':            self.density,
+				'composition':        self.composition,
+				'description':        self.description,
 
 				# optical parameters
-				lstr += '%s | ' % self.photonEnergy
-				lstr += '%s | ' % self.indexOfRefraction
-				lstr += '%s | ' % self.absorptionLength
-				lstr += '%s | ' % self.reflectivity
-				lstr += '%s | ' % self.efficiency
+				'photonEnergy':       self.photonEnergy,
+				'indexOfRefraction':  self.indexOfRefraction,
+				'absorptionLength':   self.absorptionLength,
+				'reflectivity':       self.reflectivity,
+				'efficiency':         self.efficiency,
 
 				# scintillation parameters
-				lstr += '%s | ' % self.fastcomponent
-				lstr += '%s | ' % self.slowcomponent
-				lstr += '%s | ' % self.scintillationyield
-				lstr += '%s | ' % self.resolutionscale
-				lstr += '%s | ' % self.fasttimeconstant
-				lstr += '%s | ' % self.slowtimeconstant
-				lstr += '%s | ' % self.yieldratio
-				lstr += '%s | ' % self.birksConstant
+				'fastcomponent':      self.fastcomponent,
+				'slowcomponent':      self.slowcomponent,
+				'scintillationyield': self.scintillationyield,
+				'resolutionscale':    self.resolutionscale,
+				'fasttimeconstant':   self.fasttimeconstant,
+				'slowtimeconstant':   self.slowtimeconstant,
+				'yieldratio':         self.yieldratio,
+				'birksConstant':      self.birksConstant,
 
 				# other optical processes
-				lstr += '%s |\n' % self.rayleigh
-
-				dn.write(lstr)
-		# SQLITE factory
-		elif configuration.factory == 'SQLITE':
-			configuration.nmaterials += 1
-			populate_sqlite_materials(self, configuration)
+				'rayleigh':           self.rayleigh
+			})
 
 	def addNAtoms(self, element, natoms):
 		if self.composition == WILLBESETSTRING:
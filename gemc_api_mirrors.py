@@ -113,9 +113,7 @@ class MyMirror():
 
 # Function to initialize (overwrite) any existing mirror file so that any new mirrors can simply be appended in this project	
 def init_mirrors_file(configuration):
-	if configuration.factory == "TEXT":
-		fileName = configuration.detector_name + "__mirrors_"+str(configuration.variation)+".txt"
-		open(fileName, "w+")
+	configuration.init_mirs_file()
 
 
 # Function to write out a material definition to the material file for use as input by gemc
@@ -127,37 +125,35 @@ def print_mir(configuration, mirror):
 
 	# TEXT Factory
 	if configuration.factory == "TEXT":
-		fName = configuration.detector_name+"__mirrors_"+configuration.variation+".txt"
-		with open(fName, "a+") as fn:
-			if mirror.type == "notDefined":
-				print("Error: type undefined.\n")
-			if mirror.finish == "notDefined":
-				print("Error: finish undefined.\n")
-			if mirror.model == "notDefined":
-				print("Error: model undefined.\n")
-			if mirror.border == "notDefined":
-				print("Error: border undefined.\n")
+		if mirror.type == "notDefined":
+			print("Error: type undefined.\n")
+		if mirror.finish == "notDefined":
+			print("Error: finish undefined.\n")
+		if mirror.model == "notDefined":
+			print("Error: model undefined.\n")
+		if mirror.border == "notDefined":
+			print("Error: border undefined.\n")
 
-			lstr = ""
-			
-			lstr += "%20s  |" % str(mirror.name)
-			lstr += "%30s  |" % str(mirror.description)
-			lstr += "%24s  |" % str(mirror.type)
-			lstr += "%20s  |" % str(mirror.finish)
-			lstr += "%10s  |" % str(mirror.model)
-			lstr += "%25s  |" % str(mirror.border)
-			lstr += "%25s  |" % str(mirror.matOptProps)
-			lstr += "%5s |" % str(mirror.photonEnergy)
-			lstr += "%5s |" % str(mirror.indexOfRefraction)
-			lstr += "%5s |" % str(mirror.reflectivity)
-			lstr += "%5s |" % str(mirror.efficiency)
-			lstr += "%5s |" % str(mirror.specularlobe)
-			lstr += "%5s |" % str(mirror.specularspike)
-			lstr += "%5s " % str(mirror.backscatter)
-			
-			lstr += "\n"
-			fn.write(lstr)
+		lstr = ""
+		
+		lstr += "%20s  |" % str(mirror.name)
+		lstr += "%30s  |" % str(mirror.description)
+		lstr += "%24s  |" % str(mirror.type)
+		lstr += "%20s  |" % str(mirror.finish)
+		lstr += "%10s  |" % str(mirror.model)
+		lstr += "%25s  |" % str(mirror.border)
+		lstr += "%25s  |" % str(mirror.matOptProps)
+		lstr += "%5s |" % str(mirror.photonEnergy)
+		lstr += "%5s |" % str(mirror.indexOfRefraction)
+		lstr += "%5s |" % str(mirror.reflectivity)
+		lstr += "%5s |" % str(mirror.efficiency)
+		lstr += "%5s |" % str(mirror.specularlobe)
+		lstr += "%5s |" % str(mirror.specularspike)
+		lstr += "%5s " % str(mirror.backscatter)
+		
+		lstr += "\n"
+		configuration.writer(configuration.mirFileName).write(lstr)
 
 
 	if int(configuration.verbosity) > 0:
-		print("  + Mirror %s uploaded successfully for variation %s \n" %(configuration.detector_name, configuration.variation))
+		print("  + Mirror %s uploaded successfully for variation %s \n" %(mirror.name, configuration.variation))
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc navigator
+#
+# This file locates points in the volumes of a GSystem, without geant4: for each world point, the deepest volume that
+# contains it and its material, as geant4 navigates the geometry published by GVolume.publish.
+#
+# GNavigator holds the solids of the built volumes in their own frames, with their world transforms:
+#
+# - G4Box, G4Trd and the G4Trap: convex hexahedra, the 6 half spaces of their faces
+# - G4Tubs, G4Cons and G4Polycone: sections between two z planes, inside the rmax cone and outside the rmin cone,
+#   within the phi section. A polycone is one section for each pair of consecutive planes
+# - G4Sphere: shell between the rmin and rmax balls, within the phi section and the theta section
+#
+# The points are followed down the hierarchy: the points in a volume are only tested with its daughters.
+# Each mother (and the world volume) has a uniform grid over the world bounding boxes of its daughters: a daughter is
+# registered in the cells that its box spans, and a point is only tested with the daughters of its cell, first with
+# their box, then exactly in the solid frame. The cell size is the mean size of the daughters boxes, so that the
+# number of daughters tested does not grow with the number of daughters. The boxes that span more than LARGE_SPAN
+# cells (envelopes) are tested with all the points of their mother.
+#
+# Points on a surface are inside, within SURFACE_TOLERANCE mm. Points outside all the volumes are in the world volume.
+# The volumes not built (exist 0) and the solids not supported (for example operations) are not located:
+# their points are located in their mother. GNavigator lists the solids not supported.
+import sys
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_solids import solid_groups, local_vertices, world_bounding_boxes, local_bounding_boxes, ragged_arange
+from gemc_api_overlaps import face_planes, LARGE_SPAN
+from gemc_api_system import WORLDVOLUME
+
+# solid kinds of the navigator
+HEXAHEDRON = 0
+SECTIONS = 1
+SPHERE = 2
+
+SURFACE_TOLERANCE = 1.e-9
+
+# number of points located at once
+POINTS_CHUNK = 65536
+
+# maximum number of grid cells along each axis of a mother grid
+GRID_CELLS = 1024
+
+
+# GNavigator class definition
+# The arrays have one entry per row of the system:
+#
+# - names, materials: the volume names and materials
+# - parents: the row of the mother, -1 for the daughters of the world volume
+# - rows: the rows of the located volumes (built, with a supported solid)
+# - positions, rotations, world_bounds: world transforms and bounding boxes
+# - kinds: HEXAHEDRON, SECTIONS, SPHERE, -1 if the volume is not located
+# - normals, offsets: the faces of the hexahedra, inside if normal . p <= offset
+# - first_sections, nsections, sections: the (zlo, zhi, a_out, b_out, a_in, b_in, hole, sphi, dphi) sections
+#   of the tubes, cones and polycones: inside a_out + b_out z >= rho, outside a_in + b_in z >= rho if hole,
+#   between zlo and zhi
+# - spheres: the G4Sphere parameters
+# - first_daughters, ndaughters, daughters: the located daughters of each row are daughters[first: first + n]
+# - top: the located volumes placed in the world volume
+#
+# The grids have one entry per mother, and one more for the world volume, the last one:
+#
+# - grid_origins, grid_cells, grid_dims, grid_bases: the grid origin, cell sizes and number of cells along each axis,
+#   and number of the first cell. Cell (i, j, k) of mother m is grid_bases[m] + i + dims_x (j + dims_y k)
+# - cell_keys, cell_starts, cell_daughters: the daughters of cell cell_keys[c] are cell_daughters[starts[c]: starts[c + 1]].
+#   The last key is past all the cells, with no daughters
+# - first_large, nlarge, large_daughters: the daughters tested with all the points of their mother
+class GNavigator:
+    __slots__ = ('names', 'materials', 'parents', 'rows', 'positions', 'rotations', 'world_bounds', 'kinds',
+                 'normals', 'offsets', 'first_sections', 'nsections', 'sections', 'spheres',
+                 'first_daughters', 'ndaughters', 'daughters', 'top', 'unsupported_volumes',
+                 'grid_origins', 'grid_cells', 'grid_dims', 'grid_bases', 'cell_keys', 'cell_starts', 'cell_daughters',
+                 'first_large', 'nlarge', 'large_daughters')
+
+    def __init__(self, system):
+        if np is None:
+            sys.exit(' Error: the navigator requires numpy')
+        nrows = len(system)
+        self.names = system.columns['name']
+        self.materials = system.columns['material']
+        self.parents = np.asarray(system.hierarchy().parents, dtype=int)
+        self.positions, self.rotations = system.world_transforms()
+        local_bounds = local_bounding_boxes(system)
+        self.world_bounds = world_bounding_boxes(system, local_bounds)
+
+        self.kinds = np.full(nrows, -1, dtype=int)
+        self.normals = np.zeros((nrows, 6, 3))
+        self.offsets = np.zeros((nrows, 6))
+        self.spheres = np.zeros((nrows, 6))
+        sections = [np.zeros((0, 9))] * nrows
+        vertices, polyhedral = local_vertices(system, local_bounds)
+        self.normals[polyhedral], self.offsets[polyhedral] = face_planes(vertices[polyhedral])
+        self.kinds[polyhedral] = HEXAHEDRON
+        for kind, rows, values in solid_groups(system):
+            if kind in ('G4Tubs', 'G4Cons'):
+                self.kinds[rows] = SECTIONS
+                for row, row_sections in zip(rows.tolist(), cons_sections(kind, values)):
+                    sections[row] = row_sections[None]
+            elif kind == 'G4Polycone':
+                self.kinds[rows] = SECTIONS
+                for row, polycone_values in zip(rows.tolist(), values):
+                    sections[row] = polycone_sections(np.asarray(polycone_values, dtype=float))
+            elif kind == 'G4Sphere':
+                self.kinds[rows] = SPHERE
+                self.spheres[rows] = values
+        self.nsections = np.array([len(row_sections) for row_sections in sections], dtype=int)
+        self.first_sections = np.cumsum(self.nsections) - self.nsections
+        self.sections = np.concatenate(sections) if nrows else np.zeros((0, 9))
+
+        built = system.built_volumes()
+        self.unsupported_volumes = [self.names[row] for row in np.flatnonzero(built & (self.kinds < 0)).tolist()]
+        self.kinds[~built] = -1
+        located = self.kinds >= 0
+        self.rows = np.flatnonzero(located)
+
+        # the located daughters, grouped by mother
+        has_mother = self.parents >= 0
+        daughters = np.flatnonzero(located & has_mother)
+        daughters = daughters[np.argsort(self.parents[daughters], kind='stable')]
+        self.ndaughters = np.bincount(self.parents[daughters], minlength=nrows)
+        self.first_daughters = np.cumsum(self.ndaughters) - self.ndaughters
+        self.daughters = daughters
+        self.top = np.flatnonzero(located & ~has_mother)
+        self.index_daughters()
+
+    # the grid of each mother over the world bounding boxes of its daughters
+    def index_daughters(self):
+        nmothers = len(self.kinds) + 1
+        rows = self.rows
+        mothers = np.where(self.parents[rows] >= 0, self.parents[rows], nmothers - 1)
+        bounds = self.world_bounds[rows]
+
+        lows = np.full((nmothers, 3), np.inf)
+        highs = np.full((nmothers, 3), -np.inf)
+        np.minimum.at(lows, mothers, bounds[:, 0])
+        np.maximum.at(highs, mothers, bounds[:, 1])
+        counts = np.bincount(mothers, minlength=nmothers)
+        # the cells are the mean size of the boxes along each axis, so that elongated daughters are gridded too
+        sizes = np.stack([np.bincount(mothers, weights=bounds[:, 1, axis] - bounds[:, 0, axis], minlength=nmothers)
+                          for axis in range(3)], axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cells = np.maximum(sizes / counts[:, None], (highs - lows) / GRID_CELLS)
+        cells = np.where(np.isfinite(cells) & (cells > 0), cells, 1.)
+        self.grid_origins = np.where(counts[:, None] > 0, lows, 0.)
+        self.grid_cells = cells
+        self.grid_dims = np.where(counts[:, None] > 0, np.floor((highs - lows) / cells), 0).astype(np.int64) + 1
+        grid_sizes = np.prod(self.grid_dims, axis=1)
+        self.grid_bases = np.cumsum(grid_sizes) - grid_sizes
+
+        # the cells spanned by each box
+        first_cells = np.floor((bounds[:, 0] - self.grid_origins[mothers]) / cells[mothers]).astype(np.int64)
+        last_cells = np.floor((bounds[:, 1] - self.grid_origins[mothers]) / cells[mothers]).astype(np.int64)
+        last_cells = np.minimum(last_cells, self.grid_dims[mothers] - 1)
+        spans = last_cells - first_cells + 1
+        ncells = np.prod(spans, axis=1)
+        large = ncells > LARGE_SPAN
+
+        # one entry per (box, cell) of the small boxes
+        small = np.flatnonzero(~large)
+        counts = ncells[small]
+        entries = np.repeat(small, counts)
+        offsets = ragged_arange(0, counts)
+        sx = spans[entries, 0]
+        sy = spans[entries, 1]
+        keys = self.cell_keys_of(mothers[entries], np.stack([first_cells[entries, 0] + offsets % sx,
+                                                              first_cells[entries, 1] + (offsets // sx) % sy,
+                                                              first_cells[entries, 2] + offsets // (sx * sy)], axis=1))
+        order = np.argsort(keys, kind='stable')
+        cell_keys, cell_starts = np.unique(keys[order], return_index=True)
+        self.cell_keys = np.append(cell_keys, self.grid_bases[-1] + grid_sizes[-1])
+        self.cell_starts = np.append(cell_starts, [len(keys), len(keys)])
+        self.cell_daughters = rows[entries[order]]
+
+        large = np.flatnonzero(large)
+        large = large[np.argsort(mothers[large], kind='stable')]
+        self.nlarge = np.bincount(mothers[large], minlength=nmothers)
+        self.first_large = np.cumsum(self.nlarge) - self.nlarge
+        self.large_daughters = rows[large]
+
+    def cell_keys_of(self, mothers, cells):
+        dims = self.grid_dims[mothers]
+        return self.grid_bases[mothers] + cells[:, 0] + dims[:, 0] * (cells[:, 1] + dims[:, 1] * cells[:, 2])
+
+    # the (point, daughter) pairs of the daughters of the mothers (-1 for the world volume) whose grid cell,
+    # or whose whole grid, contains the points
+    def candidates(self, mothers, points):
+        mothers = np.where(mothers >= 0, mothers, len(self.kinds))
+        cells = np.floor((points - self.grid_origins[mothers]) / self.grid_cells[mothers]).astype(np.int64)
+        in_grid = np.all((cells >= 0) & (cells < self.grid_dims[mothers]), axis=1)
+        keys = self.cell_keys_of(mothers, np.where(in_grid[:, None], cells, 0))
+        # the cell_keys end with a key past all the cells
+        found = np.searchsorted(self.cell_keys, keys)
+        in_grid &= self.cell_keys[found] == keys
+        counts = np.where(in_grid, self.cell_starts[found + 1] - self.cell_starts[found], 0)
+        starts = self.cell_starts[found]
+
+        large_counts = self.nlarge[mothers]
+        pairs_points = np.concatenate([np.repeat(np.arange(len(points)), counts),
+                                       np.repeat(np.arange(len(points)), large_counts)])
+        cell_entries = ragged_arange(starts, counts)
+        large_entries = ragged_arange(self.first_large[mothers], large_counts)
+        pairs_rows = np.concatenate([self.cell_daughters[cell_entries], self.large_daughters[large_entries]])
+        return pairs_points, pairs_rows
+
+    # (N,) rows of the deepest volumes that contain the (N, 3) world points, in mm. -1 for the world volume
+    def locate(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        located = np.full(len(points), -1, dtype=int)
+        for start in range(0, len(points), POINTS_CHUNK):
+            active = np.arange(start, min(start + POINTS_CHUNK, len(points)))
+            while len(active):
+                pairs_points, pairs_rows = self.candidates(located[active], points[active])
+                pairs_world = points[active[pairs_points]]
+                bounds = self.world_bounds[pairs_rows]
+                in_box = np.all((pairs_world >= bounds[:, 0] - SURFACE_TOLERANCE) &
+                                (pairs_world <= bounds[:, 1] + SURFACE_TOLERANCE), axis=1)
+                pairs_points, pairs_rows = pairs_points[in_box], pairs_rows[in_box]
+                inside = self.contains(pairs_rows, points[active[pairs_points]])
+                pairs_points, pairs_rows = pairs_points[inside], pairs_rows[inside]
+                # overlapping daughters: the first one published
+                order = np.lexsort((pairs_rows, pairs_points))
+                found, first = np.unique(pairs_points[order], return_index=True)
+                active = active[found]
+                located[active] = pairs_rows[order][first]
+        return located
+
+    # the volume names of the rows, WORLDVOLUME for -1
+    def volume_names(self, rows):
+        return np.array([self.names[row] if row >= 0 else WORLDVOLUME for row in np.asarray(rows).tolist()], dtype=object)
+
+    # the materials of the rows, an empty string for the world volume
+    def volume_materials(self, rows):
+        return np.array([self.materials[row] if row >= 0 else '' for row in np.asarray(rows).tolist()], dtype=object)
+
+    # (p,) True for the world points inside the solids of the rows
+    def contains(self, rows, points):
+        rotations = self.rotations[rows]
+        local = np.einsum('pji,pj->pi', rotations, points - self.positions[rows])
+        inside = np.zeros(len(rows), dtype=bool)
+        kinds = self.kinds[rows]
+
+        selected = np.flatnonzero(kinds == HEXAHEDRON)
+        inside[selected] = np.all(np.einsum('pfi,pi->pf', self.normals[rows[selected]], local[selected]) <=
+                                  self.offsets[rows[selected]] + SURFACE_TOLERANCE, axis=1)
+        selected = np.flatnonzero(kinds == SPHERE)
+        inside[selected] = sphere_contains(local[selected], self.spheres[rows[selected]])
+
+        # one entry per (point, section)
+        selected = np.flatnonzero(kinds == SECTIONS)
+        counts = self.nsections[rows[selected]]
+        pairs = np.repeat(selected, counts)
+        sections = ragged_arange(self.first_sections[rows[selected]], counts)
+        np.logical_or.at(inside, pairs, sections_contain(local[pairs], self.sections[sections]))
+        return inside
+
+
+# (n, 9) sections of the G4Tubs (rmin, rmax, dz, sphi, dphi) and G4Cons (rmin1, rmax1, rmin2, rmax2, dz, sphi, dphi)
+def cons_sections(kind, values):
+    if kind == 'G4Tubs':
+        rmin, rmax, dz, sphi, dphi = values.T
+        rmin1, rmax1, rmin2, rmax2 = rmin, rmax, rmin, rmax
+    else:
+        rmin1, rmax1, rmin2, rmax2, dz, sphi, dphi = values.T
+    return np.stack([-dz, dz,
+                     (rmax1 + rmax2) / 2, (rmax2 - rmax1) / (2 * dz),
+                     (rmin1 + rmin2) / 2, (rmin2 - rmin1) / (2 * dz),
+                     (rmin1 > 0) | (rmin2 > 0), sphi, dphi], axis=1)
+
+
+# (k, 9) sections of the G4Polycone sphi, dphi, nplanes, z[nplanes], rmin[nplanes], rmax[nplanes]
+def polycone_sections(values):
+    sphi, dphi, nplanes = values[0], values[1], int(values[2])
+    z, rmin, rmax = values[3:3 + 3 * nplanes].reshape(3, nplanes)
+    sections = []
+    for i in range(nplanes - 1):
+        (z1, rmin1, rmax1), (z2, rmin2, rmax2) = sorted([(z[i], rmin[i], rmax[i]), (z[i + 1], rmin[i + 1], rmax[i + 1])])
+        if z2 <= z1:
+            continue
+        b_out = (rmax2 - rmax1) / (z2 - z1)
+        b_in = (rmin2 - rmin1) / (z2 - z1)
+        sections.append((z1, z2, rmax1 - b_out * z1, b_out, rmin1 - b_in * z1, b_in, rmin1 > 0 or rmin2 > 0, sphi, dphi))
+    return np.array(sections, dtype=float).reshape(-1, 9)
+
+
+# True for the (p, 3) local points x, y within the phi sections
+def in_phi(points, sphi, dphi):
+    phi = np.arctan2(points[:, 1], points[:, 0])
+    return (dphi >= 2 * math.pi) | (np.mod(phi - sphi, 2 * math.pi) <= dphi + SURFACE_TOLERANCE)
+
+
+def sections_contain(points, sections):
+    zlo, zhi, a_out, b_out, a_in, b_in, hole, sphi, dphi = sections.T
+    z = points[:, 2]
+    rho = np.hypot(points[:, 0], points[:, 1])
+    return ((z >= zlo - SURFACE_TOLERANCE) & (z <= zhi + SURFACE_TOLERANCE) &
+            (rho <= a_out + b_out * z + SURFACE_TOLERANCE) &
+            ((hole == 0) | (rho >= a_in + b_in * z - SURFACE_TOLERANCE)) & in_phi(points, sphi, dphi))
+
+
+def sphere_contains(points, spheres):
+    rmin, rmax, sphi, dphi, stheta, dtheta = spheres.T
+    r = np.linalg.norm(points, axis=1)
+    theta = np.arctan2(np.hypot(points[:, 0], points[:, 1]), points[:, 2])
+    return ((r <= rmax + SURFACE_TOLERANCE) & (r >= rmin - SURFACE_TOLERANCE) & in_phi(points, sphi, dphi) &
+            (theta >= stheta - SURFACE_TOLERANCE) & (theta <= stheta + dtheta + SURFACE_TOLERANCE))
+
+
+# The following code allows this module to be executed as a main python script to locate points in a published geometry
+# To test, type:  'python gemc_api_navigator.py <system>__geometry_default.txt -p 0 0 0' on the command line
+if __name__ == "__main__":
+    import argparse
+    import time
+    from gemc_api_system import load_geometry
+
+    desc_str = ' Deepest volume and material of points in a published geometry\n'
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('geometry', help='TEXT (.txt) or JSON (.json) geometry file, or SQLITE database')
+    parser.add_argument('-s', '--system', help='system name, for the SQLITE database')
+    parser.add_argument('-v', '--variation', default='default', help='variation, for the SQLITE database')
+    parser.add_argument('-r', '--run', type=int, default=1, help='run number, for the SQLITE database')
+    parser.add_argument('-p', '--point', type=float, nargs=3, action='append', default=[], help='point x y z, in mm')
+    parser.add_argument('--points', help='NumPy (.npy) file of (N, 3) points, in mm: number of points in each volume')
+    args = parser.parse_args()
+
+    navigator = GNavigator(load_geometry(args.geometry, args.system, args.variation, args.run))
+    for name in navigator.unsupported_volumes:
+        print(f'  Warning: the solid of volume {name} is not supported, its points are located in its mother')
+    if args.point:
+        located_rows = navigator.locate(args.point)
+        for point, volume, material in zip(args.point, navigator.volume_names(located_rows), navigator.volume_materials(located_rows)):
+            print(f'  {point[0]:g} {point[1]:g} {point[2]:g} mm: {volume} {material}')
+    if args.points:
+        start_time = time.time()
+        located_rows = navigator.locate(np.load(args.points))
+        elapsed = time.time() - start_time
+        distinct_rows, numbers = np.unique(located_rows, return_counts=True)
+        for volume, number in zip(navigator.volume_names(distinct_rows), numbers.tolist()):
+            print(f'  {volume:30s} {number:12d}')
+        print(f'  {len(located_rows)} points located in {elapsed:.2f}s')
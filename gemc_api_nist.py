@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc NIST materials
+#
+# This file lists the properties of the geant4 NIST materials (the G4_* names of G4NistManager) and elements used by
+# the offline system tools, so that the volumes made of NIST materials can be weighed, and their radiation and
+# interaction lengths computed, without geant4.
+#
+# NIST_DENSITIES: the density of the materials, in g/cm3, as defined in the geant4 NIST material builder.
+# The list covers the elements and the compounds commonly used in detectors; the other G4_* names have no density.
+#
+# NIST_ELEMENTS: the atomic number Z and the molar mass A, in g/mole, of the elements, by symbol.
+#
+# NIST_COMPOSITIONS: the composition of the compounds of NIST_DENSITIES, with the syntax of GMaterial.composition:
+# numbers of atoms ("H 2 O 1") or mass fractions ("C 0.000124 N 0.755267 ..."). The G4_<symbol> materials are
+# made of the element <symbol> and are not listed.
+
+NIST_DENSITIES = {
+    # elements
+    'G4_H':  8.3748e-05,
+    'G4_He': 0.000166322,
+    'G4_Li': 0.534,
+    'G4_Be': 1.848,
+    'G4_B':  2.37,
+    'G4_C':  2.0,
+    'G4_N':  0.0011652,
+    'G4_O':  0.00133151,
+    'G4_F':  0.00158029,
+    'G4_Ne': 0.000838505,
+    'G4_Na': 0.971,
+    'G4_Mg': 1.74,
+    'G4_Al': 2.699,
+    'G4_Si': 2.33,
+    'G4_P':  2.2,
+    'G4_S':  2.0,
+    'G4_Cl': 0.00299473,
+    'G4_Ar': 0.00166201,
+    'G4_K':  0.862,
+    'G4_Ca': 1.55,
+    'G4_Ti': 4.54,
+    'G4_V':  6.11,
+    'G4_Cr': 7.18,
+    'G4_Mn': 7.44,
+    'G4_Fe': 7.874,
+    'G4_Co': 8.9,
+    'G4_Ni': 8.902,
+    'G4_Cu': 8.96,
+    'G4_Zn': 7.133,
+    'G4_Ga': 5.904,
+    'G4_Ge': 5.323,
+    'G4_Kr': 0.00347832,
+    'G4_Zr': 6.506,
+    'G4_Nb': 8.57,
+    'G4_Mo': 10.22,
+    'G4_Ag': 10.5,
+    'G4_Cd': 8.65,
+    'G4_In': 7.31,
+    'G4_Sn': 7.31,
+    'G4_Sb': 6.691,
+    'G4_I':  4.93,
+    'G4_Xe': 0.00548536,
+    'G4_Cs': 1.873,
+    'G4_Ba': 3.5,
+    'G4_Gd': 7.9004,
+    'G4_Ta': 16.654,
+    'G4_W':  19.3,
+    'G4_Pt': 21.45,
+    'G4_Au': 19.32,
+    'G4_Hg': 13.546,
+    'G4_Pb': 11.35,
+    'G4_Bi': 9.747,
+    'G4_U':  18.95,
+
+    # gases and liquids
+    'G4_Galactic':       1.e-25,
+    'G4_AIR':            0.00120479,
+    'G4_WATER':          1.0,
+    'G4_WATER_VAPOR':    0.000756182,
+    'G4_CARBON_DIOXIDE': 0.00184212,
+    'G4_METHANE':        0.000667151,
+    'G4_ETHANE':         0.00125324,
+    'G4_PROPANE':        0.00187939,
+    'G4_BUTANE':         0.00249343,
+    'G4_lH2':            0.0708,
+    'G4_lN2':            0.807,
+    'G4_lO2':            1.141,
+    'G4_lAr':            1.396,
+    'G4_lKr':            2.418,
+    'G4_lXe':            2.953,
+
+    # plastics
+    'G4_POLYETHYLENE':            0.94,
+    'G4_POLYPROPYLENE':           0.9,
+    'G4_POLYSTYRENE':             1.06,
+    'G4_PLASTIC_SC_VINYLTOLUENE': 1.032,
+    'G4_PLEXIGLASS':              1.19,
+    'G4_MYLAR':                   1.4,
+    'G4_KAPTON':                  1.42,
+    'G4_TEFLON':                  2.2,
+    'G4_NYLON-6-6':               1.14,
+    'G4_POLYVINYL_CHLORIDE':      1.3,
+    'G4_PARAFFIN':                0.93,
+
+    # glasses, crystals and ceramics
+    'G4_SILICON_DIOXIDE':   2.32,
+    'G4_GLASS_PLATE':       2.4,
+    'G4_Pyrex_Glass':       2.23,
+    'G4_GLASS_LEAD':        6.22,
+    'G4_LEAD_OXIDE':        9.53,
+    'G4_ALUMINUM_OXIDE':    3.97,
+    'G4_CESIUM_IODIDE':     4.51,
+    'G4_SODIUM_IODIDE':     3.667,
+    'G4_BGO':               7.13,
+    'G4_PbWO4':             8.28,
+    'G4_BARIUM_FLUORIDE':   4.89,
+    'G4_CALCIUM_FLUORIDE':  3.18,
+    'G4_LITHIUM_FLUORIDE':  2.635,
+    'G4_GRAPHITE':          2.21,
+
+    # construction materials
+    'G4_STAINLESS-STEEL': 8.0,
+    'G4_BRASS':           8.52,
+    'G4_BRONZE':          8.82,
+    'G4_CONCRETE':        2.3,
+
+    # tissues
+    'G4_TISSUE_SOFT_ICRP':      1.03,
+    'G4_MUSCLE_SKELETAL_ICRP':  1.05,
+    'G4_ADIPOSE_TISSUE_ICRP':   0.95,
+    'G4_BONE_COMPACT_ICRU':     1.85,
+    'G4_LUNG_ICRP':             1.05,
+}
+
+
+NIST_ELEMENTS = {
+    'H':  (1,  1.00794),
+    'He': (2,  4.002602),
+    'Li': (3,  6.941),
+    'Be': (4,  9.012182),
+    'B':  (5,  10.811),
+    'C':  (6,  12.0107),
+    'N':  (7,  14.0067),
+    'O':  (8,  15.9994),
+    'F':  (9,  18.9984032),
+    'Ne': (10, 20.1797),
+    'Na': (11, 22.98977),
+    'Mg': (12, 24.305),
+    'Al': (13, 26.981538),
+    'Si': (14, 28.0855),
+    'P':  (15, 30.973761),
+    'S':  (16, 32.065),
+    'Cl': (17, 35.453),
+    'Ar': (18, 39.948),
+    'K':  (19, 39.0983),
+    'Ca': (20, 40.078),
+    'Sc': (21, 44.95591),
+    'Ti': (22, 47.867),
+    'V':  (23, 50.9415),
+    'Cr': (24, 51.9961),
+    'Mn': (25, 54.938049),
+    'Fe': (26, 55.845),
+    'Co': (27, 58.9332),
+    'Ni': (28, 58.6934),
+    'Cu': (29, 63.546),
+    'Zn': (30, 65.409),
+    'Ga': (31, 69.723),
+    'Ge': (32, 72.64),
+    'As': (33, 74.9216),
+    'Se': (34, 78.96),
+    'Br': (35, 79.904),
+    'Kr': (36, 83.798),
+    'Rb': (37, 85.4678),
+    'Sr': (38, 87.62),
+    'Y':  (39, 88.90585),
+    'Zr': (40, 91.224),
+    'Nb': (41, 92.90638),
+    'Mo': (42, 95.94),
+    'Ag': (47, 107.8682),
+    'Cd': (48, 112.411),
+    'In': (49, 114.818),
+    'Sn': (50, 118.71),
+    'Sb': (51, 121.76),
+    'Te': (52, 127.6),
+    'I':  (53, 126.90447),
+    'Xe': (54, 131.293),
+    'Cs': (55, 132.90545),
+    'Ba': (56, 137.327),
+    'La': (57, 138.9055),
+    'Ce': (58, 140.116),
+    'Gd': (64, 157.25),
+    'Lu': (71, 174.967),
+    'Hf': (72, 178.49),
+    'Ta': (73, 180.9479),
+    'W':  (74, 183.84),
+    'Re': (75, 186.207),
+    'Os': (76, 190.23),
+    'Ir': (77, 192.217),
+    'Pt': (78, 195.078),
+    'Au': (79, 196.96655),
+    'Hg': (80, 200.59),
+    'Tl': (81, 204.3833),
+    'Pb': (82, 207.2),
+    'Bi': (83, 208.98038),
+    'Th': (90, 232.0381),
+    'U':  (92, 238.02891),
+}
+
+NIST_COMPOSITIONS = {
+    # gases and liquids
+    'G4_Galactic':       'H 1',
+    'G4_AIR':            'C 0.000124 N 0.755267 O 0.231781 Ar 0.012827',
+    'G4_WATER':          'H 2 O 1',
+    'G4_WATER_VAPOR':    'H 2 O 1',
+    'G4_CARBON_DIOXIDE': 'C 1 O 2',
+    'G4_METHANE':        'C 1 H 4',
+    'G4_ETHANE':         'C 2 H 6',
+    'G4_PROPANE':        'C 3 H 8',
+    'G4_BUTANE':         'C 4 H 10',
+    'G4_lH2':            'H 1',
+    'G4_lN2':            'N 1',
+    'G4_lO2':            'O 1',
+    'G4_lAr':            'Ar 1',
+    'G4_lKr':            'Kr 1',
+    'G4_lXe':            'Xe 1',
+
+    # plastics
+    'G4_POLYETHYLENE':            'C 1 H 2',
+    'G4_POLYPROPYLENE':           'C 3 H 6',
+    'G4_POLYSTYRENE':             'C 8 H 8',
+    'G4_PLASTIC_SC_VINYLTOLUENE': 'C 9 H 10',
+    'G4_PLEXIGLASS':              'C 5 H 8 O 2',
+    'G4_MYLAR':                   'C 10 H 8 O 4',
+    'G4_KAPTON':                  'C 22 H 10 N 2 O 5',
+    'G4_TEFLON':                  'C 2 F 4',
+    'G4_NYLON-6-6':               'C 12 H 22 N 2 O 2',
+    'G4_POLYVINYL_CHLORIDE':      'C 2 H 3 Cl 1',
+    'G4_PARAFFIN':                'C 25 H 52',
+
+    # glasses, crystals and ceramics
+    'G4_SILICON_DIOXIDE':   'Si 1 O 2',
+    'G4_GLASS_PLATE':       'O 0.4598 Na 0.0964 Si 0.3365 Ca 0.1073',
+    'G4_Pyrex_Glass':       'B 0.040064 O 0.539562 Na 0.028191 Al 0.011644 Si 0.37722 K 0.003321',
+    'G4_GLASS_LEAD':        'O 0.156453 Si 0.080866 Ti 0.008092 As 0.002651 Pb 0.751938',
+    'G4_LEAD_OXIDE':        'Pb 1 O 1',
+    'G4_ALUMINUM_OXIDE':    'Al 2 O 3',
+    'G4_CESIUM_IODIDE':     'Cs 1 I 1',
+    'G4_SODIUM_IODIDE':     'Na 1 I 1',
+    'G4_BGO':               'Bi 4 Ge 3 O 12',
+    'G4_PbWO4':             'Pb 1 W 1 O 4',
+    'G4_BARIUM_FLUORIDE':   'Ba 1 F 2',
+    'G4_CALCIUM_FLUORIDE':  'Ca 1 F 2',
+    'G4_LITHIUM_FLUORIDE':  'Li 1 F 1',
+    'G4_GRAPHITE':          'C 1',
+
+    # construction materials
+    'G4_STAINLESS-STEEL': 'Fe 74 Cr 18 Ni 8',
+    'G4_BRASS':           'Cu 62 Zn 35 Pb 3',
+    'G4_BRONZE':          'Cu 89 Zn 9 Pb 2',
+    'G4_CONCRETE':        'H 0.01 C 0.001 O 0.529107 Na 0.016 Mg 0.002 Al 0.033872 Si 0.337021 K 0.013 Ca 0.044 Fe 0.014',
+
+    # tissues
+    'G4_TISSUE_SOFT_ICRP':     'H 0.104472 C 0.23219 N 0.02488 O 0.630238 Na 0.00113 Mg 0.00013 P 0.00133 S 0.00199 '
+                               'Cl 0.00134 K 0.00199 Ca 0.00023 Fe 0.00005 Zn 0.00003',
+    'G4_MUSCLE_SKELETAL_ICRP': 'H 0.100637 C 0.10783 N 0.02768 O 0.754773 Na 0.00075 Mg 0.00019 P 0.0018 S 0.00241 '
+                               'Cl 0.00079 K 0.00302 Ca 0.00003 Fe 0.00004 Zn 0.00005',
+    'G4_ADIPOSE_TISSUE_ICRP':  'H 0.114 C 0.598 N 0.007 O 0.278 Na 0.001 S 0.001 Cl 0.001',
+    'G4_BONE_COMPACT_ICRU':    'H 0.064 C 0.278 N 0.027 O 0.41 Mg 0.002 P 0.07 S 0.002 Ca 0.147',
+    'G4_LUNG_ICRP':            'H 0.105 C 0.083 N 0.023 O 0.779 Na 0.002 P 0.002 S 0.003 Cl 0.003 K 0.002',
+}
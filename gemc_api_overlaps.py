@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc overlaps
+#
+# This file screens the volumes of a GSystem for overlaps, offline, before running geant4:
+#
+# - 'overlap': two daughters of the same mother share some volume
+# - 'outside': a daughter is not contained in its mother
+#
+# The candidate pairs of siblings are found with a uniform grid over the world-frame bounding boxes
+# (gemc_api_solids.world_bounding_boxes): each box is registered in the cells of its mother grid that it spans, and
+# only the siblings that share a cell are compared. The cell size along each axis is the median size of the boxes
+# along that axis, so that elongated boxes (fibers, bars) are gridded too. The boxes that span more than LARGE_SPAN
+# cells (mothers, envelopes) are compared directly with all their siblings.
+#
+# The candidates are then refined:
+#
+# - separating axis test on the vertices of the solids (gemc_api_solids.local_vertices): exact for the convex
+#   polyhedral solids (box, trd, traps), conservative for the other solids, represented by their local bounding box
+# - exact tests for the full G4Tubs (360 degrees): tubes with parallel axes, and tubes with an axis parallel
+#   to a box axis
+#
+# Each result is a tuple (kind, status, name, other_name), where other_name is the sibling for an 'overlap' and the
+# mother for an 'outside'. The status is 'confirmed' if an exact test found it, 'candidate' if the solids could
+# not be separated with their bounding boxes: the geant4 overlap check decides.
+#
+# Surfaces in contact are not overlaps: depths up to the tolerance, in mm, are ignored.
+# The volumes not built (exist 0, or in a volume with exist 0) and the solids without bounding box (for example
+# operations) are skipped.
+import sys
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_solids import solid_groups, local_bounding_boxes, world_bounding_boxes, local_vertices, HEXAHEDRON_FACES
+from gemc_api_solids import ragged_arange
+
+OVERLAP_TOLERANCE = 1.e-6
+
+# boxes spanning more cells than this are compared with all their siblings
+LARGE_SPAN = 64
+
+# maximum number of grid cells along each axis
+GRID_CELLS = 1024
+
+# number of pairs in each separating axis test array operation
+PAIRS_CHUNK = 4096
+
+# two axes are parallel above this value of the cosine of their angle
+PARALLEL = 1 - 1.e-9
+
+# the edges directions of the 8 vertices, in the order of gemc_api_solids.trap_vertices.
+# The 4 edges along x are parallel: only one is used
+HEXAHEDRON_EDGES = ((0, 1),
+                    (0, 2), (1, 3), (4, 6), (5, 7),
+                    (0, 4), (1, 5), (2, 6), (3, 7))
+
+
+# GOverlapData class definition
+# The arrays used by the tests, one entry per row of the system:
+#
+# - valid: the volume is built (gemc_api_system.GSystem.built_volumes) and has a bounding box
+# - parents: the row of the mother, -1 for the daughters of the world volume
+# - positions, rotations: the world transforms
+# - local_bounds, world_bounds: the bounding boxes
+# - vertices, world_vertices: the local vertices, in the volume and in the world frame
+# - polyhedral: the vertices are the ones of a convex polyhedral solid
+# - boxes: the solid is a G4Box
+# - tubes: rmin, rmax, dz of the full G4Tubs, NaN for the other solids
+class GOverlapData:
+    __slots__ = ('valid', 'parents', 'positions', 'rotations', 'local_bounds', 'world_bounds',
+                 'vertices', 'world_vertices', 'polyhedral', 'boxes', 'tubes')
+
+    def __init__(self, system):
+        hierarchy = system.hierarchy()
+        self.positions, self.rotations = system.world_transforms()
+        self.parents = np.asarray(hierarchy.parents, dtype=int)
+        self.local_bounds = local_bounding_boxes(system)
+        self.world_bounds = world_bounding_boxes(system, self.local_bounds)
+        self.vertices, self.polyhedral = local_vertices(system, self.local_bounds)
+        self.world_vertices = np.einsum('nij,nvj->nvi', self.rotations, self.vertices) + self.positions[:, None]
+        self.boxes = np.array([solid == 'G4Box' for solid in system.columns['solid']], dtype=bool)
+        self.tubes = full_tubes(system)
+
+        self.valid = system.built_volumes() & np.all(np.isfinite(self.local_bounds), axis=(1, 2))
+
+
+# (n, 3) rmin, rmax, dz of the G4Tubs with a full phi section, NaN for the other solids
+def full_tubes(system):
+    tubes = np.full((len(system), 3), np.nan)
+    for kind, rows, values in solid_groups(system):
+        if kind == 'G4Tubs':
+            full = values[:, 4] >= 2 * math.pi
+            tubes[rows[full]] = values[full, :3]
+    return tubes
+
+
+# unit vectors of (..., 3) vectors. Vectors of zero length stay zero
+def unit_vectors(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 1.e-12)
+
+
+# (n, 6, 3) outward unit normals of the faces of (n, 8, 3) vertices, and (n, 6) offsets:
+# a point p is inside the convex solid if normal . p <= offset for all faces
+def face_planes(vertices):
+    corners = vertices[:, np.array(HEXAHEDRON_FACES)]
+    normals = unit_vectors(np.cross(corners[:, :, 2] - corners[:, :, 0], corners[:, :, 3] - corners[:, :, 1]))
+    face_centers = corners.mean(axis=2)
+    inwards = np.einsum('nfi,nfi->nf', normals, face_centers - vertices.mean(axis=1)[:, None]) < 0
+    normals[inwards] *= -1
+    return normals, np.einsum('nfi,nfi->nf', normals, face_centers)
+
+
+# True for the pairs of (p, 8, 3) vertices whose convex hulls are separated: on one axis the projections of the two
+# hulls overlap by no more than the tolerance. The face normals are tested first, then the cross products of the edges
+# for the pairs not yet separated
+def separated(vertices, other_vertices, tolerance):
+    result = np.empty(len(vertices), dtype=bool)
+    edges = np.array(HEXAHEDRON_EDGES)
+    for start in range(0, len(vertices), PAIRS_CHUNK):
+        a = vertices[start:start + PAIRS_CHUNK]
+        b = other_vertices[start:start + PAIRS_CHUNK]
+        chunk_result = separated_on_axes(a, b, np.concatenate([face_planes(a)[0], face_planes(b)[0]], axis=1), tolerance)
+        remaining = np.flatnonzero(~chunk_result)
+        a = a[remaining]
+        b = b[remaining]
+        edges_a = unit_vectors(a[:, edges[:, 1]] - a[:, edges[:, 0]])
+        edges_b = unit_vectors(b[:, edges[:, 1]] - b[:, edges[:, 0]])
+        crosses = np.cross(edges_a[:, :, None], edges_b[:, None, :]).reshape(len(a), len(edges) ** 2, 3)
+        chunk_result[remaining] = separated_on_axes(a, b, unit_vectors(crosses), tolerance)
+        result[start:start + PAIRS_CHUNK] = chunk_result
+    return result
+
+
+def separated_on_axes(a, b, axes, tolerance):
+    projections_a = np.einsum('pki,pvi->pkv', axes, a)
+    projections_b = np.einsum('pki,pvi->pkv', axes, b)
+    depths = np.minimum(projections_a.max(axis=2) - projections_b.min(axis=2),
+                        projections_b.max(axis=2) - projections_a.min(axis=2))
+    # the degenerate axes (parallel edges, faces of zero area) do not separate
+    depths[~np.any(axes != 0, axis=2)] = np.inf
+    return np.any(depths <= tolerance, axis=1)
+
+
+# The (p, 2) sorted pairs of valid siblings whose world bounding boxes overlap by more than the tolerance
+def sibling_pairs(system, data, tolerance):
+    rows = np.flatnonzero(data.valid)
+    bounds = data.world_bounds[rows]
+    parents = data.parents[rows]
+    if len(rows) < 2:
+        return np.zeros((0, 2), dtype=int)
+
+    # the grid cells spanned by each box
+    origin = bounds[:, 0].min(axis=0)
+    cells = np.maximum(np.median(bounds[:, 1] - bounds[:, 0], axis=0), (bounds[:, 1].max(axis=0) - origin) / GRID_CELLS)
+    cells = np.where(np.isfinite(cells) & (cells > 0), cells, 1.)
+    first_cells = np.floor((bounds[:, 0] - origin) / cells).astype(np.int64)
+    spans = np.floor((bounds[:, 1] - origin) / cells).astype(np.int64) - first_cells + 1
+    ncells = np.prod(spans, axis=1)
+    large = ncells > LARGE_SPAN
+
+    # one entry per (box, cell) of the small boxes
+    small = np.flatnonzero(~large)
+    counts = ncells[small]
+    entries = np.repeat(small, counts)
+    offsets = ragged_arange(0, counts)
+    sx = spans[entries, 0]
+    sy = spans[entries, 1]
+    ix = first_cells[entries, 0] + offsets % sx
+    iy = first_cells[entries, 1] + (offsets // sx) % sy
+    iz = first_cells[entries, 2] + offsets // (sx * sy)
+
+    # the entries sorted by (mother, cell): the pairs of each cell are the entries d = 1, 2, ... apart
+    order = np.lexsort((iz, iy, ix, parents[entries]))
+    entries = entries[order]
+    keys = np.stack([parents[entries], ix[order], iy[order], iz[order]], axis=1)
+    new_cell = np.ones(len(entries), dtype=bool)
+    new_cell[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    cell_starts = np.flatnonzero(new_cell)
+    cell_sizes = np.diff(np.append(cell_starts, len(entries)))
+    # the number of entries after each entry in its cell
+    after = np.repeat(cell_starts + cell_sizes, cell_sizes) - np.arange(len(entries)) - 1
+
+    pairs = []
+    active = np.flatnonzero(after >= 1)
+    distance = 1
+    while len(active):
+        pairs.append(np.stack([entries[active], entries[active + distance]], axis=1))
+        distance += 1
+        active = active[after[active] >= distance]
+
+    # the large boxes with all their siblings
+    local_rows = {row: i for i, row in enumerate(rows.tolist())}
+    for i in np.flatnonzero(large).tolist():
+        mother = system.columns['mother'][rows[i]]
+        siblings = [local_rows[row] for row in system.children[mother] if row in local_rows and row != rows[i]]
+        if siblings:
+            pairs.append(np.stack([np.full(len(siblings), i), siblings], axis=1))
+
+    if not pairs:
+        return np.zeros((0, 2), dtype=int)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    pairs = np.unique(pairs[:, 0] * len(rows) + pairs[:, 1])
+    first, second = pairs // len(rows), pairs % len(rows)
+    depths = np.minimum(bounds[first, 1] - bounds[second, 0], bounds[second, 1] - bounds[first, 0])
+    overlapping = np.all(depths > tolerance, axis=1)
+    return np.stack([rows[first[overlapping]], rows[second[overlapping]]], axis=1)
+
+
+# overlap of parallel full tubes a, b with centers, common axis, and (p, 3) rmin, rmax, dz
+def parallel_tubes_overlap(centers_a, tubes_a, centers_b, tubes_b, axes, tolerance):
+    delta = centers_b - centers_a
+    along = np.einsum('pi,pi->p', delta, axes)
+    radial = np.linalg.norm(delta - along[:, None] * axes, axis=1)
+    rmin_a, rmax_a, dz_a = tubes_a.T
+    rmin_b, rmax_b, dz_b = tubes_b.T
+    return ((dz_a + dz_b - np.abs(along) > tolerance) &
+            (rmax_a + rmax_b - radial > tolerance) &
+            (radial + rmax_b - rmin_a > tolerance) &
+            (radial + rmax_a - rmin_b > tolerance))
+
+
+# the tube centers and axes in the frame of the boxes, and the index of the box axis parallel to the tube axis, -1 if none
+def tubes_in_boxes(data, tube_rows, box_rows):
+    rotations = data.rotations[box_rows]
+    centers = np.einsum('pji,pj->pi', rotations, data.positions[tube_rows] - data.positions[box_rows])
+    axes = np.einsum('pji,pj->pi', rotations, data.rotations[tube_rows, :, 2])
+    parallel_axis = np.argmax(np.abs(axes), axis=1)
+    parallel = np.abs(axes[np.arange(len(axes)), parallel_axis]) > PARALLEL
+    return centers, np.where(parallel, parallel_axis, -1)
+
+
+# the tube center coordinates along the box axis parallel to the tube axis, and the two other coordinates
+def split_axes(values, parallel_axis):
+    p = np.arange(len(values))
+    return values[p, parallel_axis], values[p, (parallel_axis + 1) % 3], values[p, (parallel_axis + 2) % 3]
+
+
+# overlap of full tubes and boxes, the tube axis parallel to the box axis: the annulus and the rectangle
+# section intersect if the distance from the tube axis to the rectangle is below rmax and the distance
+# to its farthest corner is above rmin
+def tube_box_overlap(centers, parallel_axis, tubes, half_lengths, tolerance):
+    rmin, rmax, dz = tubes.T
+    c_axis, c_1, c_2 = np.abs(split_axes(centers, parallel_axis))
+    h_axis, h_1, h_2 = split_axes(half_lengths, parallel_axis)
+    nearest = np.hypot(np.maximum(c_1 - h_1, 0), np.maximum(c_2 - h_2, 0))
+    farthest = np.hypot(c_1 + h_1, c_2 + h_2)
+    return ((h_axis + dz - c_axis > tolerance) &
+            (rmax - nearest > tolerance) &
+            (farthest - rmin > tolerance))
+
+
+# the (kind, status, name, other_name) sibling overlaps
+def sibling_overlaps(system, data, tolerance):
+    pairs = sibling_pairs(system, data, tolerance)
+    pairs = pairs[~separated(data.world_vertices[pairs[:, 0]], data.world_vertices[pairs[:, 1]], tolerance)]
+    a, b = pairs.T
+    overlapping = np.ones(len(pairs), dtype=bool)
+    exact = data.polyhedral[a] & data.polyhedral[b]
+
+    # parallel full tubes
+    tubes = ~np.isnan(data.tubes[a, 0]) & ~np.isnan(data.tubes[b, 0])
+    axes = data.rotations[a[tubes], :, 2]
+    parallel = np.abs(np.einsum('pi,pi->p', axes, data.rotations[b[tubes], :, 2])) > PARALLEL
+    selected = np.flatnonzero(tubes)[parallel]
+    overlapping[selected] = parallel_tubes_overlap(data.positions[a[selected]], data.tubes[a[selected]],
+                                                   data.positions[b[selected]], data.tubes[b[selected]],
+                                                   axes[parallel], tolerance)
+    exact[selected] = True
+
+    # full tubes and boxes with parallel axes
+    for tube_rows, box_rows in ((a, b), (b, a)):
+        selected = np.flatnonzero(~np.isnan(data.tubes[tube_rows, 0]) & data.boxes[box_rows])
+        centers, parallel_axis = tubes_in_boxes(data, tube_rows[selected], box_rows[selected])
+        parallel = parallel_axis >= 0
+        selected = selected[parallel]
+        overlapping[selected] = tube_box_overlap(centers[parallel], parallel_axis[parallel], data.tubes[tube_rows[selected]],
+                                                 data.local_bounds[box_rows[selected], 1], tolerance)
+        exact[selected] = True
+
+    return results('overlap', system, a, b, overlapping, exact)
+
+
+# the (kind, status, name, mother_name) daughters outside their mother
+def outside_mothers(system, data, tolerance):
+    daughters = np.flatnonzero(data.valid & (data.parents >= 0))
+    daughters = daughters[data.valid[data.parents[daughters]]]
+    mothers = data.parents[daughters]
+    # the daughters vertices in the mother frame
+    points = np.einsum('nji,nvj->nvi', data.rotations[mothers], data.world_vertices[daughters] - data.positions[mothers, None])
+    outside = np.zeros(len(daughters), dtype=bool)
+    exact = data.polyhedral[daughters].copy()
+
+    # convex polyhedral mothers: the daughter vertices must be inside all the faces
+    selected = data.polyhedral[mothers]
+    normals, offsets = face_planes(data.vertices[mothers[selected]])
+    excess = np.einsum('nfi,nvi->nfv', normals, points[selected]) - offsets[:, :, None]
+    outside[selected] = np.max(excess, axis=(1, 2)) > tolerance
+
+    # full tube mothers: the daughter vertices must be within rmax and dz. The vertices within rmin are in the hole
+    tube_mothers = ~np.isnan(data.tubes[mothers, 0])
+    selected = np.flatnonzero(tube_mothers)
+    rmin, rmax, dz = data.tubes[mothers[selected]].T
+    rho = np.hypot(points[selected, :, 0], points[selected, :, 1])
+    outside[selected] = ((rho.max(axis=1) - rmax > tolerance) |
+                         (np.abs(points[selected, :, 2]).max(axis=1) - dz > tolerance) |
+                         (data.polyhedral[daughters[selected]] & (rmin - rho.min(axis=1) > tolerance)))
+
+    # the other mothers: the daughter vertices must be inside the mother bounding box
+    selected = ~data.polyhedral[mothers] & ~tube_mothers
+    bounds = data.local_bounds[mothers[selected]]
+    outside[selected] = (np.any(bounds[:, None, 0] - points[selected] > tolerance, axis=(1, 2)) |
+                         np.any(points[selected] - bounds[:, None, 1] > tolerance, axis=(1, 2)))
+
+    # full tubes in boxes, with parallel axes
+    tube_daughters = ~np.isnan(data.tubes[daughters, 0])
+    selected = np.flatnonzero(tube_daughters & data.boxes[mothers])
+    centers, parallel_axis = tubes_in_boxes(data, daughters[selected], mothers[selected])
+    parallel = parallel_axis >= 0
+    selected = selected[parallel]
+    rmin, rmax, dz = data.tubes[daughters[selected]].T
+    c_axis, c_1, c_2 = np.abs(split_axes(centers[parallel], parallel_axis[parallel]))
+    h_axis, h_1, h_2 = split_axes(data.local_bounds[mothers[selected], 1], parallel_axis[parallel])
+    outside[selected] = ((c_axis + dz - h_axis > tolerance) |
+                         (c_1 + rmax - h_1 > tolerance) |
+                         (c_2 + rmax - h_2 > tolerance))
+    exact[selected] = True
+
+    # full tubes in full tubes, with parallel axes: within rmax and dz, and not in the hole
+    selected = np.flatnonzero(tube_daughters & tube_mothers)
+    axes = data.rotations[mothers[selected], :, 2]
+    parallel = np.abs(np.einsum('pi,pi->p', axes, data.rotations[daughters[selected], :, 2])) > PARALLEL
+    selected = selected[parallel]
+    axes = axes[parallel]
+    delta = data.positions[daughters[selected]] - data.positions[mothers[selected]]
+    along = np.einsum('pi,pi->p', delta, axes)
+    radial = np.linalg.norm(delta - along[:, None] * axes, axis=1)
+    rmin_m, rmax_m, dz_m = data.tubes[mothers[selected]].T
+    rmin_d, rmax_d, dz_d = data.tubes[daughters[selected]].T
+    # distance from the mother axis to the daughter annulus
+    distance = np.maximum(np.maximum(radial - rmax_d, rmin_d - radial), 0)
+    outside[selected] = ((np.abs(along) + dz_d - dz_m > tolerance) |
+                         (radial + rmax_d - rmax_m > tolerance) |
+                         (rmin_m - distance > tolerance))
+    exact[selected] = True
+
+    return results('outside', system, daughters, mothers, outside, exact)
+
+
+def results(kind, system, rows, other_rows, found, exact):
+    names = system.columns['name']
+    return [(kind, 'confirmed' if is_exact else 'candidate', names[row], names[other_row])
+            for row, other_row, is_exact in zip(rows[found].tolist(), other_rows[found].tolist(), exact[found].tolist())]
+
+
+# The list of (kind, status, name, other_name) overlaps of the volumes of the system: the sibling overlaps
+# first, then the daughters outside their mother
+def check_overlaps(system, tolerance=OVERLAP_TOLERANCE):
+    if np is None:
+        sys.exit(' Error: the overlaps check requires numpy')
+    data = GOverlapData(system)
+    return sibling_overlaps(system, data, tolerance) + outside_mothers(system, data, tolerance)
+
+
+# The following code allows this module to be executed as a main python script to check a published geometry
+# To test, type:  'python gemc_api_overlaps.py <system>__geometry_default.txt' on the command line
+if __name__ == "__main__":
+    import argparse
+    import time
+    from gemc_api_system import load_geometry
+
+    desc_str = ' Screens the volumes of a published geometry for overlaps\n'
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('geometry', help='TEXT (.txt) or JSON (.json) geometry file, or SQLITE database')
+    parser.add_argument('-s', '--system', help='system name, for the SQLITE database')
+    parser.add_argument('-v', '--variation', default='default', help='variation, for the SQLITE database')
+    parser.add_argument('-r', '--run', type=int, default=1, help='run number, for the SQLITE database')
+    parser.add_argument('-t', '--tolerance', type=float, default=OVERLAP_TOLERANCE, help='overlap tolerance, in mm')
+    args = parser.parse_args()
+
+    start = time.time()
+    gsystem = load_geometry(args.geometry, args.system, args.variation, args.run)
+    overlaps = check_overlaps(gsystem, args.tolerance)
+    for kind, status, name, other_name in overlaps:
+        if kind == 'overlap':
+            print(f'  {status} overlap: {name} and {other_name}')
+        else:
+            print(f'  {status} outside: {name} is not inside its mother {other_name}')
+    print(f'  {len(gsystem)} volumes checked, {len(overlaps)} overlap(s) found in {time.time() - start:.2f}s')
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc radiation lengths
+#
+# This file computes the radiation length X0 and the nuclear interaction length lambda_I of the materials of a GSystem,
+# with the formulas of geant4 (G4Element and G4Material), so that the material budget can be computed without geant4.
+#
+# The composition of a material is resolved down to the mass fractions of its elements:
+#
+# - the system materials (GSystem.materials) have the GMaterial composition: numbers of atoms of elements
+#   ("H 2 O 1"), or mass fractions of elements, NIST materials and other system materials ("G4_Pb 0.5 epoxy 0.5")
+# - the NIST materials have the gemc_api_nist.NIST_COMPOSITIONS composition, and the G4_<symbol> ones are the element
+#
+# An element is given by its symbol or by its G4_<symbol> NIST material name.
+# For each element, in g/cm2:
+#
+# - X0: Tsai formula with the Coulomb correction, as G4Element::ComputeLradTsaiFactor
+# - lambda_I: 35 g/cm2 A^(1/3), and 35 g/cm2 for hydrogen, as G4Material::ComputeNuclearInterLength
+#
+# The inverse lengths of the elements add with their mass fractions. The lengths are divided by the density
+# (gemc_api_mass.material_density) to give lengths in mm. Materials that cannot be resolved have NaN lengths.
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_nist import NIST_ELEMENTS, NIST_COMPOSITIONS
+from gemc_api_mass import material_density
+
+FINE_STRUCTURE = 1 / 137.035999084
+ELECTRON_RADIUS = 2.8179403262e-13  # cm
+AVOGADRO = 6.02214076e23            # 1/mole
+LAMBDA0 = 35.                       # g/cm2
+
+# Lrad and L'rad of the light elements, Z = 1 to 4
+LRAD_LIGHT = (5.31, 4.79, 4.74, 4.71)
+LPRAD_LIGHT = (6.144, 5.621, 5.805, 5.924)
+
+# the compositions with a total above this are numbers of atoms
+ATOMS_TOTAL = 1 + 1.e-6
+
+
+# the element symbol of an element or of its G4_<symbol> NIST material, None if not an element
+def element_symbol(name):
+    if name in NIST_ELEMENTS:
+        return name
+    if name.startswith('G4_') and name[3:] in NIST_ELEMENTS:
+        return name[3:]
+    return None
+
+
+# the element and amount pairs of a composition string
+def composition_components(composition):
+    tokens = composition.split()
+    return [(tokens[i], float(tokens[i + 1])) for i in range(0, len(tokens) - 1, 2)]
+
+
+# The mass fractions of the elements of the material, a dictionary by symbol. None if the material cannot be resolved.
+# materials: the GMaterial of each system material name
+def element_fractions(name, materials, resolving=()):
+    symbol = element_symbol(name)
+    if symbol is not None:
+        return {symbol: 1.}
+    if name in resolving:
+        return None
+    if name in materials:
+        composition = materials[name].composition
+    elif name in NIST_COMPOSITIONS:
+        composition = NIST_COMPOSITIONS[name]
+    else:
+        return None
+    components = composition_components(composition)
+    if not components:
+        return None
+
+    # numbers of atoms are converted to mass fractions
+    if sum(amount for component, amount in components) > ATOMS_TOTAL:
+        symbols = [element_symbol(component) for component, amount in components]
+        if None in symbols:
+            return None
+        components = [(symbol, amount * NIST_ELEMENTS[symbol][1]) for symbol, (component, amount) in zip(symbols, components)]
+
+    total = sum(amount for component, amount in components)
+    fractions = {}
+    for component, amount in components:
+        component_fractions = element_fractions(component, materials, resolving + (name,))
+        if component_fractions is None:
+            return None
+        for symbol, fraction in component_fractions.items():
+            fractions[symbol] = fractions.get(symbol, 0.) + fraction * amount / total
+    return fractions
+
+
+# X0 of the element, in g/cm2
+def element_radiation_length(symbol):
+    z, a = NIST_ELEMENTS[symbol]
+    if z <= 4:
+        lrad, lprad = LRAD_LIGHT[z - 1], LPRAD_LIGHT[z - 1]
+    else:
+        lrad = math.log(184.15) - math.log(z) / 3
+        lprad = math.log(1194.) - 2 * math.log(z) / 3
+    az2 = (FINE_STRUCTURE * z) ** 2
+    az4 = az2 * az2
+    coulomb = (0.0083 * az4 + 0.20206 + 1 / (1 + az2)) * az2 - (0.0020 * az4 + 0.0369) * az4
+    tsai = 4 * FINE_STRUCTURE * ELECTRON_RADIUS ** 2 * z * (z * (lrad - coulomb) + lprad)
+    return a / (AVOGADRO * tsai)
+
+
+# lambda_I of the element, in g/cm2
+def element_interaction_length(symbol):
+    z, a = NIST_ELEMENTS[symbol]
+    if z == 1:
+        return LAMBDA0
+    return LAMBDA0 * a ** (1 / 3)
+
+
+# X0 and lambda_I of the material, in mm. NaN if the material composition or density is not known
+def material_lengths(system, name, densities=None):
+    fractions = element_fractions(name, system.materials)
+    density = material_density(system, name, densities)
+    if fractions is None or np.isnan(density):
+        return np.nan, np.nan
+    inverse_x0 = sum(fraction / element_radiation_length(symbol) for symbol, fraction in fractions.items())
+    inverse_lambda = sum(fraction / element_interaction_length(symbol) for symbol, fraction in fractions.items())
+    # g/cm2 over g/cm3 is cm
+    return 10 / (inverse_x0 * density), 10 / (inverse_lambda * density)
+
+
+# (n,) inverse X0 and inverse lambda_I of the materials of the volumes of the system, in 1/mm (NaN if not known),
+# and the list of the materials not known. Each distinct material is computed once
+def inverse_lengths(system, densities=None):
+    distinct_materials, inverse = np.unique(np.asarray(system.columns['material'], dtype=str), return_inverse=True)
+    lengths = np.array([material_lengths(system, material, densities)
+                        for material in distinct_materials.tolist()], dtype=float).reshape(-1, 2)
+    unknown = distinct_materials[np.isnan(lengths[:, 0])].tolist()
+    inverse = inverse.reshape(-1)
+    return 1 / lengths[inverse, 0], 1 / lengths[inverse, 1], unknown
@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc ray casting
+#
+# This file computes the material budget of a GSystem along straight rays, without geant4: the number of radiation
+# lengths X0 and of nuclear interaction lengths lambda_I crossed by each ray (gemc_api_radiation.inverse_lengths).
+#
+# The solids are the ones of gemc_api_navigator.GNavigator. The length of a ray in a solid is computed exactly, in the
+# solid frame. Each solid is a signed sum of intersections of convex sets (half spaces, slabs, cones, balls): a line
+# crosses a convex set along one interval, so the length in the solid is the signed sum of the lengths of intersections
+# of intervals. For example a tube with rmin > 0 is the rmax cylinder minus the rmin cylinder, and a phi section larger
+# than 180 degrees is the full turn minus a convex wedge.
+#
+# - G4Box, G4Trd and the G4Trap: the 6 half spaces of their faces
+# - G4Tubs, G4Cons and G4Polycone sections: the z slab and the rmax cone, minus the rmin cone
+# - G4Sphere: the rmax ball minus the rmin ball, within the theta cones
+#
+# The daughters displace the material of their mother: each volume adds its length times the difference between its
+# inverse lengths and the ones of its mother. The world volume ("root") is vacuum. The volumes not built (exist 0),
+# the solids not supported and the materials not known do not add to the budget: GRayScene lists them.
+#
+# - ray_budgets: the budget of any set of rays. The rays are followed down the hierarchy: the daughters of a volume are
+#   only tested with the rays that cross it, and only the ones of the cells of its grid (GNavigator) along the ray,
+#   first with their world bounding box, then exactly
+# - material_budget_map: the theta / phi maps of the budget of the rays from a point. The spatial index is angular:
+#   each volume is only tested with the rays of the grid cells covered by its world bounding box, seen from the point.
+#   The bands of theta rows are distributed to a process pool
+import sys
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_navigator import GNavigator, HEXAHEDRON, SECTIONS, SPHERE
+from gemc_api_solids import ragged_arange
+from gemc_api_radiation import inverse_lengths
+
+# approximate number of rays computed at once
+RAYS_CHUNK = 16384
+
+# maximum number of (ray, volume) pairs tested at once by ray_budgets, unless one volume has more daughters
+PAIRS_CHUNK = 1 << 20
+
+# relative size of the quadratic coefficient below which the cone equation is linear
+LINEAR_CONE = 1.e-12
+
+
+# GRayScene class definition
+# The GNavigator of the system, with the arrays of the material budget, one entry per row:
+#
+# - delta_x0, delta_lambda: the inverse lengths of the volume minus the ones of its mother, in 1/mm
+# - unknown_materials: the materials that do not add to the budget
+class GRayScene(GNavigator):
+    __slots__ = ('delta_x0', 'delta_lambda', 'unknown_materials')
+
+    def __init__(self, system, densities=None):
+        if np is None:
+            sys.exit(' Error: ray casting requires numpy')
+        GNavigator.__init__(self, system)
+        inverse_x0, inverse_lambda, self.unknown_materials = inverse_lengths(system, densities)
+        inverse_x0 = np.nan_to_num(inverse_x0)
+        inverse_lambda = np.nan_to_num(inverse_lambda)
+        has_mother = self.parents >= 0
+        self.delta_x0 = inverse_x0 - np.where(has_mother, inverse_x0[self.parents], 0.)
+        self.delta_lambda = inverse_lambda - np.where(has_mother, inverse_lambda[self.parents], 0.)
+
+
+# Intervals [start, end] of the ray parameter t, arrays of p rays. The universal set is (-inf, inf),
+# the empty set (inf, -inf)
+def universal(p):
+    return np.full(p, -np.inf), np.full(p, np.inf)
+
+
+def intersect(*intervals):
+    return (np.maximum.reduce([interval[0] for interval in intervals]),
+            np.minimum.reduce([interval[1] for interval in intervals]))
+
+
+def set_empty(interval, empty):
+    return np.where(empty, np.inf, interval[0]), np.where(empty, -np.inf, interval[1])
+
+
+def set_universal(interval, full):
+    return np.where(full, -np.inf, interval[0]), np.where(full, np.inf, interval[1])
+
+
+# length of the interval within [0, tmax]
+def interval_length(interval, tmax):
+    return np.maximum(np.minimum(interval[1], tmax) - np.maximum(interval[0], 0.), 0.)
+
+
+# the half space normal . x <= c, with normal . o and normal . d
+def half_space(normal_o, normal_d, c):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (c - normal_o) / normal_d
+    inside = normal_o <= c
+    start = np.where(normal_d < 0, t, np.where(normal_d == 0, np.where(inside, -np.inf, np.inf), -np.inf))
+    end = np.where(normal_d > 0, t, np.where(normal_d == 0, np.where(inside, np.inf, -np.inf), np.inf))
+    return start, end
+
+
+# the slab lo <= x . axis <= hi
+def slab(o_axis, d_axis, lo, hi):
+    return intersect(half_space(o_axis, d_axis, hi), half_space(-o_axis, -d_axis, -lo))
+
+
+# {A t2 + B t + C <= 0}: one interval, and a second one when A < 0 (the two outer half lines)
+def quadratic_intervals(a, b, c, scale):
+    p = len(a)
+    discriminant = b * b - 4 * a * c
+    root = np.sqrt(np.maximum(discriminant, 0))
+    q = -0.5 * (b + np.where(b < 0, -root, root))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r1 = q / a
+        r2 = np.where(q != 0, c / q, r1)
+        linear_root = -c / b
+    low, high = np.minimum(r1, r2), np.maximum(r1, r2)
+    linear = np.abs(a) <= LINEAR_CONE * scale
+    real = discriminant >= 0
+    first = (np.full(p, np.inf), np.full(p, -np.inf))
+    second = (np.full(p, np.inf), np.full(p, -np.inf))
+
+    # A > 0: between the roots
+    selected = ~linear & (a > 0) & real
+    first = (np.where(selected, low, first[0]), np.where(selected, high, first[1]))
+    # A < 0: everywhere without roots, else the two half lines
+    selected = ~linear & (a < 0)
+    first = set_universal(first, selected & ~real)
+    selected = selected & real
+    first = (np.where(selected, -np.inf, first[0]), np.where(selected, low, first[1]))
+    second = (np.where(selected, high, second[0]), np.where(selected, np.inf, second[1]))
+    # linear: B t + C <= 0
+    linear_interval = half_space(c, b, 0.)
+    linear_interval = (np.where(np.isnan(linear_root) & (c <= 0), -np.inf, linear_interval[0]),
+                       np.where(np.isnan(linear_root) & (c <= 0), np.inf, linear_interval[1]))
+    first = (np.where(linear, linear_interval[0], first[0]), np.where(linear, linear_interval[1], first[1]))
+    return first, second
+
+
+# the cone c rho <= a + b z, with a + b z >= 0 (a cylinder if b = 0), for c >= 0: one convex interval
+def cone(o, d, c, a, b):
+    s0 = a + b * o[:, 2]
+    s1 = b * d[:, 2]
+    c2 = c * c
+    rho_d2 = d[:, 0] ** 2 + d[:, 1] ** 2
+    qa = c2 * rho_d2 - s1 * s1
+    qb = 2 * (c2 * (o[:, 0] * d[:, 0] + o[:, 1] * d[:, 1]) - s0 * s1)
+    qc = c2 * (o[:, 0] ** 2 + o[:, 1] ** 2) - s0 * s0
+    first, second = quadratic_intervals(qa, qb, qc, c2 * rho_d2 + s1 * s1)
+    positive = half_space(-s0, -s1, 0.)
+    first = intersect(first, positive)
+    second = intersect(second, positive)
+    # the union of the pieces is convex
+    first_empty = first[0] > first[1]
+    second_empty = second[0] > second[1]
+    start = np.where(first_empty, second[0], np.where(second_empty, first[0], np.minimum(first[0], second[0])))
+    end = np.where(first_empty, second[1], np.where(second_empty, first[1], np.maximum(first[1], second[1])))
+    return start, end
+
+
+# the ball of radius r around the origin, for unit directions
+def ball(o, d, r):
+    b = 2 * np.einsum('pi,pi->p', o, d)
+    c = np.einsum('pi,pi->p', o, o) - r * r
+    discriminant = b * b - 4 * c
+    root = np.sqrt(np.maximum(discriminant, 0))
+    inside = discriminant >= 0
+    return np.where(inside, (-b - root) / 2, np.inf), np.where(inside, (-b + root) / 2, -np.inf)
+
+
+# the convex wedge of the angles between start and start + width, width <= pi
+def wedge(o, d, start, width):
+    end = start + width
+    first = half_space(np.sin(start) * o[:, 0] - np.cos(start) * o[:, 1], np.sin(start) * d[:, 0] - np.cos(start) * d[:, 1], 0.)
+    second = half_space(np.cos(end) * o[:, 1] - np.sin(end) * o[:, 0], np.cos(end) * d[:, 1] - np.sin(end) * d[:, 0], 0.)
+    return intersect(first, second)
+
+
+# the phi section is the first set minus the second one: the convex wedge (dphi <= pi) minus nothing,
+# everything minus the convex complement wedge (dphi > pi), or everything minus nothing (full)
+def phi_sets(o, d, sphi, dphi):
+    full = dphi >= 2 * math.pi
+    small = dphi <= math.pi
+    convex = wedge(o, d, np.where(small, sphi, sphi + dphi), np.where(small, dphi, 2 * math.pi - dphi))
+    return set_universal(convex, ~small), set_empty(convex, small | full)
+
+
+# the sections lengths, as (p, 9) arrays of sections
+def sections_lengths(o, d, sections, tmax):
+    zlo, zhi, a_out, b_out, a_in, b_in, hole, sphi, dphi = sections.T
+    ones = np.ones(len(sections))
+    z_slab = slab(o[:, 2], d[:, 2], zlo, zhi)
+    outer = intersect(z_slab, cone(o, d, ones, a_out, b_out))
+    inner = set_empty(intersect(z_slab, cone(o, d, ones, a_in, b_in)), hole == 0)
+    phi_in, phi_out = phi_sets(o, d, sphi, dphi)
+    return (interval_length(intersect(outer, phi_in), tmax) - interval_length(intersect(outer, phi_out), tmax) -
+            interval_length(intersect(inner, phi_in), tmax) + interval_length(intersect(inner, phi_out), tmax))
+
+
+# the theta cone {theta <= angle} (angle <= pi/2) or {theta >= angle} (angle >= pi/2)
+def theta_cone(o, d, angle):
+    sign = np.where(angle <= math.pi / 2, 1., -1.)
+    return cone(o, d, sign * np.cos(angle), np.zeros(len(angle)), sign * np.sin(angle))
+
+
+# the sphere lengths: (rmax ball - rmin ball) x phi section x theta section. The theta section is everything minus
+# the cone below stheta and the cone above etheta, each a convex cone or everything minus a convex cone
+def sphere_lengths(o, d, spheres, tmax):
+    rmin, rmax, sphi, dphi, stheta, dtheta = spheres.T
+    etheta = np.minimum(stheta + dtheta, math.pi)
+    p = len(spheres)
+    balls = ((1, ball(o, d, rmax)), (-1, set_empty(ball(o, d, rmin), rmin <= 0)))
+    phi_in, phi_out = phi_sets(o, d, sphi, dphi)
+    phis = ((1, phi_in), (-1, phi_out))
+    start_cone = theta_cone(o, d, stheta)
+    end_cone = theta_cone(o, d, etheta)
+    start_convex = stheta <= math.pi / 2
+    end_convex = etheta >= math.pi / 2
+    thetas = ((1, universal(p)),
+              (-1, set_empty(set_universal(start_cone, ~start_convex), stheta <= 0)),
+              (1, set_empty(start_cone, start_convex)),
+              (-1, set_empty(set_universal(end_cone, ~end_convex), etheta >= math.pi)),
+              (1, set_empty(end_cone, end_convex)))
+    lengths = np.zeros(p)
+    for ball_sign, ball_interval in balls:
+        for phi_sign, phi_interval in phis:
+            for theta_sign, theta_interval in thetas:
+                lengths += ball_sign * phi_sign * theta_sign * interval_length(intersect(ball_interval, phi_interval, theta_interval), tmax)
+    return lengths
+
+
+def hexahedron_lengths(o, d, normals, offsets, tmax):
+    interval = half_space(np.einsum('pfi,pi->pf', normals, o), np.einsum('pfi,pi->pf', normals, d), offsets)
+    return interval_length((interval[0].max(axis=1), interval[1].min(axis=1)), tmax)
+
+
+# (p,) lengths of the rays (world origins and unit directions) in the solids of the scene rows
+def solid_lengths(scene, rows, origins, directions, tmax):
+    rotations = scene.rotations[rows]
+    o = np.einsum('pji,pj->pi', rotations, origins - scene.positions[rows])
+    d = np.einsum('pji,pj->pi', rotations, directions)
+    tmax = np.broadcast_to(tmax, len(rows))
+    lengths = np.zeros(len(rows))
+    kinds = scene.kinds[rows]
+
+    selected = np.flatnonzero(kinds == HEXAHEDRON)
+    lengths[selected] = hexahedron_lengths(o[selected], d[selected], scene.normals[rows[selected]],
+                                           scene.offsets[rows[selected]], tmax[selected])
+    selected = np.flatnonzero(kinds == SPHERE)
+    lengths[selected] = sphere_lengths(o[selected], d[selected], scene.spheres[rows[selected]], tmax[selected])
+
+    # one entry per (ray, section)
+    selected = np.flatnonzero(kinds == SECTIONS)
+    counts = scene.nsections[rows[selected]]
+    pairs = np.repeat(selected, counts)
+    sections = ragged_arange(scene.first_sections[rows[selected]], counts)
+    np.add.at(lengths, pairs, sections_lengths(o[pairs], d[pairs], scene.sections[sections], tmax[pairs]))
+    return lengths
+
+
+# the rays that cross the world bounding boxes of the rows
+def boxes_hit(bounds, origins, directions, tmax):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t0 = (bounds[:, 0] - origins) / directions
+        t1 = (bounds[:, 1] - origins) / directions
+    near = np.fmax.reduce(np.fmin(t0, t1), axis=1)
+    far = np.fmin.reduce(np.fmax(t0, t1), axis=1)
+    return (far >= np.maximum(near, 0)) & (near <= tmax)
+
+
+# adds the budget of the (ray, row) pairs to x0 and lambda_i, and returns the pairs with a length
+def add_budgets(scene, rays, rows, origins, directions, tmax, x0, lambda_i):
+    tmax = np.broadcast_to(tmax, len(origins))
+    hit = boxes_hit(scene.world_bounds[rows], origins[rays], directions[rays], tmax[rays])
+    rays, rows = rays[hit], rows[hit]
+    lengths = solid_lengths(scene, rows, origins[rays], directions[rays], tmax[rays])
+    np.add.at(x0, rays, lengths * scene.delta_x0[rows])
+    np.add.at(lambda_i, rays, lengths * scene.delta_lambda[rows])
+    crossed = lengths > 0
+    return rays[crossed], rows[crossed]
+
+
+# The number of X0 and lambda_I crossed by the rays from the (n, 3) origins, in mm, along the (n, 3) unit directions,
+# up to the distance tmax (a number or (n,) array, in mm)
+def ray_budgets(scene, origins, directions, tmax=math.inf):
+    origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+    x0 = np.zeros(len(origins))
+    lambda_i = np.zeros(len(origins))
+    # the daughters of the world volume are the ones of row -1, the last entry
+    children_index = (np.concatenate([scene.daughters, scene.top]),
+                      np.append(scene.first_daughters, len(scene.daughters)),
+                      np.append(scene.ndaughters, len(scene.top)))
+    nchildren = children_index[2]
+    for start in range(0, len(origins), RAYS_CHUNK):
+        chunk = slice(start, start + RAYS_CHUNK)
+        chunk_x0 = x0[chunk]
+        chunk_lambda = lambda_i[chunk]
+        chunk_tmax = np.broadcast_to(tmax, len(origins))[chunk]
+        # the (ray, volume) pairs whose daughters are tested, depth first, at most about PAIRS_CHUNK pairs at a time
+        pending = [(np.arange(len(chunk_x0)), np.full(len(chunk_x0), -1))]
+        while pending:
+            rays, rows = pending.pop()
+            ends = np.cumsum(nchildren[rows])
+            if len(ends) > 1 and ends[-1] > PAIRS_CHUNK:
+                half = max(1, int(np.searchsorted(ends, ends[-1] // 2)))
+                pending.extend([(rays[half:], rows[half:]), (rays[:half], rows[:half])])
+                continue
+            rays, rows = daughter_pairs(scene, children_index, rays, rows, origins[chunk], directions[chunk], chunk_tmax)
+            rays, rows = add_budgets(scene, rays, rows, origins[chunk], directions[chunk], chunk_tmax, chunk_x0, chunk_lambda)
+            if len(rays):
+                pending.append((rays, rows))
+    return x0, lambda_i
+
+
+# The (ray, daughter) pairs of the (ray, volume) pairs, row -1 for the world volume. The daughters are the ones of
+# the cells of the volume grid (GNavigator) along the ray segment in the grid, each one once: the segment is cut in
+# pieces about one cell long, and the cells within the bounding box of each piece are used.
+# When the pieces have more cells than the volume has daughters, all the daughters are used
+def daughter_pairs(scene, children_index, rays, rows, origins, directions, tmax):
+    children, first_children, nchildren = children_index
+    nrows = len(scene.kinds)
+    mothers = np.where(rows >= 0, rows, nrows)
+    nchildren = nchildren[rows]
+    cells = scene.grid_cells[mothers]
+    dims = scene.grid_dims[mothers]
+    low = scene.grid_origins[mothers]
+    high = low + dims * cells
+    ray_origins = origins[rays]
+    ray_directions = directions[rays]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t0 = (low - ray_origins) / ray_directions
+        t1 = (high - ray_origins) / ray_directions
+    near = np.maximum(np.fmax.reduce(np.fmin(t0, t1), axis=1), 0)
+    far = np.minimum(np.fmin.reduce(np.fmax(t0, t1), axis=1), tmax[rays])
+    hit = (far >= near) & (nchildren > 0)
+    near = np.where(hit, near, 0)
+    far = np.where(hit & np.isfinite(far), far, near)
+    # pieces of at most one cell along each axis, whose boxes have at most 8 cells
+    steps = np.max(np.abs(ray_directions) * (far - near)[:, None] / cells, axis=1)
+    npieces = np.where(hit, np.maximum(np.ceil(np.minimum(steps, nchildren)), 1), 0).astype(np.int64)
+    gridded = hit & (8 * npieces <= nchildren)
+    every = np.flatnonzero(hit & ~gridded)
+
+    # all the daughters
+    counts = nchildren[every]
+    every_rays = np.repeat(rays[every], counts)
+    every_rows = children[ragged_arange(first_children[rows[every]], counts)]
+
+    # the boxes of the pieces
+    pairs = np.flatnonzero(gridded)
+    counts = npieces[pairs]
+    pieces = np.repeat(pairs, counts)
+    piece_indices = ragged_arange(0, counts)
+    step = ((far - near) / np.maximum(npieces, 1))[pieces]
+    starts = near[pieces] + piece_indices * step
+    ends = np.stack([ray_origins[pieces] + starts[:, None] * ray_directions[pieces],
+                     ray_origins[pieces] + (starts + step)[:, None] * ray_directions[pieces]])
+    piece_cells = cells[pieces]
+    last_cell = dims[pieces] - 1
+    first_cells = np.clip(np.floor((ends.min(axis=0) - low[pieces]) / piece_cells), 0, last_cell).astype(np.int64)
+    last_cells = np.clip(np.floor((ends.max(axis=0) - low[pieces]) / piece_cells), 0, last_cell).astype(np.int64)
+    spans = last_cells - first_cells + 1
+
+    # the cells of the boxes
+    counts = np.prod(spans, axis=1)
+    entries = np.repeat(np.arange(len(pieces)), counts)
+    offsets = ragged_arange(0, counts)
+    sx = spans[entries, 0]
+    sy = spans[entries, 1]
+    keys = scene.cell_keys_of(mothers[pieces[entries]], np.stack([first_cells[entries, 0] + offsets % sx,
+                                                                  first_cells[entries, 1] + (offsets // sx) % sy,
+                                                                  first_cells[entries, 2] + offsets // (sx * sy)], axis=1))
+    found = np.searchsorted(scene.cell_keys, keys)
+    counts = np.where(scene.cell_keys[found] == keys, scene.cell_starts[found + 1] - scene.cell_starts[found], 0)
+    cell_pairs = np.repeat(pieces[entries], counts)
+    cell_rows = scene.cell_daughters[ragged_arange(scene.cell_starts[found], counts)]
+    # the daughters in several cells once, and the large daughters
+    unique_pairs = np.unique(cell_pairs.astype(np.int64) * nrows + cell_rows)
+    counts = scene.nlarge[mothers[pairs]]
+    large_pairs = np.repeat(pairs, counts)
+    large_rows = scene.large_daughters[ragged_arange(scene.first_large[mothers[pairs]], counts)]
+    return (np.concatenate([every_rays, rays[unique_pairs // nrows], rays[large_pairs]]),
+            np.concatenate([every_rows, unique_pairs % nrows, large_rows]))
+
+
+# GBudgetMap class definition
+# The material budget of the rays from a point on a theta / phi grid:
+#
+# - origin: the point, in mm
+# - theta, phi: the (ntheta,) and (nphi,) angles of the rays, at the centers of the grid cells, in rad
+# - x0, lambda_i: the (ntheta, nphi) numbers of X0 and lambda_I crossed by the rays
+class GBudgetMap:
+    __slots__ = ('origin', 'theta', 'phi', 'x0', 'lambda_i')
+
+    def __init__(self, origin, theta, phi, x0, lambda_i):
+        self.origin = origin
+        self.theta = theta
+        self.phi = phi
+        self.x0 = x0
+        self.lambda_i = lambda_i
+
+    def save(self, file_name):
+        np.savez(file_name, origin=self.origin, theta=self.theta, phi=self.phi, x0=self.x0, lambda_i=self.lambda_i)
+
+
+# the (ntheta,) and (nphi,) angles at the centers of the grid cells
+def grid_angles(theta_range, phi_range, shape):
+    theta_edges = np.linspace(theta_range[0], theta_range[1], shape[0] + 1)
+    phi_edges = np.linspace(phi_range[0], phi_range[1], shape[1] + 1)
+    return (theta_edges[:-1] + theta_edges[1:]) / 2, (phi_edges[:-1] + phi_edges[1:]) / 2
+
+
+# The theta and phi ranges of the world bounding boxes seen from the origin, in rad: (n, 2) theta ranges and
+# (n, 2) phi ranges, within [-pi, pi] or, for the boxes behind the negative x axis, within [0, 2 pi]
+def angular_ranges(bounds, origin):
+    relative = bounds - origin
+    (xmin, ymin, zmin), (xmax, ymax, zmax) = relative[:, 0].T, relative[:, 1].T
+    rho_min = np.hypot(np.maximum(np.maximum(xmin, -xmax), 0), np.maximum(np.maximum(ymin, -ymax), 0))
+    rho_max = np.hypot(np.maximum(np.abs(xmin), np.abs(xmax)), np.maximum(np.abs(ymin), np.abs(ymax)))
+    # below the origin, theta decreases with rho
+    theta = np.stack([np.arctan2(np.where(zmax >= 0, rho_min, rho_max), zmax),
+                      np.arctan2(np.where(zmin <= 0, rho_min, rho_max), zmin)], axis=1)
+
+    corners = np.arctan2(np.stack([ymin, ymin, ymax, ymax], axis=1), np.stack([xmin, xmax, xmin, xmax], axis=1))
+    around_axis = (xmin <= 0) & (xmax >= 0) & (ymin <= 0) & (ymax >= 0)
+    behind = ~around_axis & (xmin < 0) & (ymin <= 0) & (ymax >= 0)
+    corners = np.where(behind[:, None], np.mod(corners, 2 * math.pi), corners)
+    phi = np.stack([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    phi[around_axis] = (-math.pi, 3 * math.pi)
+
+    inside = np.all((relative[:, 0] <= 0) & (relative[:, 1] >= 0), axis=1)
+    theta[inside] = (0, math.pi)
+    phi[inside] = (-math.pi, 3 * math.pi)
+    return theta, phi
+
+
+# the index ranges [first, last] of the grid angles within the (n, 2) ranges. One cell of margin for the rounding
+def index_ranges(angles, ranges):
+    step = angles[1] - angles[0] if len(angles) > 1 else 1.
+    first = np.ceil((ranges[:, 0] - angles[0]) / step) - 1
+    last = np.floor((ranges[:, 1] - angles[0]) / step) + 1
+    return np.clip(first, 0, len(angles) - 1).astype(int), np.clip(last, -1, len(angles) - 1).astype(int), first <= last
+
+
+# scene of the worker processes
+WORKER_SCENE = None
+
+
+def init_worker(scene):
+    global WORKER_SCENE
+    WORKER_SCENE = scene
+
+
+# The budget of the theta rows [first_row, last_row) of the grid: the (ray, volume) pairs are the grid cells of the
+# angular range of each volume, then the pairs are tested with the bounding boxes and computed exactly
+def band_budgets(band, scene=None):
+    scene = WORKER_SCENE if scene is None else scene
+    origin, theta, phi, first_row, last_row = band
+    nphi = len(phi)
+    rows = scene.rows
+    theta_ranges, phi_ranges = angular_ranges(scene.world_bounds[rows], origin)
+    theta_first, theta_last, theta_any = index_ranges(theta, theta_ranges)
+    theta_first = np.maximum(theta_first, first_row)
+    theta_last = np.minimum(theta_last, last_row - 1)
+
+    pairs_rays = []
+    pairs_rows = []
+    # the phi ranges are also tested shifted by one turn
+    for shift in (0, -2 * math.pi, 2 * math.pi):
+        phi_first, phi_last, phi_any = index_ranges(phi, phi_ranges + shift)
+        ntheta = np.where(theta_any & phi_any, np.maximum(theta_last - theta_first + 1, 0), 0)
+        nphis = np.where(theta_any & phi_any, np.maximum(phi_last - phi_first + 1, 0), 0)
+        counts = ntheta * nphis
+        volumes = np.repeat(np.arange(len(rows)), counts)
+        offsets = ragged_arange(0, counts)
+        cells_theta = theta_first[volumes] + offsets // nphis[volumes]
+        cells_phi = phi_first[volumes] + offsets % nphis[volumes]
+        pairs_rays.append((cells_theta - first_row) * nphi + cells_phi)
+        pairs_rows.append(rows[volumes])
+    rays = np.concatenate(pairs_rays)
+    volume_rows = np.concatenate(pairs_rows)
+    # the same cell can be found with two shifts for the volumes around the axis
+    unique_pairs = np.unique(volume_rows.astype(np.int64) * (last_row - first_row) * nphi + rays)
+    rays = unique_pairs % ((last_row - first_row) * nphi)
+    volume_rows = unique_pairs // ((last_row - first_row) * nphi)
+
+    sin_theta = np.sin(theta[first_row:last_row])
+    directions = np.stack([np.outer(sin_theta, np.cos(phi)).ravel(),
+                           np.outer(sin_theta, np.sin(phi)).ravel(),
+                           np.repeat(np.cos(theta[first_row:last_row]), nphi)], axis=1)
+    origins = np.broadcast_to(origin, directions.shape)
+    x0 = np.zeros(len(directions))
+    lambda_i = np.zeros(len(directions))
+    order = np.argsort(rays, kind='stable')
+    for start in range(0, len(order), RAYS_CHUNK * 8):
+        chunk = order[start:start + RAYS_CHUNK * 8]
+        add_budgets(scene, rays[chunk], volume_rows[chunk], origins, directions, np.inf, x0, lambda_i)
+    return x0.reshape(-1, nphi), lambda_i.reshape(-1, nphi)
+
+
+# The GBudgetMap of the rays from origin (in mm) on a grid of shape (ntheta, nphi) cells, between the theta and phi
+# ranges (in rad). The bands of theta rows are computed by nprocesses processes (all cores by default, 1 in this process)
+def material_budget_map(scene, origin=(0, 0, 0), theta_range=(0, math.pi), phi_range=(-math.pi, math.pi),
+                        shape=(180, 360), nprocesses=None):
+    origin = np.asarray(origin, dtype=float)
+    theta, phi = grid_angles(theta_range, phi_range, shape)
+    band_rows = max(1, RAYS_CHUNK // shape[1])
+    bands = [(origin, theta, phi, first_row, min(first_row + band_rows, shape[0])) for first_row in range(0, shape[0], band_rows)]
+
+    nprocesses = nprocesses or os.cpu_count() or 1
+    if nprocesses == 1 or len(bands) == 1:
+        results = [band_budgets(band, scene) for band in bands]
+    else:
+        with ProcessPoolExecutor(max_workers=nprocesses, initializer=init_worker, initargs=(scene,)) as executor:
+            results = list(executor.map(band_budgets, bands))
+    x0 = np.concatenate([band_x0 for band_x0, band_lambda in results])
+    lambda_i = np.concatenate([band_lambda for band_x0, band_lambda in results])
+    return GBudgetMap(origin, theta, phi, x0, lambda_i)
+
+
+# The following code allows this module to be executed as a main python script to map the material budget
+# To test, type:  'python gemc_api_raycast.py <system>__geometry_default.txt' on the command line
+if __name__ == "__main__":
+    import argparse
+    import time
+    from gemc_api_system import load_geometry
+
+    desc_str = ' Theta / phi maps of the X0 and lambda_I material budget of a published geometry, from a point\n'
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('geometry', help='TEXT (.txt) or JSON (.json) geometry file, or SQLITE database')
+    parser.add_argument('-s', '--system', help='system name, for the SQLITE database')
+    parser.add_argument('-v', '--variation', default='default', help='variation, for the SQLITE database')
+    parser.add_argument('-r', '--run', type=int, default=1, help='run number, for the SQLITE database')
+    parser.add_argument('--origin', type=float, nargs=3, default=(0, 0, 0), help='origin of the rays, in mm')
+    parser.add_argument('--theta', type=float, nargs=2, default=(0, 180), help='theta range, in deg')
+    parser.add_argument('--phi', type=float, nargs=2, default=(-180, 180), help='phi range, in deg')
+    parser.add_argument('--shape', type=int, nargs=2, default=(180, 360), help='number of theta and phi cells')
+    parser.add_argument('-j', '--processes', type=int, help='number of processes, all cores by default')
+    parser.add_argument('-o', '--output', default='material_budget.npz', help='output NumPy file')
+    args = parser.parse_args()
+
+    start = time.time()
+    gscene = GRayScene(load_geometry(args.geometry, args.system, args.variation, args.run))
+    budget_map = material_budget_map(gscene, args.origin, np.radians(args.theta), np.radians(args.phi),
+                                     args.shape, args.processes)
+    budget_map.save(args.output)
+    for material in gscene.unknown_materials:
+        print(f'  Warning: material {material} has no known composition or density, it does not add to the budget')
+    for name in gscene.unsupported_volumes:
+        print(f'  Warning: the solid of volume {name} is not supported, it does not add to the budget')
+    print(f'  X0: max {budget_map.x0.max():.4g}, mean {budget_map.x0.mean():.4g}')
+    print(f'  lambda_I: max {budget_map.lambda_i.max():.4g}, mean {budget_map.lambda_i.mean():.4g}')
+    print(f'  {budget_map.x0.size} rays in {time.time() - start:.2f}s, maps written to {args.output}')
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc rotations
+#
+# This file computes the 3x3 rotation matrix of a GVolume rotations string, as gemc builds it.
+#
+# A rotations string is a chain of rotations separated by ' + ' (see GVolume.add_rotation).
+# Each rotation of the chain is either:
+#
+# - "x, y, z": rotation around the x-, y-, and z- axes in order, for example "10*deg, 45*deg, 30*deg"
+# - "ordered: <order>, x, y, z": the same angles, applied in the given order, for example "ordered: zyx, 10*deg, 45*deg, 30*deg"
+#
+# Like the geant4 G4RotationMatrix rotateX, rotateY and rotateZ functions, each rotation around an axis multiplies
+# the matrix on the left: "x, y, z" is Rz(z) Ry(y) Rx(x), and the chain "A + B" is B A.
+# The matrix is the one given to the geant4 G4PVPlacement: the orientation of the volume in its mother is its inverse
+# (the transpose), so that a point p of the volume is R^T p + position in the mother.
+#
+# rotation_matrix keeps the matrices in an LRU cache keyed on the rotations string, and rotation_matrices
+# computes the (n, 3, 3) matrices of a whole column of strings, for example the "rotations" column of a system.
+# rotation_angles gives back the x, y, z angles of a single rotation with the same matrix:
+# GVolume.get_collapsed_rotation_string uses it to publish a chain as a single rotation.
+import sys
+import functools
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_units import parse_quantities, CACHESIZE
+
+# the chain separator. The + of exponents, like 1e+2, is not a separator
+CHAIN_SEPARATOR = re.compile(r'(?<![eE])\+')
+
+# below this value of cos(y), x and z rotate around the same axis: z is set to zero
+GIMBALLOCK = 1e-12
+
+
+# (n, 3, 3) matrices of the rotations around axis ('x', 'y' or 'z') by the angles, in rad
+def axis_rotations(axis, angles):
+    angles = np.asarray(angles, dtype=float)
+    c = np.cos(angles)
+    s = np.sin(angles)
+    matrices = np.zeros(angles.shape + (3, 3))
+    i, j = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}[axis]
+    k = 3 - i - j
+    matrices[..., k, k] = 1
+    matrices[..., i, i] = c
+    matrices[..., j, j] = c
+    matrices[..., i, j] = -s
+    matrices[..., j, i] = s
+    return matrices
+
+
+# (n, 3, 3) matrices of the single rotations of angles x, y, z (in rad, arrays or single values) applied in order
+def rotation_matrices_from_angles(x, y, z, order='xyz'):
+    if np is None:
+        sys.exit(' Error: rotation matrices require numpy')
+    angles = dict(zip('xyz', np.broadcast_arrays(x, y, z)))
+    if sorted(order) != ['x', 'y', 'z']:
+        sys.exit(' Error: rotation order ' + str(order) + ' must be a permutation of xyz')
+    matrices = axis_rotations(order[0], angles[order[0]])
+    for axis in order[1:]:
+        matrices = axis_rotations(axis, angles[axis]) @ matrices
+    return matrices
+
+
+# the angles (in rad) and order of a single rotation of the chain
+def parse_rotation(rotation):
+    order = 'xyz'
+    rotation = rotation.strip()
+    if rotation.startswith('ordered:'):
+        order, _, rotation = rotation[len('ordered:'):].partition(',')
+        order = order.strip()
+    angles = parse_quantities(rotation)
+    if len(angles) != 3:
+        sys.exit(' Error: rotation ' + repr(rotation) + ' must have 3 angles')
+    return angles, order
+
+
+# The 3x3 matrix of a rotations string. The matrix is read-only: it is shared by all volumes with the same string
+@functools.lru_cache(maxsize=CACHESIZE)
+def rotation_matrix(rotations):
+    matrix = np.identity(3)
+    for rotation in CHAIN_SEPARATOR.split(rotations):
+        angles, order = parse_rotation(rotation)
+        matrix = rotation_matrices_from_angles(*angles, order) @ matrix
+    matrix.flags.writeable = False
+    return matrix
+
+
+# (n, 3, 3) matrices of a column of n rotations strings. Each distinct string is composed only once
+def rotation_matrices(rotations):
+    if np is None:
+        sys.exit(' Error: rotation matrices require numpy')
+    distinct_rotations, inverse = np.unique(np.asarray(rotations, dtype=str), return_inverse=True)
+    distinct_matrices = np.array([rotation_matrix(rotation) for rotation in distinct_rotations.tolist()]).reshape(-1, 3, 3)
+    return distinct_matrices[inverse.reshape(-1)]
+
+
+# The x, y, z angles (in rad) of the single rotation "x, y, z" of each (..., 3, 3) matrix, that is Rz(z) Ry(y) Rx(x).
+# y is between -pi/2 and pi/2. When cos(y) is zero, x and z rotate around the same axis, and z is set to zero.
+def rotation_angles(matrices):
+    matrices = np.asarray(matrices, dtype=float)
+    y = np.arcsin(np.clip(-matrices[..., 2, 0], -1, 1))
+    locked = np.abs(np.cos(y)) < GIMBALLOCK
+    x = np.where(locked,
+                 np.arctan2(-matrices[..., 1, 2], matrices[..., 1, 1]),
+                 np.arctan2(matrices[..., 2, 1], matrices[..., 2, 2]))
+    z = np.where(locked, 0., np.arctan2(matrices[..., 1, 0], matrices[..., 0, 0]))
+    return x, y, z
+
+
+# The single rotation string with the same matrix as the rotations string, in degrees.
+# The angles are rounded to 1e-9 degrees, to remove the floating point noise of the composition
+@functools.lru_cache(maxsize=CACHESIZE)
+def collapsed_rotation_string(rotations):
+    angles = np.degrees(rotation_angles(rotation_matrix(rotations)))
+    return ', '.join(f'{round(float(angle), 9) + 0.}*deg' for angle in angles)
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc solids
+#
+# This file computes geometric quantities of the solids in solids_map.AVAILABLE_SOLIDS_MAP from their parameters,
+# for all the volumes of a GSystem at once.
+#
+# The parameters are taken in the canonical units (mm, rad): from GSolidParameters.canonical_values for the volumes
+# built with the make_* functions, or parsed from the published parameters string.
+# The volumes are grouped by solid kind, and each kind is computed with NumPy over all its volumes.
+# The G4Trap kind depends on its number of parameters: G4TrapRAW (4), G4TrapG (11) or G4Trap8 (24).
+#
+# Bounding boxes are (n, 2, 3) arrays: [:, 0] is the minimum x, y, z and [:, 1] the maximum.
+# The boxes of solids not supported (for example operations) are NaN.
+#
+# - local_bounding_boxes: the box of each solid in its own frame. Exact for box, trd and trap; for the solids with
+#   a phi (and theta) section, the extreme points of the section are used, so the box is tight for tubes and
+#   spheres sections and conservative for cones.
+# - world_bounding_boxes: the world-frame boxes of the local boxes, rotated and translated with the
+#   GSystem world transforms.
+#
+# local_vertices gives the 8 vertices of the convex polyhedral solids (box, trd and traps): a point set whose
+# convex hull is the solid. For the other solids, the 8 corners of their local bounding box are used.
+#
+# solid_volumes and solid_surfaces give the analytic volume, in mm3, and surface area, in mm2, of each solid.
+# The box, trd and traps are computed from their vertices, the other solids from their closed forms. NaN if not supported.
+import sys
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_units import parse_quantities
+
+TRAP_KINDS = {4: 'G4TrapRAW', 11: 'G4TrapG', 24: 'G4Trap8'}
+
+# the faces of the 8 vertices of trap_vertices, each with its vertices in cyclic order
+HEXAHEDRON_FACES = ((0, 1, 3, 2), (4, 5, 7, 6), (0, 1, 5, 4), (2, 3, 7, 6), (0, 2, 6, 4), (1, 3, 7, 5))
+
+
+# the concatenated ranges [start, start + count) of the (n,) starts (or a single start) and (n,) counts
+def ragged_arange(starts, counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    total = int(ends[-1]) if len(ends) else 0
+    return np.repeat(np.broadcast_to(starts, counts.shape) + counts - ends, counts) + np.arange(total)
+
+
+# the AVAILABLE_SOLIDS_MAP name of the solid, given its number of parameters
+def solid_kind(solid, nvalues):
+    if solid == 'G4Trap':
+        return TRAP_KINDS.get(nvalues, solid)
+    return solid
+
+
+# the canonical values of the solid parameters of each volume
+def solid_values(system):
+    values = []
+    for parameters in system.columns['parameters']:
+        if isinstance(parameters, str):
+            values.append(parse_quantities(parameters))
+        else:
+            values.append(parameters.canonical_values())
+    return values
+
+
+# the rows of each solid kind, and their parameters as a (k, nparams) array.
+# The polycones have a variable number of parameters: their parameters are a list of tuples
+def solid_groups(system):
+    groups = {}
+    for row, (solid, values) in enumerate(zip(system.columns['solid'], solid_values(system))):
+        kind = solid_kind(solid, len(values))
+        rows, kind_values = groups.setdefault(kind, ([], []))
+        rows.append(row)
+        kind_values.append(values)
+    for kind, (rows, kind_values) in groups.items():
+        if kind != 'G4Polycone' and kind in SOLIDS_BOUNDS:
+            kind_values = np.array(kind_values, dtype=float)
+        yield kind, np.asarray(rows, dtype=int), kind_values
+
+
+# (n, 2, 3) boxes from the minimum and maximum x, y, z arrays
+def boxes(xmin, ymin, zmin, xmax, ymax, zmax):
+    return np.stack([np.stack(np.broadcast_arrays(xmin, ymin, zmin), axis=-1),
+                     np.stack(np.broadcast_arrays(xmax, ymax, zmax), axis=-1)], axis=-2)
+
+
+# x, y bounds of the sections of rings between the radii rmin and rmax and the angles sphi and sphi + dphi:
+# the ends of the two edges, and the points of rmax along the axes that are inside the section
+def section_bounds(rmin, rmax, sphi, dphi):
+    full = dphi >= 2 * math.pi
+    ephi = sphi + dphi
+    xs = [rmin * np.cos(sphi), rmax * np.cos(sphi), rmin * np.cos(ephi), rmax * np.cos(ephi)]
+    ys = [rmin * np.sin(sphi), rmax * np.sin(sphi), rmin * np.sin(ephi), rmax * np.sin(ephi)]
+    xmin, xmax = np.minimum.reduce(xs), np.maximum.reduce(xs)
+    ymin, ymax = np.minimum.reduce(ys), np.maximum.reduce(ys)
+    for axis_phi, bound in ((0, 'xmax'), (math.pi / 2, 'ymax'), (math.pi, 'xmin'), (3 * math.pi / 2, 'ymin')):
+        inside = full | (np.mod(axis_phi - sphi, 2 * math.pi) <= dphi)
+        if bound == 'xmax':
+            xmax = np.where(inside, rmax, xmax)
+        elif bound == 'ymax':
+            ymax = np.where(inside, rmax, ymax)
+        elif bound == 'xmin':
+            xmin = np.where(inside, -rmax, xmin)
+        else:
+            ymin = np.where(inside, -rmax, ymin)
+    return xmin, ymin, xmax, ymax
+
+
+# G4Box: dx, dy, dz half lengths
+def box_bounds(values):
+    dx, dy, dz = values.T
+    return boxes(-dx, -dy, -dz, dx, dy, dz)
+
+
+# G4Tubs: rmin, rmax, dz, sphi, dphi
+def tubs_bounds(values):
+    rmin, rmax, dz, sphi, dphi = values.T
+    xmin, ymin, xmax, ymax = section_bounds(rmin, rmax, sphi, dphi)
+    return boxes(xmin, ymin, -dz, xmax, ymax, dz)
+
+
+# G4Cons: rmin1, rmax1, rmin2, rmax2, dz, sphi, dphi. The section of the smallest rmin and largest rmax
+def cons_bounds(values):
+    rmin1, rmax1, rmin2, rmax2, dz, sphi, dphi = values.T
+    xmin, ymin, xmax, ymax = section_bounds(np.minimum(rmin1, rmin2), np.maximum(rmax1, rmax2), sphi, dphi)
+    return boxes(xmin, ymin, -dz, xmax, ymax, dz)
+
+
+# G4Trd: dx1, dx2, dy1, dy2, dz
+def trd_bounds(values):
+    dx1, dx2, dy1, dy2, dz = values.T
+    dx = np.maximum(dx1, dx2)
+    dy = np.maximum(dy1, dy2)
+    return boxes(-dx, -dy, -dz, dx, dy, dz)
+
+
+# The (n, 8, 3) vertices of the general G4Trap: dz, theta, phi, dy1, dx1, dx2, alpha1, dy2, dx3, dx4, alpha2,
+# in the geant4 order: -dz face first, in each face the lower y edge first, in each edge the lower x first
+def trap_vertices(values):
+    dz, theta, phi, dy1, dx1, dx2, alpha1, dy2, dx3, dx4, alpha2 = values.T
+    tthetacphi = np.tan(theta) * np.cos(phi)
+    tthetasphi = np.tan(theta) * np.sin(phi)
+    talpha1 = np.tan(alpha1)
+    talpha2 = np.tan(alpha2)
+    vertices = []
+    for sign, dy, talpha, dx_low, dx_high in ((-1, dy1, talpha1, dx1, dx2), (1, dy2, talpha2, dx3, dx4)):
+        cx = sign * dz * tthetacphi
+        cy = sign * dz * tthetasphi
+        for ysign, dx in ((-1, dx_low), (1, dx_high)):
+            for xsign in (-1, 1):
+                vertices.append(np.stack([cx + ysign * dy * talpha + xsign * dx, cy + ysign * dy, sign * dz], axis=-1))
+    return np.stack(vertices, axis=1)
+
+
+# the general G4Trap parameters of the right angular wedge: pz, py, px, pltx full lengths
+def trap_raw_as_general(values):
+    pz, py, px, pltx = values.T
+    zeros = np.zeros_like(pz)
+    alpha = np.arctan(0.5 * (pltx - px) / py)
+    return np.stack([pz / 2, zeros, zeros, py / 2, px / 2, pltx / 2, alpha, py / 2, px / 2, pltx / 2, alpha], axis=-1)
+
+
+def vertices_bounds(vertices):
+    return np.stack([vertices.min(axis=1), vertices.max(axis=1)], axis=1)
+
+
+def trap_general_bounds(values):
+    return vertices_bounds(trap_vertices(values))
+
+
+def trap_raw_bounds(values):
+    return trap_general_bounds(trap_raw_as_general(values))
+
+
+# G4Trap from its 8 vertices
+def trap_eight_bounds(values):
+    return vertices_bounds(values.reshape(-1, 8, 3))
+
+
+# G4Sphere: rmin, rmax, sphi, dphi, stheta, dtheta
+def sphere_bounds(values):
+    rmin, rmax, sphi, dphi, stheta, dtheta = values.T
+    etheta = np.minimum(stheta + dtheta, math.pi)
+    # z = r cos(theta): cos is decreasing in [0, pi]
+    zmax = np.maximum(rmax * np.cos(stheta), rmin * np.cos(stheta))
+    zmin = np.minimum(rmax * np.cos(etheta), rmin * np.cos(etheta))
+    # distance from the z axis: r sin(theta), maximum at pi/2
+    sin_max = np.where((stheta <= math.pi / 2) & (etheta >= math.pi / 2), 1., np.maximum(np.sin(stheta), np.sin(etheta)))
+    sin_min = np.minimum(np.sin(stheta), np.sin(etheta))
+    xmin, ymin, xmax, ymax = section_bounds(rmin * sin_min, rmax * sin_max, sphi, dphi)
+    return boxes(xmin, ymin, zmin, xmax, ymax, zmax)
+
+
+# G4Polycone: sphi, dphi, nplanes, z[nplanes], rmin[nplanes], rmax[nplanes]. One polycone at a time
+def polycone_bounds(polycones_values):
+    bounds = []
+    for values in polycones_values:
+        sphi, dphi, nplanes = values[0], values[1], int(values[2])
+        z = values[3:3 + nplanes]
+        rmin = values[3 + nplanes:3 + 2 * nplanes]
+        rmax = values[3 + 2 * nplanes:3 + 3 * nplanes]
+        xmin, ymin, xmax, ymax = section_bounds(np.array(min(rmin)), np.array(max(rmax)), np.array(sphi), np.array(dphi))
+        bounds.append(boxes(xmin, ymin, min(z), xmax, ymax, max(z)))
+    return np.array(bounds).reshape(-1, 2, 3)
+
+
+SOLIDS_BOUNDS = {
+    'G4Box':      box_bounds,
+    'G4Tubs':     tubs_bounds,
+    'G4Cons':     cons_bounds,
+    'G4Trd':      trd_bounds,
+    'G4TrapRAW':  trap_raw_bounds,
+    'G4TrapG':    trap_general_bounds,
+    'G4Trap8':    trap_eight_bounds,
+    'G4Sphere':   sphere_bounds,
+    'G4Polycone': polycone_bounds,
+}
+
+
+# the general G4Trap parameters of the box and of the trd
+def box_as_general(values):
+    dx, dy, dz = values.T
+    zeros = np.zeros_like(dx)
+    return np.stack([dz, zeros, zeros, dy, dx, dx, zeros, dy, dx, dx, zeros], axis=-1)
+
+
+def trd_as_general(values):
+    dx1, dx2, dy1, dy2, dz = values.T
+    zeros = np.zeros_like(dx1)
+    return np.stack([dz, zeros, zeros, dy1, dx1, dx1, zeros, dy2, dx2, dx2, zeros], axis=-1)
+
+
+SOLIDS_VERTICES = {
+    'G4Box':     lambda values: trap_vertices(box_as_general(values)),
+    'G4Trd':     lambda values: trap_vertices(trd_as_general(values)),
+    'G4TrapRAW': lambda values: trap_vertices(trap_raw_as_general(values)),
+    'G4TrapG':   trap_vertices,
+    'G4Trap8':   lambda values: values.reshape(-1, 8, 3),
+}
+
+
+# (n, 8, 3) corners of (n, 2, 3) boxes
+def box_corners(bounds):
+    return np.stack([np.stack([bounds[:, i, 0], bounds[:, j, 1], bounds[:, k, 2]], axis=-1)
+                     for k in (0, 1) for j in (0, 1) for i in (0, 1)], axis=1)
+
+
+# (n, 8, 3) local vertices of the solids, in mm, and for each solid True if they are the vertices of
+# a convex polyhedral solid, False if they are the corners of its local bounding box
+def local_vertices(system, local_bounds=None):
+    if local_bounds is None:
+        local_bounds = local_bounding_boxes(system)
+    vertices = box_corners(local_bounds)
+    polyhedral = np.zeros(len(system), dtype=bool)
+    for kind, rows, values in solid_groups(system):
+        if kind in SOLIDS_VERTICES:
+            vertices[rows] = SOLIDS_VERTICES[kind](values)
+            polyhedral[rows] = True
+    return vertices, polyhedral
+
+
+# (n, 2, 3) bounding boxes of the solids in their own frame, in mm
+def local_bounding_boxes(system):
+    if np is None:
+        sys.exit(' Error: bounding boxes require numpy')
+    bounds = np.full((len(system), 2, 3), np.nan)
+    for kind, rows, values in solid_groups(system):
+        if kind in SOLIDS_BOUNDS:
+            bounds[rows] = SOLIDS_BOUNDS[kind](values)
+    return bounds
+
+
+# (n, 2, 3) world-frame axis-aligned bounding boxes of the local boxes, in mm
+def world_bounding_boxes(system, local_bounds=None):
+    if local_bounds is None:
+        local_bounds = local_bounding_boxes(system)
+    positions, rotations = system.world_transforms()
+    centers = (local_bounds[:, 0] + local_bounds[:, 1]) / 2
+    half_lengths = (local_bounds[:, 1] - local_bounds[:, 0]) / 2
+    world_centers = np.einsum('nij,nj->ni', rotations, centers) + positions
+    world_half_lengths = np.einsum('nij,nj->ni', np.abs(rotations), half_lengths)
+    return np.stack([world_centers - world_half_lengths, world_centers + world_half_lengths], axis=1)
+
+
+# volume and surface of the convex hexahedra of (n, 8, 3) vertices with planar faces: the faces are split in triangles,
+# and the volume is the sum of the tetrahedra of the triangles and the center of the vertices
+def hexahedron_volumes(vertices):
+    corners = vertices[:, np.array(HEXAHEDRON_FACES)] - vertices.mean(axis=1)[:, None, None]
+    volumes = np.zeros(len(vertices))
+    for first, second in ((1, 2), (2, 3)):
+        volumes += np.abs(np.einsum('nfi,nfi->nf', corners[:, :, 0],
+                                    np.cross(corners[:, :, first], corners[:, :, second]))).sum(axis=1) / 6
+    return volumes
+
+
+# the area of a planar quadrilateral is half the norm of the cross product of its diagonals
+def hexahedron_surfaces(vertices):
+    corners = vertices[:, np.array(HEXAHEDRON_FACES)]
+    diagonals_cross = np.cross(corners[:, :, 2] - corners[:, :, 0], corners[:, :, 3] - corners[:, :, 1])
+    return np.linalg.norm(diagonals_cross, axis=2).sum(axis=1) / 2
+
+
+# the phi section is full
+def full_phi(dphi):
+    return dphi >= 2 * math.pi
+
+
+# G4Tubs: a ring section of height 2 dz, with two phi cut rectangles if not full
+def tubs_volumes(values):
+    rmin, rmax, dz, sphi, dphi = values.T
+    return dphi * dz * (rmax ** 2 - rmin ** 2)
+
+
+def tubs_surfaces(values):
+    rmin, rmax, dz, sphi, dphi = values.T
+    lateral = dphi * (rmax + rmin) * 2 * dz
+    caps = dphi * (rmax ** 2 - rmin ** 2)
+    cuts = np.where(full_phi(dphi), 0, 2 * (rmax - rmin) * 2 * dz)
+    return lateral + caps + cuts
+
+
+# G4Cons: frustums of height 2 dz, with two phi cut trapezoids if not full
+def cons_volumes(values):
+    rmin1, rmax1, rmin2, rmax2, dz, sphi, dphi = values.T
+    return dphi * dz / 3 * ((rmax1 ** 2 + rmax1 * rmax2 + rmax2 ** 2) - (rmin1 ** 2 + rmin1 * rmin2 + rmin2 ** 2))
+
+
+def cons_surfaces(values):
+    rmin1, rmax1, rmin2, rmax2, dz, sphi, dphi = values.T
+    outer = dphi / 2 * (rmax1 + rmax2) * np.hypot(rmax2 - rmax1, 2 * dz)
+    inner = dphi / 2 * (rmin1 + rmin2) * np.hypot(rmin2 - rmin1, 2 * dz)
+    caps = dphi / 2 * (rmax1 ** 2 - rmin1 ** 2 + rmax2 ** 2 - rmin2 ** 2)
+    cuts = np.where(full_phi(dphi), 0, 2 * ((rmax1 - rmin1) + (rmax2 - rmin2)) * dz)
+    return outer + inner + caps + cuts
+
+
+# G4Sphere: spherical shell section, with the theta cones and the phi cut sectors
+def sphere_volumes(values):
+    rmin, rmax, sphi, dphi, stheta, dtheta = values.T
+    etheta = np.minimum(stheta + dtheta, math.pi)
+    return dphi / 3 * (rmax ** 3 - rmin ** 3) * (np.cos(stheta) - np.cos(etheta))
+
+
+def sphere_surfaces(values):
+    rmin, rmax, sphi, dphi, stheta, dtheta = values.T
+    etheta = np.minimum(stheta + dtheta, math.pi)
+    shells = dphi * (rmax ** 2 + rmin ** 2) * (np.cos(stheta) - np.cos(etheta))
+    cones = dphi / 2 * (rmax ** 2 - rmin ** 2) * (np.where(stheta > 0, np.sin(stheta), 0) +
+                                                   np.where(etheta < math.pi, np.sin(etheta), 0))
+    cuts = np.where(full_phi(dphi), 0, (etheta - stheta) * (rmax ** 2 - rmin ** 2))
+    return shells + cones + cuts
+
+
+# G4Polycone: the frustums between consecutive planes. One polycone at a time
+def polycone_planes(values):
+    nplanes = int(values[2])
+    planes = np.asarray(values[3:3 + 3 * nplanes], dtype=float).reshape(3, nplanes)
+    return values[1], planes[0], planes[1], planes[2]
+
+
+def polycone_volumes(polycones_values):
+    volumes = []
+    for values in polycones_values:
+        dphi, z, rmin, rmax = polycone_planes(values)
+        h = np.abs(np.diff(z))
+        volumes.append(np.sum(dphi * h / 6 * ((rmax[:-1] ** 2 + rmax[:-1] * rmax[1:] + rmax[1:] ** 2) -
+                                              (rmin[:-1] ** 2 + rmin[:-1] * rmin[1:] + rmin[1:] ** 2))))
+    return np.array(volumes)
+
+
+# the frustums of zero height are the steps between planes at the same z: their lateral surface is the step ring
+def polycone_surfaces(polycones_values):
+    surfaces = []
+    for values in polycones_values:
+        dphi, z, rmin, rmax = polycone_planes(values)
+        h = np.abs(np.diff(z))
+        lateral = dphi / 2 * np.sum((rmax[:-1] + rmax[1:]) * np.hypot(np.diff(rmax), h) +
+                                    (rmin[:-1] + rmin[1:]) * np.hypot(np.diff(rmin), h))
+        caps = dphi / 2 * (rmax[0] ** 2 - rmin[0] ** 2 + rmax[-1] ** 2 - rmin[-1] ** 2)
+        cuts = 0 if full_phi(dphi) else np.sum(((rmax - rmin)[:-1] + (rmax - rmin)[1:]) * h)
+        surfaces.append(lateral + caps + cuts)
+    return np.array(surfaces)
+
+
+SOLIDS_VOLUMES = {kind: lambda values, vertices=vertices: hexahedron_volumes(vertices(values))
+                  for kind, vertices in SOLIDS_VERTICES.items()}
+SOLIDS_VOLUMES.update({
+    'G4Tubs':     tubs_volumes,
+    'G4Cons':     cons_volumes,
+    'G4Sphere':   sphere_volumes,
+    'G4Polycone': polycone_volumes,
+})
+
+SOLIDS_SURFACES = {kind: lambda values, vertices=vertices: hexahedron_surfaces(vertices(values))
+                   for kind, vertices in SOLIDS_VERTICES.items()}
+SOLIDS_SURFACES.update({
+    'G4Tubs':     tubs_surfaces,
+    'G4Cons':     cons_surfaces,
+    'G4Sphere':   sphere_surfaces,
+    'G4Polycone': polycone_surfaces,
+})
+
+
+# (n,) volumes of the solids, in mm3
+def solid_volumes(system):
+    return solid_quantities(system, SOLIDS_VOLUMES)
+
+
+# (n,) surface areas of the solids, in mm2
+def solid_surfaces(system):
+    return solid_quantities(system, SOLIDS_SURFACES)
+
+
+def solid_quantities(system, solids_functions):
+    if np is None:
+        sys.exit(' Error: solid volumes and surfaces require numpy')
+    quantities = np.full(len(system), np.nan)
+    for kind, rows, values in solid_groups(system):
+        if kind in solids_functions:
+            quantities[rows] = solids_functions[kind](values)
+    return quantities
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc system
+#
+# This file defines the GSystem class that holds the volumes of a built system, in columns, for the
+# tools that need the whole geometry: world transforms, hierarchy, bounding boxes, masses.
+#
+# A GSystem can be:
+#
+# - recorded while the system is built: configuration.setKeepVolumes(True) before publishing the volumes,
+#   then configuration.volumes is the GSystem of the current variation.
+# - loaded from the published geometry: load_text_geometry, load_json_geometry and load_sqlite_geometry,
+#   or load_geometry that selects the loader from the file name and also loads the materials of the system.
+#
+# Columns (lists, one entry per volume, in publish order):
+#
+# - name, solid, material, mother, position, rotations: the published strings
+# - parameters: the GSolidParameters of the volumes built with the make_* functions, or the published string
+# - exist: 1 if the volume exists, 0 if not
+#
+# The materials of the system are kept in GSystem.materials, a dictionary of the GMaterial of each material name:
+# the materials published with configuration.volumes set, or loaded with load_text_materials,
+# load_json_materials and load_sqlite_materials. The loaded GMaterial have their name, density and composition.
+#
+# The children of each mother are indexed as the volumes are added. GSystem.hierarchy() returns the GHierarchy of the
+# volumes: their depth, subtree size, an order with each mother before its daughters, the missing mothers and the cycles.
+#
+# The world frame is the frame of the mother "root". The world transform of a volume maps a point p given in the
+# volume frame to the world frame: rotation @ p + position. The rotation is the orientation of the volume in the world.
+import sys
+import os
+import json
+import sqlite3
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_units import parse_quantities_column
+from gemc_api_rotations import rotation_matrices
+from gemc_api_materials import GMaterial
+
+WORLDVOLUME = 'root'
+
+# the GVolume fields kept by GSystem
+SYSTEM_FIELDS = ('name', 'solid', 'parameters', 'material', 'mother', 'position', 'rotations', 'exist')
+
+# the GVolume fields published by the factories: the TEXT columns, the JSON keys and the SQLITE geometry columns
+# (after system, variation and run) are in this order
+PUBLISHED_FIELDS = ('name', 'solid', 'parameters', 'material',
+                    'mother', 'position', 'rotations', 'mfield',
+                    'visible', 'style', 'color',
+                    'digitization', 'identifier',
+                    'copyOf', 'replicaOf', 'solidsOpr',
+                    'mirror',
+                    'exist', 'description')
+
+
+# GSystem class definition
+class GSystem:
+    __slots__ = ('columns', 'index', 'children', 'duplicates', 'cached_hierarchy', 'transforms', 'materials')
+
+    def __init__(self):
+        self.columns = {field: [] for field in SYSTEM_FIELDS}
+        # row of each volume name
+        self.index = {}
+        # rows of the daughters of each mother name
+        self.children = {}
+        # names published more than once
+        self.duplicates = []
+        # cached hierarchy and world transforms, reset when volumes are added
+        self.cached_hierarchy = None
+        self.transforms = None
+        # GMaterial of each material name
+        self.materials = {}
+
+    def __len__(self):
+        return len(self.columns['name'])
+
+    def add_volume(self, gvolume):
+        self.add_row(name=gvolume.name, solid=gvolume.solid, parameters=gvolume.parameters,
+                     material=gvolume.material, mother=gvolume.mother, position=gvolume.position,
+                     rotations=gvolume.get_rotation_string(), exist=gvolume.exist)
+
+    def add_material(self, gmaterial):
+        self.materials[gmaterial.name] = gmaterial
+
+    # fields: the SYSTEM_FIELDS values of the volume
+    def add_row(self, **fields):
+        self.add_rows({field: [fields[field]] for field in SYSTEM_FIELDS})
+
+    # columns: the SYSTEM_FIELDS lists of values of the volumes
+    def add_rows(self, columns):
+        first_row = len(self)
+        for row, (name, mother) in enumerate(zip(columns['name'], columns['mother']), first_row):
+            if name in self.index:
+                self.duplicates.append(name)
+            self.index[name] = row
+            self.children.setdefault(mother, []).append(row)
+        for field in SYSTEM_FIELDS:
+            self.columns[field].extend(columns[field])
+        self.cached_hierarchy = None
+        self.transforms = None
+
+    def hierarchy(self):
+        if self.cached_hierarchy is None:
+            self.cached_hierarchy = GHierarchy(self)
+        return self.cached_hierarchy
+
+    # (n,) True for the volumes built by geant4: the volumes that exist, are placed, and whose mother is built
+    def built_volumes(self):
+        if np is None:
+            sys.exit(' Error: built volumes require numpy')
+        hierarchy = self.hierarchy()
+        parents = np.asarray(hierarchy.parents, dtype=int)
+        built = np.array([int(exist) == 1 for exist in self.columns['exist']], dtype=bool)
+        built[np.asarray(hierarchy.depth, dtype=int) == 0] = False
+        for rows in hierarchy.levels()[1:]:
+            built[rows] &= built[parents[rows]]
+        return built
+
+    # (n,) True for the rows of the subtree of the volume name: the volume and all its descendants
+    def subtree_rows(self, name):
+        if np is None:
+            sys.exit(' Error: subtrees require numpy')
+        if name not in self.index:
+            sys.exit(f' Error: volume {name} not found in the system')
+        hierarchy = self.hierarchy()
+        parents = np.asarray(hierarchy.parents, dtype=int)
+        in_subtree = np.zeros(len(self), dtype=bool)
+        in_subtree[self.index[name]] = True
+        for rows in hierarchy.levels()[1:]:
+            in_subtree[rows] |= in_subtree[parents[rows]]
+        return in_subtree
+
+    # The world transforms of all volumes: (n, 3) positions, in mm, and (n, 3, 3) rotations, in the order of the rows.
+    # The volumes are processed one level of the hierarchy at a time: the transform of each mother is computed
+    # once, and the transforms of all the daughters of a level are composed from them in one NumPy operation.
+    def world_transforms(self):
+        if np is None:
+            sys.exit(' Error: world transforms require numpy')
+        if self.transforms is not None:
+            return self.transforms
+
+        nrows = len(self)
+        local_positions = parse_quantities_column(self.columns['position']).reshape(nrows, 3)
+        # the placement matrix is the inverse of the orientation of the volume in its mother
+        local_rotations = rotation_matrices(self.columns['rotations']).reshape(nrows, 3, 3).transpose(0, 2, 1)
+
+        hierarchy = self.hierarchy()
+        hierarchy.check()
+        positions = np.zeros((nrows, 3))
+        rotations = np.zeros((nrows, 3, 3))
+        all_parents = np.asarray(hierarchy.parents)
+        for rows in hierarchy.levels():
+            parents = all_parents[rows]
+            if hierarchy.depth[rows[0]] == 1:
+                positions[rows] = local_positions[rows]
+                rotations[rows] = local_rotations[rows]
+            else:
+                positions[rows] = np.einsum('nij,nj->ni', rotations[parents], local_positions[rows]) + positions[parents]
+                rotations[rows] = rotations[parents] @ local_rotations[rows]
+
+        self.transforms = (positions, rotations)
+        return self.transforms
+
+    # world position and rotation of the volume name
+    def world_transform(self, name):
+        positions, rotations = self.world_transforms()
+        row = self.index[name]
+        return positions[row], rotations[row]
+
+
+# GHierarchy class definition
+# The hierarchy of the volumes of a GSystem, computed in one linear pass over the volumes:
+#
+# - order: the rows of the volumes placed in the world volume, each mother before its daughters, level by level
+# - parents: the row of the mother of each volume, -1 for the daughters of the world volume and the volumes not placed
+# - depth: 1 for the daughters of the world volume, 2 for their daughters, etc. 0 for the volumes not placed
+# - subtree_sizes: the number of volumes in the subtree of each volume, itself included
+# - missing_mothers: the rows of the volumes of each mother name that is not defined
+# - cycles: the lists of volumes names that are each other's mothers
+# - duplicates: the names defined more than once
+class GHierarchy:
+    __slots__ = ('order', 'parents', 'depth', 'subtree_sizes', 'missing_mothers', 'cycles', 'duplicates')
+
+    def __init__(self, system):
+        names = system.columns['name']
+        mothers = system.columns['mother']
+        nrows = len(system)
+
+        # breadth first from the world volume. A row already visited (a duplicate name) is not visited twice
+        self.order = []
+        self.parents = [-1] * nrows
+        self.depth = [0] * nrows
+        level = system.children.get(WORLDVOLUME, [])
+        depth = 1
+        while level:
+            next_level = []
+            for row in level:
+                if self.depth[row]:
+                    continue
+                self.depth[row] = depth
+                self.order.append(row)
+                for daughter in system.children.get(names[row], []):
+                    self.parents[daughter] = row
+                    next_level.append(daughter)
+            level = next_level
+            depth += 1
+
+        self.subtree_sizes = [1] * nrows
+        for row in reversed(self.order):
+            if self.parents[row] >= 0:
+                self.subtree_sizes[self.parents[row]] += self.subtree_sizes[row]
+
+        # the volumes not placed either descend from a missing mother, or are in (or descend from) a cycle.
+        # Each chain of mothers is followed once: rows already classified stop the walk
+        self.missing_mothers = {}
+        self.cycles = []
+        state = [0 if depth == 0 else 2 for depth in self.depth]
+        for first_row in range(nrows):
+            path = []
+            row = first_row
+            while row is not None and state[row] == 0:
+                state[row] = 1
+                path.append(row)
+                mother = mothers[row]
+                row = system.index.get(mother)
+                if row is None and mother != WORLDVOLUME:
+                    self.missing_mothers.setdefault(mother, []).append(path[-1])
+            if row is not None and state[row] == 1:
+                self.cycles.append([names[cycle_row] for cycle_row in path[path.index(row):]])
+            for path_row in path:
+                state[path_row] = 2
+
+        self.duplicates = list(system.duplicates)
+
+    # the rows of each level, in order
+    def levels(self):
+        levels = []
+        for row in self.order:
+            if len(levels) < self.depth[row]:
+                levels.append([])
+            levels[-1].append(row)
+        return levels
+
+    # exits with the list of problems, if any
+    def check(self):
+        errors = []
+        for mother, rows in self.missing_mothers.items():
+            errors.append(f'mother {mother} of {len(rows)} volume(s) is not defined')
+        for cycle in self.cycles:
+            errors.append('volumes are mothers of each other: ' + ' -> '.join(cycle))
+        for name in self.duplicates:
+            errors.append(f'volume {name} is defined more than once')
+        if errors:
+            sys.exit(' Error: ' + '\n Error: '.join(errors))
+
+
+# GSystem of the TEXT factory geometry file
+def load_text_geometry(file_name):
+    system = GSystem()
+    with open(file_name) as geometry_file:
+        for line in geometry_file:
+            values = [value.strip() for value in line.split('|')]
+            if len(values) < len(PUBLISHED_FIELDS):
+                continue
+            fields = dict(zip(PUBLISHED_FIELDS, values))
+            fields['exist'] = int(fields['exist'])
+            system.add_row(**fields)
+    return system
+
+
+# GSystem of the JSON factory geometry file
+def load_json_geometry(file_name):
+    system = GSystem()
+    with open(file_name) as geometry_file:
+        records = json.load(geometry_file)
+    system.add_rows({field: [record[field] for record in records] for field in SYSTEM_FIELDS})
+    return system
+
+
+# GSystem of the SQLITE factory geometry table, for one system, variation and run
+def load_sqlite_geometry(sqlitedb_file, system_name, variation='default', runno=1):
+    system = GSystem()
+    sqlitedb = sqlite3.connect(sqlitedb_file)
+    query = "SELECT {} FROM geometry WHERE system = ? and variation = ? and run = ? ORDER BY id".format(", ".join(SYSTEM_FIELDS))
+    rows = sqlitedb.execute(query, (system_name, variation, runno)).fetchall()
+    sqlitedb.close()
+    system.add_rows({field: [row[i] for row in rows] for i, field in enumerate(SYSTEM_FIELDS)})
+    return system
+
+
+# GMaterial from its published name, density and composition
+def loaded_material(name, density, composition):
+    gmaterial = GMaterial(name)
+    gmaterial.density = float(density)
+    gmaterial.composition = composition
+    return gmaterial
+
+
+# adds the materials of the TEXT factory materials file to the system
+def load_text_materials(file_name, system):
+    with open(file_name) as materials_file:
+        for line in materials_file:
+            values = [value.strip() for value in line.split('|')]
+            if len(values) < 3:
+                continue
+            system.add_material(loaded_material(*values[:3]))
+    return system
+
+
+# adds the materials of the JSON factory materials file to the system
+def load_json_materials(file_name, system):
+    with open(file_name) as materials_file:
+        for record in json.load(materials_file):
+            system.add_material(loaded_material(record['name'], record['density'], record['composition']))
+    return system
+
+
+# adds the materials of the SQLITE factory materials table to the system, for one system, variation and run
+def load_sqlite_materials(sqlitedb_file, system, system_name, variation='default', runno=1):
+    sqlitedb = sqlite3.connect(sqlitedb_file)
+    query = "SELECT name, density, composition FROM materials WHERE system = ? and variation = ? and run = ? ORDER BY id"
+    for row in sqlitedb.execute(query, (system_name, variation, runno)).fetchall():
+        system.add_material(loaded_material(*row))
+    sqlitedb.close()
+    return system
+
+
+# GSystem of a published geometry: a TEXT (.txt) or JSON (.json) geometry file, or a SQLITE database, with its materials.
+# The materials file of a geometry file is the one written by the same configuration, if it exists
+def load_geometry(file_name, system_name=None, variation='default', runno=1):
+    if file_name.endswith('.txt') or file_name.endswith('.json'):
+        if file_name.endswith('.txt'):
+            system = load_text_geometry(file_name)
+            load_materials = load_text_materials
+        else:
+            system = load_json_geometry(file_name)
+            load_materials = load_json_materials
+        materials_file_name = file_name.replace('__geometry_', '__materials_')
+        if materials_file_name != file_name and os.path.exists(materials_file_name):
+            load_materials(materials_file_name, system)
+        return system
+    if system_name is None:
+        sys.exit(' Error: the system name is required to load the geometry of the SQLITE database ' + file_name)
+    system = load_sqlite_geometry(file_name, system_name, variation, runno)
+    return load_sqlite_materials(file_name, system, system_name, variation, runno)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc units
+#
+# This file converts the free-form "value*unit" strings used by sci-g to floats in the canonical
+# geant4 (CLHEP) units: mm for lengths, rad for angles, MeV for energies and ns for times.
+#
+# Examples of strings:
+#
+# - position, rotation and solid parameters:  "0*mm, 12.5*cm, -3*m", "90*deg, 0*deg, 0*deg"
+# - optical properties, space separated:       "0.187*eV 0.224*eV", "72.8*m 53.2*cm"
+# - numbers without units are returned as they are: "1.40 1.39 1.38"
+#
+# parse_quantity and parse_quantities keep the results in an LRU cache keyed on the raw string:
+# volumes built on grids repeat the same strings many times, and each one is parsed only once.
+# parse_quantity_column and parse_quantities_column convert a whole column of strings (for example the
+# "position" column of a SQLITE geometry table) into a NumPy array, parsing each distinct string once.
+import sys
+import functools
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The unit name, its value in the canonical unit of its dimension, and the dimension
+UNITS = {
+    # lengths, canonical unit: mm
+    'fm':   (1.e-12,           'length'),
+    'nm':   (1.e-6,            'length'),
+    'um':   (1.e-3,            'length'),
+    'mm':   (1.,               'length'),
+    'cm':   (10.,              'length'),
+    'm':    (1000.,            'length'),
+    'km':   (1.e6,             'length'),
+    # angles, canonical unit: rad
+    'urad': (1.e-6,            'angle'),
+    'mrad': (1.e-3,            'angle'),
+    'rad':  (1.,               'angle'),
+    'deg':  (math.pi / 180.,   'angle'),
+    # energies, canonical unit: MeV
+    'eV':   (1.e-6,            'energy'),
+    'keV':  (1.e-3,            'energy'),
+    'MeV':  (1.,               'energy'),
+    'GeV':  (1.e3,             'energy'),
+    'TeV':  (1.e6,             'energy'),
+    # times, canonical unit: ns
+    'ps':   (1.e-3,            'time'),
+    'ns':   (1.,               'time'),
+    'us':   (1.e3,             'time'),
+    'ms':   (1.e6,             'time'),
+    's':    (1.e9,             'time'),
+}
+
+CANONICAL_UNITS = {'length': 'mm', 'angle': 'rad', 'energy': 'MeV', 'time': 'ns'}
+
+# maximum number of distinct strings kept by the parse_quantity and parse_quantities caches
+CACHESIZE = 2 ** 20
+
+
+# the value of unit in the canonical unit of its dimension. None (no unit) is 1
+def unit_factor(unit):
+    if unit is None:
+        return 1.
+    if unit not in UNITS:
+        sys.exit(' Error: unit ' + str(unit) + ' not supported. Choices are: ' + ', '.join(UNITS))
+    return UNITS[unit][0]
+
+
+# "12.5*cm" is 125.0, "90*deg" is 1.5707963267948966, "1.40" is 1.4
+@functools.lru_cache(maxsize=CACHESIZE)
+def parse_quantity(string):
+    value, star, unit = string.strip().partition('*')
+    try:
+        number = float(value)
+    except ValueError:
+        sys.exit(' Error: ' + repr(string) + ' is not a value*unit quantity')
+    if star:
+        return number * unit_factor(unit.strip())
+    return number
+
+
+# "0*mm, 12.5*cm, -3*m" is (0.0, 125.0, -3000.0). The quantities can be separated by commas and / or spaces
+@functools.lru_cache(maxsize=CACHESIZE)
+def parse_quantities(string):
+    return tuple(parse_quantity(quantity) for quantity in string.replace(',', ' ').split())
+
+
+# Array of the canonical values of a column of "value*unit" strings, one value per string
+def parse_quantity_column(strings):
+    return parse_column(strings, parse_quantity)
+
+
+# (n, k) array of the canonical values of a column of n strings, each with k quantities
+def parse_quantities_column(strings):
+    return parse_column(strings, parse_quantities)
+
+
+# each distinct string is parsed only once
+def parse_column(strings, parse):
+    if np is None:
+        sys.exit(' Error: parsing a column of quantities requires numpy')
+    distinct_strings, inverse = np.unique(np.asarray(strings, dtype=str), return_inverse=True)
+    distinct_values = np.array([parse(string) for string in distinct_strings.tolist()], dtype=float)
+    return distinct_values[inverse.reshape(-1)]
+
+
+# The following code allows this module to be executed as a main python script to convert quantities
+# To test, type:  'python gemc_api_units.py "0*mm, 12.5*cm, -3*m" "0.187*eV 0.224*eV"' on the command line
+if __name__ == "__main__":
+    import argparse
+
+    desc_str = ' Converts value*unit strings to the canonical units: ' + ', '.join(CANONICAL_UNITS.values()) + '\n'
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('quantities', nargs='+', help='strings of value*unit quantities')
+    args = parser.parse_args()
+
+    for quantities in args.quantities:
+        print(f'  {quantities} : {parse_quantities(quantities)}')
@@ -10,11 +10,24 @@
 #	variation 	- The name of the project variation.  For example, one could have variations of the project where
 #					- a volume has a different size or material.  The variation defaults to 'default'
 #	factory		- The configuration factory defines how the generated files that gemc uses are stored.
-#					- Possible choices: TEXT, MYSQL, JSON
+#					- Possible choices: TEXT, SQLITE, MYSQL, JSON
+#					- JSON files contain an array of objects, one per volume or material, streamed as they are published.
 #	dbhost		- The hostname of the mysql database server where gemc detectors, materials, etc. may be stored
 #					- for the MYSQL factory. Default to "na".
 #	description	- A one liner describing the project
 #	verbosity	- The log verbosity level for the sci-g API. The default is 0 (print only summary information)
+#	sqliteBatchSize	- The number of rows written in a single transaction by the SQLITE factory. Default is 10000.
+#					- Rows are accumulated in the configuration and flushed when the batch is full or the sqlite file is closed.
+#					- A batch size of 1 writes and commits every row as soon as it is published.
+#	collapseRotations	- If True, the volumes rotations chains (see GVolume.add_rotation) are published as a single
+#					- "x, y, z" rotation with the same matrix. Default is False: the chains are published as they are.
+#	volumes		- The GSystem of the volumes published for the current variation and run, if setKeepVolumes(True)
+#					- was called before publishing them. Default is None: the volumes are not kept.
+#	orderVolumes	- If True, the volumes are written when the output is closed, each mother before its daughters,
+#					- instead of in publish order. Missing mothers, cycles and duplicate names are reported before writing.
+#					- Default is False.
+#	bufferSize	- The size in bytes of the write buffer used for the TEXT factory output files. Default is 1MB.
+#					- Each output file is opened once and kept open until close_files() is called (or the script exits)
 #	
 
 class gcolors:
@@ -29,9 +42,32 @@ class gcolors:
     UNDERLINE = '\033[4m'
     END = '\033[0m'
 
-from scig_sql import create_sqlite_database
+from scig_sql import create_sqlite_database, flush_sqlite_batches, apply_sqlite_profile, restore_sqlite_durability
+from scig_sql import load_sqlite_database, backup_sqlite_database, populate_sqlite_geometry_rows
+from gemc_api_system import GSystem
 import sqlite3
+import sys
+import atexit
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULTBUFFERSIZE = 1024 * 1024
+DEFAULTSQLITEBATCHSIZE = 10000
+
+# the configurations with open output files, SQLITE databases or volumes not written yet. They are closed at exit
+# (the SQLITE files too, so that append and in memory databases are committed and written), and released from this
+# set once closed, so that they can be garbage collected
+OPEN_CONFIGURATIONS = set()
+
+def close_open_configurations():
+    for configuration in list(OPEN_CONFIGURATIONS):
+        configuration.close_files()
+        if configuration.sqlitedb is not None:
+            configuration.close_sqlite_file()
+
+atexit.register(close_open_configurations)
 
 # Configuration class definition
 class GConfiguration():
@@ -41,19 +77,42 @@ class GConfiguration():
         self.factory = factory
         self.dbhost = "na"
         self.sqlitedb: sqlite3.Connection = None
+        self.sqliteBatchSize = DEFAULTSQLITEBATCHSIZE
+        self.sqliteRows = {}
+        self.sqliteColumns = {}
+        self.sqliteInserts = {}
+        self.sqliteAppend = False
+        self.sqliteReplaced = set()
+        self.sqliteProfile = None
+        self.sqliteInMemory = False
+        self.sqliteFileName = "na"
         self.description = description
         self.verbosity = 0
+        self.collapseRotations = False
+        self.volumes = None
+        self.orderVolumes = False
+        # orderVolumes: the geometry records not written yet, those of the last self.volumes rows
+        self.volumeRecords = []
         self.nvolumes = 0
         self.nmaterials = 0
         self.geoFileName = "na"
         self.matFileName = "na"
         self.mirFileName = "na"
+        # persistent, buffered output files, keyed by filename
+        self.bufferSize = DEFAULTBUFFERSIZE
+        self.writers = {}
+        # JSON factory: number of records written in each open file
+        self.jsonRecords = {}
         # filenames
         self.setVariation("default")
 
 
     def setVariation(self, newVariation):
+        # the filenames change with the variation: close the files of the previous one
+        self.close_files()
         self.variation = newVariation
+        if self.volumes is not None:
+            self.volumes = GSystem()
         # filenames
         if self.factory == "TEXT":
             self.geoFileName = self.system + "__geometry_" + str(self.variation) + ".txt"
@@ -65,28 +124,113 @@ class GConfiguration():
             self.mirFileName = self.system + "__mirrors_" + str(self.variation) + ".json"
 
     def setRunNo(self, runno):
+        # the SQLITE rows of the previous run are written with their run number
+        self.write_ordered_volumes()
         self.runno = runno
+        if self.volumes is not None:
+            self.volumes = GSystem()
+
+    # keeps the published volumes and materials in self.volumes, a GSystem, for the world transforms and the other system tools
+    def setKeepVolumes(self, keepVolumes):
+        self.volumes = GSystem() if keepVolumes else None
+
+    # writes the volumes each mother before its daughters, when the output is closed. The volumes are kept.
+    def setOrderVolumes(self, orderVolumes):
+        self.orderVolumes = orderVolumes
+        if orderVolumes and self.volumes is None:
+            self.setKeepVolumes(True)
+
+    # records: the TEXT lines, the JSON encoded records, or the SQLITE rows (without system, variation and run) of volumes
+    def write_volume_records(self, records):
+        if self.orderVolumes:
+            self.volumeRecords.extend(records)
+            OPEN_CONFIGURATIONS.add(self)
+        elif self.factory == "TEXT":
+            self.writer(self.geoFileName).writelines(records)
+        elif self.factory == "SQLITE":
+            populate_sqlite_geometry_rows(list(records), self)
+        elif self.factory == "JSON":
+            self.write_json_records(self.geoFileName, records)
+
+    # orderVolumes: writes the records of the volumes kept so far, each mother before its daughters
+    def write_ordered_volumes(self):
+        if not self.volumeRecords:
+            return
+        hierarchy = self.volumes.hierarchy()
+        hierarchy.check()
+        records = self.volumeRecords
+        first_row = len(self.volumes) - len(records)
+        self.volumeRecords = []
+        self.orderVolumes = False
+        self.write_volume_records([records[row - first_row] for row in hierarchy.order if row >= first_row])
+        self.orderVolumes = True
 
     def setVerbosity(self, verbosity):
         self.verbosity = verbosity
 
+    def setCollapseRotations(self, collapseRotations):
+        self.collapseRotations = collapseRotations
+
+    def setBufferSize(self, bufferSize):
+        self.bufferSize = bufferSize
+
+    def setSqliteBatchSize(self, sqliteBatchSize):
+        self.flush_sqlite_rows()
+        self.sqliteBatchSize = sqliteBatchSize
+
     def init_mysql_host(self, dbhost):
         self.dbhost = dbhost
 
-    def init_sqlite_file(self, sqlitedb_file):
+    # append: keep the existing database and replace only the rows of the (system, variation, run) being published.
+    #         All changes are committed in a single transaction when the file is closed, or at exit.
+    # profile: name of a performance profile in scig_sql.SQLITE_PROFILES, for example 'fast'.
+    #          The durable settings are restored, and the database analyzed and vacuumed, when the file is closed.
+    # in_memory: build the database in memory. It is written to sqlitedb_file only when the file is closed,
+    #            through a temporary file that atomically replaces sqlitedb_file.
+    def init_sqlite_file(self, sqlitedb_file, append=False, profile=None, in_memory=False):
         print()
-        # remove file if it exists
-        try:
-            os.remove(sqlitedb_file)
-            print("  ❖ Removed existing database file: {}".format(sqlitedb_file))
-        except OSError:
-            pass
+        self.sqliteFileName = sqlitedb_file
+        self.sqliteAppend = append
+        self.sqliteProfile = profile
+        self.sqliteInMemory = in_memory
+        self.sqliteReplaced = set()
+        # remove file if it exists. In memory, the file is replaced when the database is closed
+        if not append and not in_memory:
+            try:
+                os.remove(sqlitedb_file)
+                print("  ❖ Removed existing database file: {}".format(sqlitedb_file))
+            except OSError:
+                pass
+
+        if in_memory:
+            self.sqlitedb = sqlite3.connect(":memory:")
+            if append and os.path.exists(sqlitedb_file):
+                load_sqlite_database(sqlitedb_file, self.sqlitedb)
+        else:
+            self.sqlitedb = sqlite3.connect(sqlitedb_file)
+        if profile is not None:
+            apply_sqlite_profile(self.sqlitedb, profile)
+        create_sqlite_database(self)
+        OPEN_CONFIGURATIONS.add(self)
 
-        self.sqlitedb = sqlite3.connect(sqlitedb_file)
-        create_sqlite_database(self.sqlitedb)
+    # writes the rows accumulated by the SQLITE factory batching mode
+    def flush_sqlite_rows(self):
+        if self.sqlitedb is not None:
+            self.write_ordered_volumes()
+            flush_sqlite_batches(self)
 
     def close_sqlite_file(self):
+        self.flush_sqlite_rows()
+        self.sqlitedb.commit()
+        if self.sqliteProfile is not None:
+            restore_sqlite_durability(self.sqlitedb)
+        if self.sqliteInMemory:
+            backup_sqlite_database(self.sqlitedb, self.sqliteFileName)
+            print("  ❖ Database written to file: {}".format(self.sqliteFileName))
         self.sqlitedb.close()
+        self.sqlitedb = None
+        if not self.writers:
+            OPEN_CONFIGURATIONS.discard(self)
 
     def printC(self):
         print()
@@ -112,17 +256,133 @@ class GConfiguration():
     # overwrites any existing geometry file.
     def init_geom_file(self):
         if self.factory == "TEXT" or self.factory == "JSON":
-            open(self.geoFileName, "w")
+            self.open_writer(self.geoFileName, "w")
 
     # overwrites any existing material file.
     def init_mats_file(self):
         if self.factory == "TEXT" or self.factory == "JSON":
-            open(self.matFileName, "w")
+            self.open_writer(self.matFileName, "w")
 
     # overwrites any existing mirrors file.
     def init_mirs_file(self):
         if self.factory == "TEXT" or self.factory == "JSON":
-            open(self.mirFileName, "w")
+            self.open_writer(self.mirFileName, "w")
+
+    # opens (or re-opens with the given mode) the buffered writer for file_name
+    # JSON factory: a new array is started in the file, or in append mode the array of the file is continued
+    def open_writer(self, file_name, mode="a"):
+        self.close_file(file_name)
+        records = None
+        if self.factory == "JSON" and mode == "a":
+            records = reopen_json_array(file_name)
+        writer = open(file_name, mode, buffering=self.bufferSize)
+        self.writers[file_name] = writer
+        OPEN_CONFIGURATIONS.add(self)
+        if self.factory == "JSON":
+            if records is None:
+                writer.write("[")
+                records = 0
+            self.jsonRecords[file_name] = records
+        return writer
+
+    # returns the buffered writer for file_name. The file is opened in append mode the first time.
+    def writer(self, file_name):
+        writer = self.writers.get(file_name)
+        if writer is None:
+            writer = self.open_writer(file_name)
+        return writer
+
+    # JSON factory: appends record (a dictionary) to the array in file_name.
+    # Records are streamed to the buffered writer, so memory use does not depend on the number of records.
+    def write_json_record(self, file_name, record):
+        self.write_json_records(file_name, [json.dumps(record)])
+
+    # JSON factory: appends the already encoded records (JSON strings) to the array in file_name
+    def write_json_records(self, file_name, encoded_records):
+        writer = self.writer(file_name)
+        for encoded_record in encoded_records:
+            if self.jsonRecords[file_name] > 0:
+                writer.write(",")
+            writer.write("\n" + encoded_record)
+            self.jsonRecords[file_name] += 1
+
+    # writes the buffered content of all output files to disk
+    def flush_files(self):
+        for writer in self.writers.values():
+            writer.flush()
+
+    # JSON factory: the array is terminated before closing the file
+    def close_file(self, file_name):
+        writer = self.writers.pop(file_name, None)
+        if writer is not None:
+            if self.jsonRecords.pop(file_name, None) is not None:
+                writer.write("\n]\n")
+            writer.close()
+
+    # flushes and closes all output files. Files are re-opened in append mode if written to again:
+    # the JSON arrays are continued.
+    def close_files(self):
+        self.write_ordered_volumes()
+        for file_name in list(self.writers):
+            self.close_file(file_name)
+        if self.sqlitedb is None and not self.volumeRecords:
+            OPEN_CONFIGURATIONS.discard(self)
+
+
+# JSON factory: removes the end of the array of the existing file_name, so that records can be appended to it.
+# Returns 1 if the array has records, 0 if it is empty, None if the file does not exist or is empty
+def reopen_json_array(file_name):
+    if not os.path.exists(file_name) or os.path.getsize(file_name) == 0:
+        return None
+    with open(file_name, "rb+") as json_file:
+        content = json_file.read()
+        end = content.rstrip().rfind(b"]")
+        start = content.find(b"[")
+        if start < 0 or end < start:
+            sys.exit(' Error: ' + file_name + ' is not a JSON array, it cannot be appended to')
+        body = content[start + 1:end].rstrip()
+        json_file.seek(start + 1 + len(body))
+        json_file.truncate()
+    return 1 if body.strip() else 0
+
+
+# Builds each variation (and run number) in its own process, using up to nprocesses processes (default: all cores).
+# build must be a module level function with signature build(variation, runno) that builds
+# the variation and returns its GConfiguration. Its output files are closed after the build.
+# Different variations write to different TEXT / JSON files; SQLITE builds should use one database file per variation.
+# Returns the list of (variation, runno, nvolumes, nmaterials, seconds), in the order of variations and runs,
+# and prints it as a summary.
+def build_variations(build, variations, runs=(1,), nprocesses=None):
+    # sets have no order: sort them so that the output is always the same
+    if isinstance(variations, (set, frozenset)):
+        variations = sorted(variations)
+
+    builds = [(variation, runno) for variation in variations for runno in runs]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=nprocesses) as executor:
+        results = list(executor.map(build_and_count,
+                                    [build] * len(builds),
+                                    [variation for variation, runno in builds],
+                                    [runno for variation, runno in builds]))
+    elapsed = time.perf_counter() - start
+
+    print()
+    print("    ❖ Sci-g build of " + str(len(results)) + " variation(s) in {:.2f}s".format(elapsed))
+    for variation, runno, nvolumes, nmaterials, seconds in results:
+        print("    ▪︎ Variation: {}, run: {}, volumes: {}, materials: {}, time: {:.2f}s".format(variation, runno,
+                                                                                          nvolumes, nmaterials,
+                                                                                          seconds))
+    print()
+    return results
+
+# runs one build in a build_variations worker process and returns its counts and timing
+def build_and_count(build, variation, runno):
+    start = time.perf_counter()
+    configuration = build(variation, runno)
+    configuration.close_files()
+    if configuration.sqlitedb is not None:
+        configuration.close_sqlite_file()
+    return variation, runno, configuration.nvolumes, configuration.nmaterials, time.perf_counter() - start
 
 
 # The following code allows this module to be executed as a main python script for the purpose of testing the functions
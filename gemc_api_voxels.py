@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# =======================================
+# gemc voxels
+#
+# This file rasterizes a GSystem, or the subtree of one of its volumes, into a 3D grid of materials and densities,
+# without geant4: for quick-look images and fast dose approximations.
+#
+# Each voxel takes the material and density of the deepest volume that contains its center
+# (gemc_api_navigator.GNavigator). The materials grid has the index of the voxel material in GVoxelGrid.materials,
+# -1 for the voxels outside the volumes (or outside the subtree). The densities grid is in g/cm3, 0 outside the volumes
+# and NaN for the materials without density (gemc_api_mass.material_density).
+#
+# The grid is computed in slabs of z planes of about VOXELS_CHUNK voxels, so that the memory used does not depend on
+# the size of the grid. The slabs are distributed to a process pool, with at most two slabs per process in flight.
+# The grids can be NumPy arrays, or memory-mapped .npy files written slab by slab.
+import sys
+import math
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from gemc_api_navigator import GNavigator
+from gemc_api_mass import material_densities
+
+# approximate number of voxels computed at once
+VOXELS_CHUNK = 1 << 20
+
+
+# GVoxelGrid class definition
+# - origin: the (3,) corner of the grid, in mm: voxel (i, j, k) is centered at origin + (i + 0.5, j + 0.5, k + 0.5) * voxel
+# - voxel: the (3,) voxel size, in mm
+# - shape: the number of voxels along x, y, z
+# - materials: the material names of the indices
+# - material_indices: the (nx, ny, nz) material index grid, int16, -1 outside the volumes
+# - densities: the (nx, ny, nz) density grid, float32, in g/cm3
+class GVoxelGrid:
+    __slots__ = ('origin', 'voxel', 'shape', 'materials', 'material_indices', 'densities')
+
+    def __init__(self, origin, voxel, shape, materials, material_indices, densities):
+        self.origin = origin
+        self.voxel = voxel
+        self.shape = shape
+        self.materials = materials
+        self.material_indices = material_indices
+        self.densities = densities
+
+    # the (n,) coordinates of the voxel centers along axis 0, 1 or 2
+    def centers(self, axis):
+        return self.origin[axis] + (np.arange(self.shape[axis]) + 0.5) * self.voxel[axis]
+
+    # the known mass of the voxels, in kg
+    def total_mass(self):
+        voxel_volume = float(np.prod(self.voxel))
+        mass = sum(float(np.nansum(self.densities[i], dtype=np.float64)) for i in range(self.shape[0]))
+        # g/cm3 times mm3 in kg
+        return mass * voxel_volume * 1.e-6
+
+    def save(self, file_name):
+        np.savez(file_name, origin=self.origin, voxel=self.voxel, materials=np.array(self.materials, dtype=str),
+                 material_indices=self.material_indices, densities=self.densities)
+
+
+# arrays of the worker processes: the navigator, the material index and the density of each row (the last entry is
+# the world volume), and the grid origin, voxel and shape
+WORKER_ARRAYS = None
+
+
+def init_worker(arrays):
+    global WORKER_ARRAYS
+    WORKER_ARRAYS = arrays
+
+
+# the material indices and densities of the z planes [first_plane, last_plane)
+def slab_voxels(planes, arrays=None):
+    navigator, row_materials, row_densities, origin, voxel, shape = WORKER_ARRAYS if arrays is None else arrays
+    first_plane, last_plane = planes
+    x = origin[0] + (np.arange(shape[0]) + 0.5) * voxel[0]
+    y = origin[1] + (np.arange(shape[1]) + 0.5) * voxel[1]
+    z = origin[2] + (np.arange(first_plane, last_plane) + 0.5) * voxel[2]
+    points = np.stack(np.meshgrid(x, y, z, indexing='ij'), axis=-1).reshape(-1, 3)
+    located = navigator.locate(points).reshape(shape[0], shape[1], -1)
+    return first_plane, row_materials[located], row_densities[located]
+
+
+# The GVoxelGrid of the system, or of the subtree of the volume mother, with voxels of size voxel (mm, a number or
+# x, y, z sizes). The grid covers the bounds ((xmin, ymin, zmin), (xmax, ymax, zmax)) in mm, by default the world
+# bounding boxes of the voxelized volumes.
+# output: base name of the memory-mapped <output>_materials.npy and <output>_densities.npy grids, and of the
+#         <output>_voxels.json grid description. The grids are NumPy arrays if None
+# nprocesses: number of processes, all cores by default, 1 in this process
+# densities: optional dictionary of material densities, in g/cm3, that replace the system ones
+def voxelize(system, voxel, mother=None, bounds=None, output=None, nprocesses=None, densities=None):
+    if np is None:
+        sys.exit(' Error: the voxelizer requires numpy')
+    navigator = GNavigator(system)
+    voxelized = np.zeros(len(system), dtype=bool)
+    voxelized[navigator.rows] = True
+    if mother is not None:
+        voxelized &= system.subtree_rows(mother)
+    if not voxelized.any():
+        sys.exit(' Error: no volume to voxelize')
+
+    if bounds is None:
+        world_bounds = navigator.world_bounds[voxelized]
+        bounds = (world_bounds[:, 0].min(axis=0), world_bounds[:, 1].max(axis=0))
+    bounds = np.asarray(bounds, dtype=float)
+    voxel = np.broadcast_to(np.asarray(voxel, dtype=float), 3).copy()
+    shape = tuple(max(1, int(math.ceil(extent - 1.e-9))) for extent in ((bounds[1] - bounds[0]) / voxel).tolist())
+    origin = bounds[0]
+
+    # the material index and density of each row, the last entry is the world volume
+    materials = sorted({system.columns['material'][row] for row in np.flatnonzero(voxelized).tolist()})
+    material_index = {material: i for i, material in enumerate(materials)}
+    row_materials = np.full(len(system) + 1, -1, dtype=np.int16 if len(materials) < 2 ** 15 else np.int32)
+    row_densities = np.zeros(len(system) + 1, dtype=np.float32)
+    rows = np.flatnonzero(voxelized)
+    row_materials[rows] = [material_index[system.columns['material'][row]] for row in rows.tolist()]
+    row_densities[rows] = material_densities(system, [system.columns['material'][row] for row in rows.tolist()], densities)
+
+    if output is None:
+        material_indices = np.empty(shape, dtype=row_materials.dtype)
+        grid_densities = np.empty(shape, dtype=np.float32)
+    else:
+        material_indices = np.lib.format.open_memmap(output + '_materials.npy', mode='w+', dtype=row_materials.dtype, shape=shape)
+        grid_densities = np.lib.format.open_memmap(output + '_densities.npy', mode='w+', dtype=np.float32, shape=shape)
+        with open(output + '_voxels.json', 'w') as description:
+            json.dump({'origin': origin.tolist(), 'voxel': voxel.tolist(), 'shape': list(shape), 'materials': materials},
+                      description, indent=4)
+
+    planes = max(1, VOXELS_CHUNK // (shape[0] * shape[1]))
+    slabs = [(first_plane, min(first_plane + planes, shape[2])) for first_plane in range(0, shape[2], planes)]
+    arrays = (navigator, row_materials, row_densities, origin, voxel, shape)
+
+    def write(slab):
+        first_plane, slab_materials, slab_densities = slab
+        material_indices[:, :, first_plane:first_plane + slab_materials.shape[2]] = slab_materials
+        grid_densities[:, :, first_plane:first_plane + slab_materials.shape[2]] = slab_densities
+
+    nprocesses = nprocesses or os.cpu_count() or 1
+    if nprocesses == 1 or len(slabs) == 1:
+        for slab_planes in slabs:
+            write(slab_voxels(slab_planes, arrays))
+    else:
+        # at most two slabs per process are computed or waiting to be written
+        with ProcessPoolExecutor(max_workers=nprocesses, initializer=init_worker, initargs=(arrays,)) as executor:
+            pending = set()
+            for slab_planes in slabs:
+                if len(pending) >= 2 * nprocesses:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(future.result())
+                pending.add(executor.submit(slab_voxels, slab_planes))
+            for future in pending:
+                write(future.result())
+
+    if output is not None:
+        material_indices.flush()
+        grid_densities.flush()
+    return GVoxelGrid(origin, voxel, shape, materials, material_indices, grid_densities)
+
+
+# The following code allows this module to be executed as a main python script to voxelize a published geometry
+# To test, type:  'python gemc_api_voxels.py <system>__geometry_default.txt -x 1' on the command line
+if __name__ == "__main__":
+    import argparse
+    import time
+    from gemc_api_system import load_geometry
+
+    desc_str = ' Material index and density grids of a published geometry\n'
+    parser = argparse.ArgumentParser(description=desc_str)
+    parser.add_argument('geometry', help='TEXT (.txt) or JSON (.json) geometry file, or SQLITE database')
+    parser.add_argument('-s', '--system', help='system name, for the SQLITE database')
+    parser.add_argument('-v', '--variation', default='default', help='variation, for the SQLITE database')
+    parser.add_argument('-r', '--run', type=int, default=1, help='run number, for the SQLITE database')
+    parser.add_argument('-x', '--voxel', type=float, nargs='+', default=[1.], help='voxel size, or x y z sizes, in mm')
+    parser.add_argument('-m', '--mother', help='voxelize the subtree of this volume')
+    parser.add_argument('-j', '--processes', type=int, help='number of processes, all cores by default')
+    parser.add_argument('-o', '--output', default='voxels', help='base name of the memory-mapped .npy grids')
+    args = parser.parse_args()
+
+    start = time.time()
+    grid = voxelize(load_geometry(args.geometry, args.system, args.variation, args.run), args.voxel, args.mother,
+                    output=args.output, nprocesses=args.processes)
+    print(f'  {grid.shape[0]} x {grid.shape[1]} x {grid.shape[2]} voxels of {" x ".join(f"{size:g}" for size in grid.voxel)} mm'
+          f' in {time.time() - start:.2f}s, written to {args.output}_materials.npy and {args.output}_densities.npy')
+    for index, material in enumerate(grid.materials):
+        print(f'    {index:4d} {material}')
+    print(f'  Voxelized mass: {grid.total_mass():.6g} kg')
@@ -7,6 +7,7 @@ import os
 
 # from gemc_api_geometry import *
 from solids_map import AVAILABLE_SOLIDS_MAP
+from gemc_api_units import UNITS
 
 _logger = logging.getLogger("sci-g")
 
@@ -121,7 +122,7 @@ def write_templates(system, variations):
         ps.write('import logging\n')
         ps.write('import subprocess\n\n')
         ps.write('# sci-g:\n')
-        ps.write('from gemc_api_utils import GConfiguration\n\n')
+        ps.write('from gemc_api_utils import GConfiguration, build_variations\n\n')
         ps.write(f'# {system}:\n')
         ps.write('from materials import define_materials\n')
         ps.write(f'from geometry import build_{system}\n\n')
@@ -132,6 +133,20 @@ def write_templates(system, variations):
             ps.write(f'    \"{v}",\n')
         ps.write('}\n\n')
 
+        ps.write('def build_variation(variation, runno):\n\n')
+        ps.write(f'	_logger.info(f"Building {system} volumes for variation')
+        ps.write(' {variation}")\n')
+        ps.write('	# Define GConfiguration name, factory and description.\n')
+        ps.write(f'	configuration = GConfiguration(\'{system}\', \'TEXT\', \'The {system} system\')\n')
+        ps.write('	configuration.setVariation(variation)\n')
+        ps.write('	configuration.setRunNo(runno)\n\n')
+        ps.write('	# define materials\n')
+        ps.write('	configuration.init_mats_file()\n')
+        ps.write('	define_materials(configuration)\n\n')
+        ps.write('	# build geometry\n')
+        ps.write('	configuration.init_geom_file()\n')
+        ps.write(f'	build_{system}(configuration)\n\n')
+        ps.write('	return configuration\n\n\n')
         ps.write('def main():\n')
         ps.write('	logging.basicConfig(level=logging.DEBUG)\n\n')
         ps.write('	# Provides the -h, --help message\n')
@@ -139,20 +154,8 @@ def write_templates(system, variations):
         ps.write(' system\\n"\n')
         ps.write('	parser = argparse.ArgumentParser(description=desc_str)\n')
         ps.write('	args = parser.parse_args()\n\n')
-        ps.write('	for variation in VARIATIONS:\n\n')
-        ps.write(f'		_logger.info(f"Building {system} volumes for variation')
-        ps.write(' {variation}")\n')
-        ps.write('		# Define GConfiguration name, factory and description.\n')
-        ps.write(f'		configuration = GConfiguration(\'{system}\', \'TEXT\', \'The {system} system\')\n')
-        ps.write('		configuration.setVariation(variation)\n\n')
-        ps.write('		# define materials\n')
-        ps.write('		configuration.init_mats_file()\n')
-        ps.write('		define_materials(configuration)\n\n')
-        ps.write('		# build geometry\n')
-        ps.write('		configuration.init_geom_file()\n')
-        ps.write(f'		build_{system}(configuration)\n\n')
-        ps.write('		# print out the GConfiguration\n')
-        ps.write('		configuration.printC()\n\n\n')
+        ps.write('	# the variations are independent: build them in parallel and print a summary\n')
+        ps.write('	build_variations(build_variation, VARIATIONS)\n\n\n')
         ps.write('if __name__ == "__main__":\n')
         ps.write('	main()\n\n\n')
     # change permission
@@ -270,7 +273,7 @@ def write_templates(system, variations):
 
 def check_units(unit_string) -> str:
     """check if units are valid and return the unit string"""
-    if unit_string in ['mm', 'cm', 'm', 'rad', 'deg', 'mrad', 'urad', 'ns', 's', 'MeV', 'GeV', 'keV', 'eV']:
+    if unit_string in UNITS:
         return unit_string
 
 
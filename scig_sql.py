@@ -1,25 +1,43 @@
 #!/usr/bin/env python3
 
 # Purposes:
-# 1. function to create a sqlite database file with the geometry and materials tables
+# 1. function to create the geometry and materials tables in a sqlite database file
 # 2. functions to fill the tables with the geometry and materials of a system
 
 import argparse
 import sys
+import os
 import sqlite3
 
 NGIVEN: str = 'NOTGIVEN'
 NGIVENS: [str] = ['NOTGIVEN']
 
+# SQLITE performance profiles: PRAGMA values applied in order for the duration of a build.
+# - fast: write-ahead log, no fsync at every commit, 256MB page cache, 64KB pages
+#         and an exclusive lock on the database file until it is closed.
+# The page_size must be set before the tables are created (or the database is vacuumed).
+SQLITE_PROFILES = {
+    'fast': [('page_size',    65536),
+             ('journal_mode', 'WAL'),
+             ('synchronous',  'NORMAL'),
+             ('cache_size',   -262144),
+             ('temp_store',   'MEMORY'),
+             ('locking_mode', 'EXCLUSIVE')]
+}
+
+# restored when the database is closed: a single file, fsync at each commit, no lock kept
+SQLITE_DURABLE_SETTINGS = [('journal_mode', 'DELETE'),
+                           ('synchronous',  'FULL'),
+                           ('locking_mode', 'NORMAL')]
+
 
 def main():
     # Provides the -h, --help message
     desc_str = "   SCI-G sql interface\n"
     sqlitedb: sqlite3.Connection = None
 
-    variation_filter = ''
-    system_filter = ''
-    runno_filter = ''
+    filters = []
+    filter_values = []
 
     what = "*"
 
@@ -42,31 +60,31 @@ def main():
     if args.l != NGIVEN:
         sqlitedb = sqlite3.connect(args.l)
 
-    if args.vf:
-        variation_filter = f" WHERE variation = '{args.vf}'"
-
+    # the filters match the (system, variation, run) index of the tables
     if args.sf:
-        if args.vf:
-            system_filter = f" and system = '{args.sf}'"
-        else:
-            system_filter = f" WHERE system = '{args.sf}'"
+        filters.append("system = ?")
+        filter_values.append(args.sf)
+
+    if args.vf:
+        filters.append("variation = ?")
+        filter_values.append(args.vf)
 
     if args.rf:
-        if args.vf or args.sf:
-            runno_filter = f" and run = {args.rf}"
-        else:
-            runno_filter = f' WHERE run = {args.rf}'
+        filters.append("run = ?")
+        filter_values.append(int(args.rf))
 
-    all_filters = variation_filter + system_filter + runno_filter
+    all_filters = ''
+    if filters:
+        all_filters = " WHERE " + " and ".join(filters)
 
     if args.what:
         what = args.what
 
     if args.sv:
-        show_volumes_from_database(sqlitedb, what, all_filters)
+        show_volumes_from_database(sqlitedb, what, all_filters, filter_values)
 
     if args.sm:
-        show_materials_from_database(sqlitedb, what, all_filters)
+        show_materials_from_database(sqlitedb, what, all_filters, filter_values)
 
     # if no argument is given print help
     if len(sys.argv) == 1:
@@ -74,138 +92,194 @@ def main():
         print()
         sys.exit(1)
 
-def show_volumes_from_database(sqlitedb, what, all_filters):
+def show_volumes_from_database(sqlitedb, what, all_filters, filter_values=()):
     if sqlitedb is not None:
         sql = sqlitedb.cursor()
         query = "SELECT {} FROM geometry {};".format(what, all_filters)
-        print(query)
-        sql.execute( query )
+        print(query, filter_values)
+        sql.execute( query, filter_values )
         for row in sql.fetchall():
             print(row)
 
-def show_materials_from_database(sqlitedb, what, all_filters):
+def show_materials_from_database(sqlitedb, what, all_filters, filter_values=()):
     if sqlitedb is not None:
         sql = sqlitedb.cursor()
         query = "SELECT {} FROM materials {};".format(what, all_filters)
-        print(query)
-        sql.execute( query )
+        print(query, filter_values)
+        sql.execute( query, filter_values )
         for row in sql.fetchall():
             print(row)
 
 
-# create the database file (overwrite if it exists)
-# create the tables geometry, materials, mirrors, parameters
-def create_sqlite_database(sqlitedb):
-    sql = sqlitedb.cursor()
-
-    # Create geometry table with one column
-    sql.execute('''CREATE TABLE geometry
-                 (id integer primary key)''')
+# The columns of the geometry and materials tables, in order, with their types.
+# The GVolume and GMaterial fields are listed explicitly, matching the order of the TEXT factory.
+# Volumes only have integer flags, while all the materials numbers are physical quantities (REAL).
+GEOMETRY_COLUMNS = [("system",       "TEXT"),
+                    ("variation",    "TEXT"),
+                    ("run",          "INTEGER"),
+                    ("name",         "TEXT"),
+                    ("solid",        "TEXT"),
+                    ("parameters",   "TEXT"),
+                    ("material",     "TEXT"),
+                    ("mother",       "TEXT"),
+                    ("position",     "TEXT"),
+                    ("rotations",    "TEXT"),
+                    ("mfield",       "TEXT"),
+                    ("visible",      "INTEGER"),
+                    ("style",        "INTEGER"),
+                    ("color",        "TEXT"),
+                    ("digitization", "TEXT"),
+                    ("identifier",   "TEXT"),
+                    ("copyOf",       "TEXT"),
+                    ("replicaOf",    "TEXT"),
+                    ("solidsOpr",    "TEXT"),
+                    ("mirror",       "TEXT"),
+                    ("exist",        "INTEGER"),
+                    ("description",  "TEXT")]
+
+MATERIALS_COLUMNS = [("system",             "TEXT"),
+                     ("variation",          "TEXT"),
+                     ("run",                "INTEGER"),
+                     ("name",               "TEXT"),
+                     ("density",            "REAL"),
+                     ("composition",        "TEXT"),
+                     ("description",        "TEXT"),
+                     ("photonEnergy",       "TEXT"),
+                     ("indexOfRefraction",  "TEXT"),
+                     ("absorptionLength",   "TEXT"),
+                     ("reflectivity",       "TEXT"),
+                     ("efficiency",         "TEXT"),
+                     ("fastcomponent",      "TEXT"),
+                     ("slowcomponent",      "TEXT"),
+                     ("scintillationyield", "REAL"),
+                     ("resolutionscale",    "REAL"),
+                     ("fasttimeconstant",   "REAL"),
+                     ("slowtimeconstant",   "REAL"),
+                     ("yieldratio",         "REAL"),
+                     ("birksConstant",      "REAL"),
+                     ("rayleigh",           "TEXT")]
+
+
+# create the tables geometry and materials, each with all its typed columns
+def create_sqlite_database(configuration):
+    configuration.sqliteColumns = {}
+    configuration.sqliteInserts = {}
+    create_sqlite_table("geometry",  GEOMETRY_COLUMNS,  configuration)
+    create_sqlite_table("materials", MATERIALS_COLUMNS, configuration)
+
+# Create the table with all the typed columns in one statement.
+# The column names are cached in configuration.sqliteColumns.
+# The composite (system, variation, run) index makes the selection of a single system / variation an index seek.
+# The parameterized INSERT for the table is built once here and reused for all rows:
+# sqlite3 keeps it in its statement cache, so it is parsed and prepared only once.
+def create_sqlite_table(tablename, columns, configuration):
+    columns_definitions = ", ".join("{} {}".format(name, sql_type) for name, sql_type in columns)
+    with configuration.sqlitedb:
+        configuration.sqlitedb.execute("CREATE TABLE IF NOT EXISTS {} (id integer primary key, {})".format(tablename, columns_definitions))
+        configuration.sqlitedb.execute("CREATE INDEX IF NOT EXISTS {0}_system_variation_run ON {0} (system, variation, run)".format(tablename))
+
+    column_names = [name for name, sql_type in columns]
+    configuration.sqliteColumns[tablename] = column_names
+    configuration.sqliteInserts[tablename] = "INSERT INTO {} ({}) VALUES ({})".format(tablename,
+                                                                                    ", ".join(column_names),
+                                                                                    ", ".join("?" * len(column_names)))
 
-    # Create materials table with one column
-    sql.execute('''CREATE TABLE materials
-                 (id integer primary key)''')
-
-    # Save (commit) the changes
-    sqlitedb.commit()
-
-def add_geometry_fields_to_sqlite_if_needed(gvolume, configuration):
-
-    # check if the geometry table has the geometry columns
-    sql = configuration.sqlitedb.cursor()
-    sql.execute("SELECT name FROM PRAGMA_TABLE_INFO('geometry');")
-    fields = sql.fetchall()
-
-    # if there is only one column, add the columns
-    if len(fields) == 1:
-        add_column(configuration.sqlitedb, "geometry", "system",    "TEXT")
-        add_column(configuration.sqlitedb, "geometry", "variation", "TEXT")
-        add_column(configuration.sqlitedb, "geometry", "run",       "INTEGER")
-        # add columns from gvolume class
-        for field in gvolume.__dict__:
-            sql_type = sqltype_of_variable(gvolume.__dict__[field])
-            add_column(configuration.sqlitedb, "geometry", field, sql_type)
-    configuration.sqlitedb.commit()
-
-def add_materials_fields_to_sqlite_if_needed(gmaterial, configuration):
-
-    # check if the geometry table has the geometry columns
-    sql = configuration.sqlitedb.cursor()
-    sql.execute("SELECT name FROM PRAGMA_TABLE_INFO('materials');")
-    fields = sql.fetchall()
-
-    # if there is only one column, add the columns
-    if len(fields) == 1:
-        add_column(configuration.sqlitedb, "materials", "system",    "TEXT")
-        add_column(configuration.sqlitedb, "materials", "variation", "TEXT")
-        add_column(configuration.sqlitedb, "materials", "run",       "INTEGER")
-        # add columns from gmaterial class
-        for field in gmaterial.__dict__:
-            if field != 'compType' and field != 'totComposition':
-                sql_type = sqltype_of_variable(gmaterial.__dict__[field])
-                add_column(configuration.sqlitedb, "materials", field, sql_type)
-    configuration.sqlitedb.commit()
-
-
-def populate_sqlite_geometry(gvolume, configuration):
-    add_geometry_fields_to_sqlite_if_needed(gvolume, configuration)
-
-    sql = configuration.sqlitedb.cursor()
-
-    # form a string representing the gvolume columns of the table
-    columns = form_string_with_column_definitions(gvolume)
-    values  = form_string_with_column_values(gvolume, configuration)
-    #print(columns)
-    #print(values)
-    sql.execute("INSERT INTO geometry {} VALUES {}".format(columns, values))
-    configuration.sqlitedb.commit()
 
 def populate_sqlite_materials(gmaterial, configuration):
-    add_materials_fields_to_sqlite_if_needed(gmaterial, configuration)
-
-    sql = configuration.sqlitedb.cursor()
-    # form a string representing the gmaterial columns of the table
-    columns = form_string_with_column_definitions(gmaterial)
-    values  = form_string_with_column_values(gmaterial, configuration)
-    #print(columns)
-    #print(values)
-    sql.execute("INSERT INTO materials {} VALUES {}".format(columns, values))
-    configuration.sqlitedb.commit()
-
-
-def form_string_with_column_definitions(gobject) -> str:
-    strn = "( system, variation, run, "
-    for field in gobject.__dict__:
-        if field != 'compType' and field != 'totComposition':
-            #print(field)
-            strn += f"{field}, "
-    strn  = strn[:-2] + ")"
-    return strn
-
-def form_string_with_column_values(gobject, configuration) -> str:
-    strn = "( '{}', '{}', {}, ".format(configuration.system, configuration.variation, configuration.runno)
-    for field in gobject.__dict__:
-        if field != 'compType' and field != 'totComposition':
-            value = gobject.__dict__[field]
-            if type(value) is str:
-                value = "'{}'".format(value)
-            strn += f"{value}, "
-    strn  = strn[:-2] + ")"
-    return strn
-
-
-def sqltype_of_variable(variable) -> str:
-    if type(variable) is int:
-        return 'INT'
-    elif type(variable) is str:
-        return 'TEXT'
-
-def add_column(db, tablename, column_name, var_type):
-    sql = db.cursor()
-    strn = "ALTER TABLE {0} ADD COLUMN {1} {2}".format(tablename, column_name, var_type)
-    # print(strn)
-    sql.execute(strn)
-    db.commit()
+    populate_sqlite_table("materials", gmaterial, configuration)
+
+def populate_sqlite_table(tablename, gobject, configuration):
+    populate_sqlite_rows(tablename, [form_tuple_with_column_values(tablename, gobject, configuration)], configuration)
+
+# rows are tuples of the values of the table columns after system, variation and run, in the cached columns order.
+# Used by GVolume and GVolumeTable, through GConfiguration.write_volume_records
+def populate_sqlite_geometry_rows(rows, configuration):
+    key = (configuration.system, configuration.variation, configuration.runno)
+    populate_sqlite_rows("geometry", [key + row for row in rows], configuration)
+
+def populate_sqlite_rows(tablename, rows, configuration):
+    if configuration.sqliteAppend:
+        delete_sqlite_rows_if_needed(configuration)
+
+    # batching mode: the rows are accumulated in the configuration and written
+    # with executemany, one transaction every configuration.sqliteBatchSize rows
+    if configuration.sqliteBatchSize > 1:
+        pending_rows = configuration.sqliteRows.setdefault(tablename, [])
+        pending_rows.extend(rows)
+        if len(pending_rows) >= configuration.sqliteBatchSize:
+            flush_sqlite_batch(tablename, configuration)
+    else:
+        configuration.sqlitedb.executemany(configuration.sqliteInserts[tablename], rows)
+        commit_sqlite(configuration)
+
+def flush_sqlite_batch(tablename, configuration):
+    rows = configuration.sqliteRows.get(tablename)
+    if not rows:
+        return
+    configuration.sqlitedb.executemany(configuration.sqliteInserts[tablename], rows)
+    commit_sqlite(configuration)
+    rows.clear()
+
+# append mode: the first time a (system, variation, run) is published, its existing rows are deleted from all tables.
+# The deletion and the new rows are committed together, in one transaction, by close_sqlite_file (also called at exit).
+def delete_sqlite_rows_if_needed(configuration):
+    key = (configuration.system, configuration.variation, configuration.runno)
+    if key in configuration.sqliteReplaced:
+        return
+    for tablename in configuration.sqliteColumns:
+        configuration.sqlitedb.execute("DELETE FROM {} WHERE system = ? and variation = ? and run = ?".format(tablename), key)
+    configuration.sqliteReplaced.add(key)
+
+def commit_sqlite(configuration):
+    if not configuration.sqliteAppend:
+        configuration.sqlitedb.commit()
+
+def apply_sqlite_settings(sqlitedb, settings):
+    for pragma, value in settings:
+        sqlitedb.execute("PRAGMA {} = {}".format(pragma, value)).fetchall()
+
+def apply_sqlite_profile(sqlitedb, profile):
+    if profile not in SQLITE_PROFILES:
+        sys.exit(' Error: SQLITE profile {} not available. Choices are: {}'.format(profile, list(SQLITE_PROFILES)))
+    apply_sqlite_settings(sqlitedb, SQLITE_PROFILES[profile])
+
+# at the end of a build with a profile: restore the durable settings, update the statistics
+# used by the query planner and rebuild the file with the new page size and without free pages
+def restore_sqlite_durability(sqlitedb):
+    sqlitedb.commit()
+    apply_sqlite_settings(sqlitedb, SQLITE_DURABLE_SETTINGS)
+    sqlitedb.execute("ANALYZE")
+    sqlitedb.commit()
+    sqlitedb.execute("VACUUM")
+
+# copy an existing database file into the (in memory) sqlitedb
+def load_sqlite_database(sqlitedb_file, sqlitedb):
+    source = sqlite3.connect(sqlitedb_file)
+    source.backup(sqlitedb)
+    source.close()
+
+# write sqlitedb to sqlitedb_file with the sqlite backup API. The copy is made to a temporary file
+# in the same directory that then replaces sqlitedb_file, so readers never see a partially written database
+def backup_sqlite_database(sqlitedb, sqlitedb_file):
+    temporary_file = sqlitedb_file + ".tmp"
+    if os.path.exists(temporary_file):
+        os.remove(temporary_file)
+    destination = sqlite3.connect(temporary_file)
+    sqlitedb.backup(destination)
+    destination.close()
+    os.replace(temporary_file, sqlitedb_file)
+
+def flush_sqlite_batches(configuration):
+    for tablename in configuration.sqliteRows:
+        flush_sqlite_batch(tablename, configuration)
+
+
+# the values are bound to the INSERT parameters, in the order of the cached table columns
+def form_tuple_with_column_values(tablename, gobject, configuration) -> tuple:
+    values = [configuration.system, configuration.variation, configuration.runno]
+    for field in configuration.sqliteColumns[tablename][3:]:
+        values.append(getattr(gobject, field))
+    return tuple(values)
 
 
 if __name__ == "__main__":